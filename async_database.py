@@ -0,0 +1,332 @@
+"""
+Async storage layer over database.py.
+Every call is queued to the dedicated DB worker thread of the chat's shard, so slow
+SQLite I/O never blocks the aiogram event loop and writes to each file stay serialized.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import context_buffer
+import database
+import profile_cache
+from metrics import register_gauge, track_stage
+from config import HISTORY_WRITE_BEHIND, HISTORY_FLUSH_INTERVAL_MS, HISTORY_FLUSH_MAX_ROWS, MAX_CONTEXT_MESSAGES, DB_SHARDS
+
+# One worker per shard = one writer per SQLite file; chats on different shards commit in parallel
+_db_executors = [
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-worker-{shard}") for shard in range(DB_SHARDS)
+]
+
+# Write-behind state for conversation history (only used while the history writer runs)
+_pending_history = []
+# id() of queued rows whose write is on a shard worker; they stay queued until it commits
+_flushing_rows = set()
+_history_flush_requested = None
+_history_writer_task = None
+_history_writer_stopping = False
+# user_id -> times the chat's history was deleted, so background work started earlier can tell
+_history_resets = {}
+history_write_stats = {
+    "flushes": 0,
+    "rows_flushed": 0,
+    "max_flush_rows": 0,
+    "total_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+}
+
+
+def submit_db(shard: int, func, *args, **kwargs) -> asyncio.Future:
+    """Queues a synchronous database call on a shard's worker right away and returns a future for its result."""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_db_executors[shard], functools.partial(func, *args, **kwargs))
+
+
+async def run_db_on_shard(shard: int, func, *args, **kwargs):
+    """Runs a synchronous database function on a shard's worker thread and awaits its result."""
+    with track_stage("db"):
+        return await submit_db(shard, func, *args, **kwargs)
+
+
+async def run_db(func, *args, **kwargs):
+    """Runs a synchronous database function on the first shard's worker thread and awaits its result."""
+    return await run_db_on_shard(0, func, *args, **kwargs)
+
+
+async def run_user_db(user_id: int, func, *args, **kwargs):
+    """Runs func(user_id, ...) on the worker thread that owns the user's shard."""
+    return await run_db_on_shard(database.get_shard_index(user_id), func, user_id, *args, **kwargs)
+
+
+def _get_db_queue_depths() -> list:
+    # Calls waiting for each shard's worker (ThreadPoolExecutor keeps them in _work_queue)
+    return [({"shard": shard}, executor._work_queue.qsize()) for shard, executor in enumerate(_db_executors)]
+
+
+register_gauge("recipe_bot_db_queue_depth", "Database calls waiting for their shard's worker", _get_db_queue_depths)
+register_gauge("recipe_bot_history_pending_rows", "History rows queued for the next group commit", lambda: [({}, len(_pending_history))])
+
+
+def shutdown_db_executor():
+    """Waits for queued database work to finish, stops the DB worker threads and closes connections."""
+    for executor in _db_executors:
+        executor.shutdown(wait=True)
+    database.close_db_connections()
+    logging.info(
+        f"Database worker stopped. Profile cache stats: {profile_cache.get_profile_cache_stats()} "
+        f"context buffer stats: {context_buffer.get_context_buffer_stats()}"
+    )
+
+
+async def init_db():
+    """Async version of database.init_db."""
+    return await run_db(database.init_db)
+
+
+async def get_user_profile(user_id: int) -> dict | None:
+    """Async version of database.get_user_profile, served from the profile cache when possible."""
+    profile = profile_cache.get_cached_profile(user_id)
+    if profile is not None:
+        return profile
+
+    profile = await run_user_db(user_id, database.get_user_profile)
+    if profile is not None:
+        profile_cache.cache_profile(user_id, profile)
+    return profile
+
+
+async def create_user_profile(user_id: int):
+    """Async version of database.create_user_profile."""
+    profile_cache.invalidate_profile(user_id)
+    return await run_user_db(user_id, database.create_user_profile)
+
+
+async def update_user_preferences(user_id: int, preferences: dict):
+    """Async version of database.update_user_preferences."""
+    await run_user_db(user_id, database.update_user_preferences, preferences)
+    profile_cache.merge_cached_preferences(user_id, preferences)
+
+
+async def find_users_by_preference(key: str, value: str) -> list[int]:
+    """Queries every shard on its own worker in parallel and returns the matching user ids in ascending order."""
+    shard_results = await asyncio.gather(*(
+        run_db_on_shard(shard, database.find_users_by_preference, key, value, shard) for shard in range(DB_SHARDS)
+    ))
+    return sorted(user_id for user_ids in shard_results for user_id in user_ids)
+
+
+async def update_journey_stage(user_id: int, journey_stage: str):
+    """Async version of database.update_journey_stage."""
+    await run_user_db(user_id, database.update_journey_stage, journey_stage)
+    profile_cache.update_cached_profile(user_id, journey_stage=journey_stage)
+
+
+async def increment_interaction_count(user_id: int) -> int | None:
+    """Async version of database.increment_interaction_count."""
+    new_count = await run_user_db(user_id, database.increment_interaction_count)
+    if new_count is None:
+        profile_cache.invalidate_profile(user_id)
+    else:
+        profile_cache.update_cached_profile(user_id, interaction_count=new_count)
+    return new_count
+
+
+async def reset_interaction_count(user_id: int):
+    """Async version of database.reset_interaction_count."""
+    await run_user_db(user_id, database.reset_interaction_count)
+    profile_cache.update_cached_profile(user_id, interaction_count=0)
+
+
+async def delete_user_profile(user_id: int):
+    """Async version of database.delete_user_profile."""
+    profile_cache.invalidate_profile(user_id)
+    await run_user_db(user_id, database.delete_user_profile)
+
+
+async def add_message_to_history(user_id: int, role: str, content: str):
+    """
+    Async version of database.add_message_to_history.
+    With the history writer running, the row is queued and committed by the next group flush.
+    """
+    context_buffer.append_message(user_id, role, content)
+    if _history_writer_task is None:
+        return await run_user_db(user_id, database.add_message_to_history, role, content)
+
+    now = datetime.now(timezone.utc).isoformat()
+    _pending_history.append((user_id, role, content, now))
+    if len(_pending_history) >= HISTORY_FLUSH_MAX_ROWS:
+        _history_flush_requested.set()
+
+
+async def get_conversation_history(user_id: int, limit: int) -> list[dict]:
+    """
+    Async version of database.get_conversation_history.
+    Served from the chat's in-memory context buffer when it is hydrated; otherwise read from the DB.
+    Rows still waiting in the write-behind queue are appended, so a chat always reads its own writes.
+    """
+    history = context_buffer.get_buffered_context(user_id, limit)
+    if history is not None:
+        return history
+
+    fetch_limit = max(limit, MAX_CONTEXT_MESSAGES)
+    generation = context_buffer.begin_hydration(user_id)
+    # Snapshot queued rows before submitting the read: a flush taking them later is queued behind
+    # this read on the same FIFO worker, so the read cannot see them yet. Rows already being
+    # flushed are ahead of the read on that worker and come back from the DB.
+    pending = [
+        {"role": row[1], "content": row[2]} for row in _pending_history
+        if row[0] == user_id and id(row) not in _flushing_rows
+    ]
+    history = None
+    try:
+        history = await run_user_db(user_id, database.get_conversation_history, fetch_limit)
+        if pending:
+            history = (history + pending)[-fetch_limit:]
+    finally:
+        context_buffer.finish_hydration(user_id, generation, history)
+    return history[-limit:] if limit < len(history) else history
+
+
+def get_history_reset_count(user_id: int) -> int:
+    """How often the chat's history has been deleted since startup."""
+    return _history_resets.get(user_id, 0)
+
+
+async def delete_conversation_history(user_id: int):
+    """Async version of database.delete_conversation_history; also drops the chat's queued and buffered rows."""
+    _history_resets[user_id] = get_history_reset_count(user_id) + 1
+    _pending_history[:] = [row for row in _pending_history if row[0] != user_id]
+    context_buffer.clear_chat(user_id)
+    return await run_user_db(user_id, database.delete_conversation_history)
+
+
+async def get_conversation_summary(user_id: int) -> dict | None:
+    """Async version of database.get_conversation_summary."""
+    return await run_user_db(user_id, database.get_conversation_summary)
+
+
+async def save_conversation_summary(user_id: int, summary: str, last_folded_hash: str, reset_count: int | None = None):
+    """
+    Async version of database.save_conversation_summary.
+    With `reset_count`, the save is skipped if the chat's history was deleted since that count was read.
+    """
+    if reset_count is not None and reset_count != get_history_reset_count(user_id):
+        logging.info(f"Skipped saving a summary for user {user_id}: history was deleted while it was built")
+        return
+    return await run_user_db(user_id, database.save_conversation_summary, summary, last_folded_hash)
+
+
+async def save_vision_cache_entry(file_unique_id: str, phash: str, ingredients: list[str]):
+    """Async version of database.save_vision_cache_entry."""
+    return await run_db(database.save_vision_cache_entry, file_unique_id, phash, ingredients)
+
+
+async def load_vision_cache_entries(limit: int) -> list[dict]:
+    """Async version of database.load_vision_cache_entries."""
+    return await run_db(database.load_vision_cache_entries, limit)
+
+
+# --- Write-behind history queue ---
+
+def _finish_flush(batches_by_shard: dict, results: list):
+    """Drops the rows of every shard write that committed from the queue; failed ones stay for the next flush."""
+    committed = set()
+    for (shard, shard_batch), result in zip(batches_by_shard.items(), results):
+        batch_ids = {id(row) for row in shard_batch}
+        _flushing_rows.difference_update(batch_ids)
+        if isinstance(result, BaseException):
+            logging.error(f"History flush to shard {shard} failed, keeping {len(shard_batch)} rows queued: {result}")
+        else:
+            committed |= batch_ids
+    if committed:
+        _pending_history[:] = [row for row in _pending_history if id(row) not in committed]
+
+
+async def flush_history():
+    """
+    Commits all queued history rows in one transaction per shard and records flush stats.
+    Rows leave the queue only once their shard's write has committed. The writes are shielded,
+    so cancelling a flush never cancels work already handed to a DB worker.
+    """
+    batch = [row for row in _pending_history if id(row) not in _flushing_rows]
+    if not batch:
+        return
+
+    start_time = time.perf_counter()
+    batches_by_shard = {}
+    for row in batch:
+        batches_by_shard.setdefault(database.get_shard_index(row[0]), []).append(row)
+        _flushing_rows.add(id(row))
+    # Submitted synchronously to the same FIFO workers as reads, so any later read already sees these rows
+    futures = [
+        submit_db(shard, database.add_messages_to_history, shard_batch, shard)
+        for shard, shard_batch in batches_by_shard.items()
+    ]
+    writes = asyncio.gather(*futures, return_exceptions=True)
+    writes.add_done_callback(lambda writes: _finish_flush(batches_by_shard, writes.result()))
+    results = await asyncio.shield(writes)
+    flush_ms = (time.perf_counter() - start_time) * 1000
+    rows_flushed = sum(
+        len(shard_batch) for shard_batch, result in zip(batches_by_shard.values(), results)
+        if not isinstance(result, BaseException)
+    )
+
+    history_write_stats["flushes"] += 1
+    history_write_stats["rows_flushed"] += rows_flushed
+    history_write_stats["max_flush_rows"] = max(history_write_stats["max_flush_rows"], rows_flushed)
+    history_write_stats["total_flush_ms"] += flush_ms
+    history_write_stats["max_flush_ms"] = max(history_write_stats["max_flush_ms"], flush_ms)
+    logging.debug(f"HISTORY_FLUSH rows={rows_flushed} time={flush_ms:.1f}ms")
+
+
+async def _history_writer_loop():
+    """
+    Flushes the history queue every HISTORY_FLUSH_INTERVAL_MS or as soon as it holds HISTORY_FLUSH_MAX_ROWS.
+    Returns after the flush that follows a stop request.
+    """
+    while True:
+        try:
+            await asyncio.wait_for(_history_flush_requested.wait(), timeout=HISTORY_FLUSH_INTERVAL_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        _history_flush_requested.clear()
+        try:
+            await flush_history()
+        except Exception as e:
+            logging.error(f"History flush failed: {e}")
+        if _history_writer_stopping:
+            return
+
+
+def start_history_writer():
+    """Starts the write-behind history writer if HISTORY_WRITE_BEHIND is enabled."""
+    global _history_writer_task, _history_flush_requested, _history_writer_stopping
+    if not HISTORY_WRITE_BEHIND or _history_writer_task is not None:
+        return
+    _history_writer_stopping = False
+    _history_flush_requested = asyncio.Event()
+    _history_writer_task = asyncio.create_task(_history_writer_loop())
+    logging.info(
+        f"History write-behind enabled: flush every {HISTORY_FLUSH_INTERVAL_MS}ms or {HISTORY_FLUSH_MAX_ROWS} rows."
+    )
+
+
+async def stop_history_writer():
+    """
+    Stops the history writer and flushes whatever is still queued.
+    The writer is asked to finish rather than cancelled, so a flush in progress completes.
+    """
+    global _history_writer_task, _history_writer_stopping
+    if _history_writer_task is None:
+        return
+    _history_writer_stopping = True
+    _history_flush_requested.set()
+    await _history_writer_task
+    _history_writer_task = None
+    await flush_history()
+    if _pending_history:
+        logging.error(f"History writer stopped with {len(_pending_history)} rows that could not be written")
+    logging.info(f"History writer stopped. Stats: {history_write_stats}")
@@ -1,24 +1,131 @@
+import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-import openai
-from config import OPENAI_API_KEY, OPENROUTER_AUDIO_MODEL
+from config import (
+    OPENROUTER_AUDIO_MODEL,
+    AUDIO_PREPROCESSING,
+    AUDIO_SAMPLE_RATE,
+    AUDIO_BITRATE,
+    AUDIO_SILENCE_THRESHOLD_DBFS,
+    AUDIO_WORKERS,
+)
+from resilience import call_with_fallback
+from metrics import inc_counter, track_stage
+from http_clients import get_client
+
+try:
+    from pydub import AudioSegment
+    from pydub.silence import detect_leading_silence
+    from pydub.utils import which
+    # pydub decodes and encodes through ffmpeg
+    AUDIO_PREPROCESSING_AVAILABLE = which("ffmpeg") is not None
+except ImportError:
+    # On Python 3.13+ pydub also needs the audioop-lts package
+    AUDIO_PREPROCESSING_AVAILABLE = False
+
+# Kept around trimmed speech so soft word onsets and endings are not cut off
+SILENCE_PADDING_MS = 200
+
+# ffmpeg runs as a subprocess, so worker threads do not hold the GIL while it works
+_audio_executor = ThreadPoolExecutor(max_workers=AUDIO_WORKERS, thread_name_prefix="audio-worker")
+_audio_state = {"unavailable_logged": False}
+
+
+def trim_silence(sound: "AudioSegment") -> "AudioSegment | None":
+    """
+    Downmixes to mono, resamples to AUDIO_SAMPLE_RATE and trims leading and trailing silence.
+    Returns None if the whole recording is below AUDIO_SILENCE_THRESHOLD_DBFS.
+    """
+    sound = sound.set_channels(1).set_frame_rate(AUDIO_SAMPLE_RATE)
+    leading = detect_leading_silence(sound, silence_threshold=AUDIO_SILENCE_THRESHOLD_DBFS)
+    if leading >= len(sound):
+        return None
+    trailing = detect_leading_silence(sound.reverse(), silence_threshold=AUDIO_SILENCE_THRESHOLD_DBFS)
+    return sound[max(0, leading - SILENCE_PADDING_MS):len(sound) - max(0, trailing - SILENCE_PADDING_MS)]
+
+
+def prepare_audio(audio_bytes: bytes) -> tuple[bytes | None, float, float, float]:
+    """
+    Decodes a voice message, trims it and re-encodes it as low-bitrate Opus for Whisper.
+    Runs on a worker thread. Returns (encoded bytes or None if silent, input seconds,
+    output seconds, CPU milliseconds spent by this thread).
+    """
+    start_cpu = time.thread_time()
+    sound = AudioSegment.from_file(BytesIO(audio_bytes))
+    trimmed = trim_silence(sound)
+    if trimmed is None:
+        return None, sound.duration_seconds, 0.0, (time.thread_time() - start_cpu) * 1000
+
+    buffered = BytesIO()
+    trimmed.export(buffered, format="ogg", codec="libopus", bitrate=AUDIO_BITRATE, parameters=["-application", "voip"])
+    return buffered.getvalue(), sound.duration_seconds, trimmed.duration_seconds, (time.thread_time() - start_cpu) * 1000
+
+
+def shutdown_audio_executor():
+    _audio_executor.shutdown(wait=True)
+
+
+async def preprocess_audio(chat_id: int, audio_bytes: bytes) -> bytes | None:
+    """
+    Runs prepare_audio off the event loop and records the savings.
+    Returns the bytes to upload, or None if the message is silent.
+    Falls back to the original bytes when preprocessing is disabled, unavailable or fails.
+    """
+    if not AUDIO_PREPROCESSING:
+        return audio_bytes
+    if not AUDIO_PREPROCESSING_AVAILABLE:
+        if not _audio_state["unavailable_logged"]:
+            logging.warning("Audio preprocessing needs pydub and ffmpeg; uploading voice messages as-is")
+            _audio_state["unavailable_logged"] = True
+        return audio_bytes
+
+    try:
+        with track_stage("audio_prepare"):
+            encoded_audio, input_seconds, output_seconds, cpu_ms = await asyncio.get_running_loop().run_in_executor(
+                _audio_executor, prepare_audio, audio_bytes
+            )
+    except Exception as e:
+        logging.error(f"Audio preprocessing failed for chat_id={chat_id}, uploading original: {e}")
+        return audio_bytes
+
+    upload_bytes = len(encoded_audio) if encoded_audio else 0
+    inc_counter("recipe_bot_voice_messages_total", "Voice messages preprocessed before transcription")
+    inc_counter("recipe_bot_voice_input_bytes_total", "Voice bytes downloaded from Telegram", len(audio_bytes))
+    inc_counter("recipe_bot_whisper_upload_bytes_total", "Encoded audio bytes sent for transcription", upload_bytes)
+    inc_counter("recipe_bot_voice_input_seconds_total", "Seconds of audio in received voice messages", input_seconds)
+    inc_counter("recipe_bot_whisper_audio_seconds_total", "Seconds of audio sent for transcription", output_seconds)
+    logging.info(
+        f"AUDIO_PREPARED chat_id={chat_id} input_bytes={len(audio_bytes)} upload_bytes={upload_bytes} "
+        f"input_seconds={input_seconds:.2f} upload_seconds={output_seconds:.2f} cpu_ms={cpu_ms:.1f}"
+    )
+    if encoded_audio is None:
+        inc_counter("recipe_bot_voice_silent_skipped_total", "Silent voice messages not sent for transcription")
+    return encoded_audio
 
-# Use the official OpenAI client for transcription
-client = openai.AsyncClient(api_key=OPENAI_API_KEY)
 
 async def transcribe_audio_message(chat_id: int, audio_data: BytesIO) -> str:
     """
     Transcribes an audio message using the official OpenAI Whisper API.
+    The recording is preprocessed first; entirely silent messages never reach the API.
     """
     try:
-        # Set the filename for the API, required for some audio formats
-        audio_data.name = "voice_message.ogg"
-
-        response = await client.audio.transcriptions.create(
-            model=OPENROUTER_AUDIO_MODEL,
-            file=audio_data
-        )
-        
+        upload = await preprocess_audio(chat_id, audio_data.getvalue())
+        if upload is None:
+            logging.info(f"Skipped transcription of silent voice message for chat_id={chat_id}")
+            return "Error: Your voice message seems to be silent. Please try recording it again."
+
+        # Pass (filename, bytes) so retried and hedged attempts each upload the whole file;
+        # the filename is required for some audio formats
+        audio_file = ("voice_message.ogg", upload)
+
+        with track_stage("whisper"):
+            response, _ = await call_with_fallback("openai", [OPENROUTER_AUDIO_MODEL], lambda model: get_client("openai").audio.transcriptions.create(
+                model=model,
+                file=audio_file
+            ), kind="transcription")
+
         transcribed_text = response.text
         logging.info(f"Successfully transcribed audio for chat_id={chat_id}: '{transcribed_text}'")
         return transcribed_text
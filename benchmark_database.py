@@ -0,0 +1,251 @@
+"""
+Scale benchmark for database.py.
+Generates synthetic users and history in temporary SQLite files, then drives every public
+data-access function through the async DB workers with concurrent callers and records
+ops/s and p50/p99 latency. Results are written as JSON so runs can be compared across commits.
+
+    python benchmark_database.py --users 1000000 --messages-per-user 50 --output bench.json
+    python benchmark_database.py --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import async_database
+import database
+from async_database import run_db, run_db_on_shard, run_user_db
+from config import DB_SHARDS, MAX_CONTEXT_MESSAGES, VISION_CACHE_SIZE
+
+GENERATE_BATCH_SIZE = 50000
+ROLES = ["user", "assistant"]
+SAMPLE_PREFERENCES = [
+    {"likes": ["spicy food"], "allergies": ["peanuts"]},
+    {"dislikes": ["celery"], "goals": ["quick dinner"]},
+    {"allergies": ["shellfish"], "cuisines": ["thai", "mexican"]},
+]
+SAMPLE_MESSAGE = "I have chicken, chocolate and a strong sense of adventure. " * 4
+
+# Own logger so per-call INFO logs from database.py can be silenced during the run
+logger = logging.getLogger("benchmark")
+
+
+def generate_dataset(users: int, messages_per_user: int):
+    """Bulk-loads synthetic profiles and history straight into every shard."""
+    start_time = time.perf_counter()
+    now = "2025-01-01T00:00:00+00:00"
+    profile_batches = {shard: [] for shard in range(DB_SHARDS)}
+    history_batches = {shard: [] for shard in range(DB_SHARDS)}
+
+    def flush(force: bool = False):
+        for shard in range(DB_SHARDS):
+            if profile_batches[shard] and (force or len(profile_batches[shard]) >= GENERATE_BATCH_SIZE):
+                with database.get_db_connection(shard=shard) as conn:
+                    conn.executemany(
+                        "INSERT INTO user_profiles (user_id, journey_stage, preferences, interaction_count, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        profile_batches[shard]
+                    )
+                profile_batches[shard].clear()
+            if history_batches[shard] and (force or len(history_batches[shard]) >= GENERATE_BATCH_SIZE):
+                database.add_messages_to_history(history_batches[shard], shard)
+                history_batches[shard].clear()
+
+    # Interleave users so history ids are spread like real traffic rather than clustered per user
+    for user_id in range(1, users + 1):
+        shard = database.get_shard_index(user_id)
+        preferences = json.dumps(SAMPLE_PREFERENCES[user_id % len(SAMPLE_PREFERENCES)])
+        profile_batches[shard].append((user_id, "familiar", preferences, user_id % 30, now, now))
+        flush()
+    for message_index in range(messages_per_user):
+        for user_id in range(1, users + 1):
+            shard = database.get_shard_index(user_id)
+            history_batches[shard].append((user_id, ROLES[message_index % 2], SAMPLE_MESSAGE, now))
+        flush()
+    flush(force=True)
+
+    rows = users * messages_per_user
+    logger.info(f"Generated {users} users and {rows} history rows in {time.perf_counter() - start_time:.1f}s")
+
+
+def build_operations(users: int) -> dict:
+    """Maps each public data-access function of database.py (not connection or schema setup) to a coroutine factory exercising it once."""
+    next_new_user = [users + 1]
+
+    def random_user() -> int:
+        return random.randint(1, users)
+
+    def new_user() -> int:
+        next_new_user[0] += 1
+        return next_new_user[0]
+
+    def history_batch():
+        user_id = random_user()
+        shard = database.get_shard_index(user_id)
+        rows = [(user_id, "user", SAMPLE_MESSAGE, "2025-01-01T00:00:00+00:00")] * 10
+        return run_db_on_shard(shard, database.add_messages_to_history, rows, shard)
+
+    def on_random_shard(func, *args):
+        shard = random.randrange(DB_SHARDS)
+        return run_db_on_shard(shard, func, *args, shard)
+
+    # Destructive operations come last, so earlier ones see the full dataset
+    return {
+        "get_user_profile": lambda: run_user_db(random_user(), database.get_user_profile),
+        "create_user_profile": lambda: run_user_db(new_user(), database.create_user_profile),
+        "update_user_preferences": lambda: run_user_db(random_user(), database.update_user_preferences, {"likes": ["sushi"]}),
+        "update_journey_stage": lambda: run_user_db(random_user(), database.update_journey_stage, "health_focused"),
+        "increment_interaction_count": lambda: run_user_db(random_user(), database.increment_interaction_count),
+        "reset_interaction_count": lambda: run_user_db(random_user(), database.reset_interaction_count),
+        "add_message_to_history": lambda: run_user_db(random_user(), database.add_message_to_history, "user", SAMPLE_MESSAGE),
+        "add_messages_to_history": history_batch,
+        "get_conversation_history": lambda: run_user_db(random_user(), database.get_conversation_history, MAX_CONTEXT_MESSAGES),
+        "save_conversation_summary": lambda: run_user_db(
+            random_user(), database.save_conversation_summary, SAMPLE_MESSAGE, "0123456789abcdef"
+        ),
+        "get_conversation_summary": lambda: run_user_db(random_user(), database.get_conversation_summary),
+        "save_vision_cache_entry": lambda: run_db(
+            database.save_vision_cache_entry, f"file-{random_user()}", f"{random_user():016x}", ["chicken", "chocolate"]
+        ),
+        "load_vision_cache_entries": lambda: run_db(database.load_vision_cache_entries, VISION_CACHE_SIZE),
+        "find_users_by_preference": lambda: on_random_shard(database.find_users_by_preference, "allergies", "peanuts"),
+        "get_users_over_history_limit": lambda: on_random_shard(
+            database.get_users_over_history_limit, random_user(), MAX_CONTEXT_MESSAGES, 500
+        ),
+        "prune_user_history": lambda: run_user_db(random_user(), database.prune_user_history, MAX_CONTEXT_MESSAGES, 500),
+        "compact_database": lambda: on_random_shard(database.compact_database, 100),
+        "delete_conversation_history": lambda: run_user_db(random_user(), database.delete_conversation_history),
+        "delete_user_profile": lambda: run_user_db(random_user(), database.delete_user_profile),
+    }
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def measure(operation, ops: int, concurrency: int) -> dict:
+    """Runs `ops` calls of an operation from `concurrency` concurrent callers and summarizes latency."""
+    latencies = []
+    remaining = [ops]
+
+    async def caller():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start_time = time.perf_counter()
+            await operation()
+            latencies.append((time.perf_counter() - start_time) * 1000)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+    }
+
+
+async def run_benchmark(users: int, ops: int, slow_ops: int, concurrency: int, only: list[str] | None) -> dict:
+    """Benchmarks every selected operation in turn; full-scan operations run `slow_ops` times."""
+    operations = build_operations(users)
+    slow_operations = {
+        "find_users_by_preference", "get_users_over_history_limit", "load_vision_cache_entries", "compact_database"
+    }
+    results = {}
+    for name, operation in operations.items():
+        if only and name not in only:
+            continue
+        count = slow_ops if name in slow_operations else ops
+        results[name] = await measure(operation, count, concurrency)
+        logger.info(
+            f"{name}: {results[name]['ops_per_sec']:.0f} ops/s "
+            f"p50={results[name]['p50_ms']:.2f}ms p99={results[name]['p99_ms']:.2f}ms"
+        )
+    return results
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_results(baseline_path: str, results: dict):
+    """Prints ops/s and p99 ratios of this run against a previous results file."""
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"Compared with {baseline.get('commit')} ({baseline_path}):")
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        throughput = current["ops_per_sec"] / previous["ops_per_sec"] if previous["ops_per_sec"] else float("inf")
+        p99 = current["p99_ms"] / previous["p99_ms"] if previous["p99_ms"] else float("inf")
+        print(f"  {name:28} ops/s x{throughput:5.2f}   p99 x{p99:5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark database.py against synthetic data in temporary files.")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages-per-user", type=int, default=20)
+    parser.add_argument("--ops", type=int, default=2000, help="Calls per operation")
+    parser.add_argument("--slow-ops", type=int, default=20, help="Calls for full-scan operations")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent async callers")
+    parser.add_argument("--only", nargs="*", help="Benchmark only these functions")
+    parser.add_argument("--output", help="Write JSON results to this path")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="recipe-bot-bench-") as tmp_dir:
+        database.DB_NAME = os.path.join(tmp_dir, "bench.db")
+        database.init_db()
+        generate_dataset(args.users, args.messages_per_user)
+        results = asyncio.run(run_benchmark(args.users, args.ops, args.slow_ops, args.concurrency, args.only))
+        async_database.shutdown_db_executor()
+
+    report = {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            "users": args.users,
+            "messages_per_user": args.messages_per_user,
+            "ops": args.ops,
+            "slow_ops": args.slow_ops,
+            "concurrency": args.concurrency,
+            "shards": DB_SHARDS,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
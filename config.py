@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -18,9 +19,85 @@ OPENROUTER_AUDIO_MODEL = os.getenv("OPENROUTER_AUDIO_MODEL", "whisper-1")
 
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.8"))
 LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "10000"))
+LLM_INPUT_TOKEN_BUDGET = int(os.getenv("LLM_INPUT_TOKEN_BUDGET", "6000"))
+LLM_SUMMARY_MAX_TOKENS = int(os.getenv("LLM_SUMMARY_MAX_TOKENS", "300"))
+# Models (by OpenRouter id prefix) that need explicit cache_control markers for prompt caching
+LLM_CACHE_CONTROL_MODEL_PREFIXES = tuple(
+    prefix.strip() for prefix in os.getenv("LLM_CACHE_CONTROL_MODEL_PREFIXES", "anthropic/,google/gemini").split(",") if prefix.strip()
+)
+# Models tried after the primary one, ordered at runtime by observed latency and error rate
+LLM_FALLBACK_MODELS = [model.strip() for model in os.getenv("LLM_FALLBACK_MODELS", "openai/gpt-4o-mini").split(",") if model.strip()]
+VISION_FALLBACK_MODELS = [model.strip() for model in os.getenv("VISION_FALLBACK_MODELS", "").split(",") if model.strip()]
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1.0"))
+
+# Photos sent to the vision model: longest side in pixels, lossy format (JPEG or WEBP) and quality
+VISION_IMAGE_MAX_SIZE = int(os.getenv("VISION_IMAGE_MAX_SIZE", "512"))
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "JPEG").upper()
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+ALBUM_VISION_CONCURRENCY = int(os.getenv("ALBUM_VISION_CONCURRENCY", "4"))
+VISION_CACHE_SIZE = int(os.getenv("VISION_CACHE_SIZE", "5000"))
+VISION_CACHE_MAX_DISTANCE = int(os.getenv("VISION_CACHE_MAX_DISTANCE", "6"))
+VISION_CACHE_PERSIST = os.getenv("VISION_CACHE_PERSIST", "false").lower() == "true"
+
+# Voice messages: silence trimming, mono downmix, resampling and low-bitrate re-encoding before Whisper
+AUDIO_PREPROCESSING = os.getenv("AUDIO_PREPROCESSING", "true").lower() == "true"
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "24k")
+AUDIO_SILENCE_THRESHOLD_DBFS = float(os.getenv("AUDIO_SILENCE_THRESHOLD_DBFS", "-45"))
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "2"))
+
+# Upstream resilience (retries, hedging, circuit breakers)
+UPSTREAM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT_SECONDS", "60"))
+UPSTREAM_DEADLINE_SECONDS = float(os.getenv("UPSTREAM_DEADLINE_SECONDS", "90"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE_MS = int(os.getenv("UPSTREAM_BACKOFF_BASE_MS", "250"))
+UPSTREAM_HEDGING = os.getenv("UPSTREAM_HEDGING", "true").lower() == "true"
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "30"))
+
+# Shared HTTP connection pools for upstream APIs
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# Metrics endpoint (port 0 disables it) and LLM pricing overrides,
+# e.g. {"openai/gpt-4o-mini": {"prompt": 0.15, "completion": 0.6, "cached": 0.075}} in USD per 1M tokens
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+LLM_PRICING = json.loads(os.getenv("LLM_PRICING", "{}"))
+
+# Surprise verification pipeline: candidates generated concurrently per round, rounds, and spend cap per recipe.
+# SURPRISE_MAX_TOKENS bounds each candidate and enhancement; the cap is budgeted against it, so with the
+# default models and pricing about five candidates fit in one round.
+SURPRISE_CANDIDATES = int(os.getenv("SURPRISE_CANDIDATES", "1"))
+SURPRISE_MAX_ROUNDS = int(os.getenv("SURPRISE_MAX_ROUNDS", "3"))
+SURPRISE_COST_CAP_USD = float(os.getenv("SURPRISE_COST_CAP_USD", "0.05"))
+SURPRISE_MAX_TOKENS = int(os.getenv("SURPRISE_MAX_TOKENS", "2000"))
 
 # Bot Behavior
 MAX_CONTEXT_MESSAGES = int(os.getenv("MAX_CONTEXT_MESSAGES", "30"))
+MESSAGE_DEBOUNCE_MS = int(os.getenv("MESSAGE_DEBOUNCE_MS", "800"))
+MEDIA_GROUP_WINDOW_MS = int(os.getenv("MEDIA_GROUP_WINDOW_MS", "500"))
+
+# Storage
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "false").lower() == "true"
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "50"))
+HISTORY_FLUSH_MAX_ROWS = int(os.getenv("HISTORY_FLUSH_MAX_ROWS", "100"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))
+CONTEXT_BUFFER_MAX_MESSAGES = int(os.getenv("CONTEXT_BUFFER_MAX_MESSAGES", "200000"))
+
+# History retention (0 disables pruning)
+HISTORY_RETENTION_MESSAGES = int(os.getenv("HISTORY_RETENTION_MESSAGES", "200"))
+HISTORY_RETENTION_INTERVAL_SECONDS = float(os.getenv("HISTORY_RETENTION_INTERVAL_SECONDS", "3600"))
+HISTORY_RETENTION_BATCH_SIZE = int(os.getenv("HISTORY_RETENTION_BATCH_SIZE", "500"))
+HISTORY_RETENTION_PAUSE_MS = int(os.getenv("HISTORY_RETENTION_PAUSE_MS", "20"))
+HISTORY_RETENTION_ARCHIVE = os.getenv("HISTORY_RETENTION_ARCHIVE", "false").lower() == "true"
 
 # Validate required settings
 required_vars = [TELEGRAM_BOT_TOKEN, OPENROUTER_API_KEY, OPENAI_API_KEY]
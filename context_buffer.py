@@ -0,0 +1,108 @@
+"""
+Per-chat in-memory ring buffers holding the last MAX_CONTEXT_MESSAGES turns.
+SQLite stays the source of truth; buffers are hydrated on a miss and idle chats
+are evicted once the total number of buffered messages exceeds CONTEXT_BUFFER_MAX_MESSAGES.
+"""
+from collections import OrderedDict, deque
+
+from config import MAX_CONTEXT_MESSAGES, CONTEXT_BUFFER_MAX_MESSAGES
+
+# chat_id -> deque of {"role", "content"}; most recently used chats at the end
+_buffers = OrderedDict()
+# chat_id -> {"generation": writes seen while reads were in flight, "readers": hydration reads in flight}
+_hydrating = {}
+context_buffer_stats = {"hits": 0, "misses": 0, "evictions": 0, "buffered_messages": 0}
+
+
+def get_buffered_context(chat_id: int, limit: int) -> list[dict] | None:
+    """Returns the last `limit` buffered messages for a chat, or None if the chat must be hydrated."""
+    buffer = _buffers.get(chat_id)
+    if buffer is None or limit > MAX_CONTEXT_MESSAGES:
+        context_buffer_stats["misses"] += 1
+        return None
+
+    _buffers.move_to_end(chat_id)
+    context_buffer_stats["hits"] += 1
+    messages = list(buffer)
+    return messages[-limit:] if limit < len(messages) else messages
+
+
+def begin_hydration(chat_id: int) -> int:
+    """Marks that a DB read for the chat's context is in flight and returns the chat's write generation."""
+    state = _hydrating.setdefault(chat_id, {"generation": 0, "readers": 0})
+    state["readers"] += 1
+    return state["generation"]
+
+
+def finish_hydration(chat_id: int, generation: int, messages: list[dict] | None):
+    """
+    Stores the hydrated context unless a write landed since this read began (its generation moved on),
+    in which case the next read retries. `messages` is None when the read failed.
+    """
+    state = _hydrating[chat_id]
+    state["readers"] -= 1
+    if not state["readers"]:
+        del _hydrating[chat_id]
+    if messages is None or state["generation"] != generation:
+        return
+    _store_buffer(chat_id, deque(messages, maxlen=MAX_CONTEXT_MESSAGES))
+
+
+def _bump_generation(chat_id: int):
+    state = _hydrating.get(chat_id)
+    if state is not None:
+        state["generation"] += 1
+
+
+def append_message(chat_id: int, role: str, content: str):
+    """Appends a message to the chat's buffer if the chat is buffered."""
+    _bump_generation(chat_id)
+    buffer = _buffers.get(chat_id)
+    if buffer is None:
+        return
+
+    if len(buffer) < buffer.maxlen:
+        context_buffer_stats["buffered_messages"] += 1
+    buffer.append({"role": role, "content": content})
+    _buffers.move_to_end(chat_id)
+    _evict_idle_chats()
+
+
+def clear_chat(chat_id: int):
+    """Marks the chat's context as known-empty after its history was deleted."""
+    _bump_generation(chat_id)
+    _store_buffer(chat_id, deque(maxlen=MAX_CONTEXT_MESSAGES))
+
+
+def drop_chat(chat_id: int):
+    """Forgets the chat's buffer so the next read hydrates it from the database."""
+    buffer = _buffers.pop(chat_id, None)
+    if buffer is not None:
+        context_buffer_stats["buffered_messages"] -= len(buffer)
+
+
+def clear_context_buffers():
+    """Drops every chat buffer."""
+    _buffers.clear()
+    _hydrating.clear()
+    context_buffer_stats["buffered_messages"] = 0
+
+
+def _store_buffer(chat_id: int, buffer: deque):
+    drop_chat(chat_id)
+    _buffers[chat_id] = buffer
+    context_buffer_stats["buffered_messages"] += len(buffer)
+    _evict_idle_chats()
+
+
+def _evict_idle_chats():
+    """Evicts least recently used chats until the global message cap is respected."""
+    while context_buffer_stats["buffered_messages"] > CONTEXT_BUFFER_MAX_MESSAGES and len(_buffers) > 1:
+        _, buffer = _buffers.popitem(last=False)
+        context_buffer_stats["buffered_messages"] -= len(buffer)
+        context_buffer_stats["evictions"] += 1
+
+
+def get_context_buffer_stats() -> dict:
+    """Returns hit/miss/eviction counters plus the number of buffered chats."""
+    return {**context_buffer_stats, "chats": len(_buffers)}
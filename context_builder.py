@@ -0,0 +1,139 @@
+"""
+Token-budget-aware context assembly for LLM calls.
+Keeps the newest turns that fit LLM_INPUT_TOKEN_BUDGET and folds the turns that fall out
+of the window into a rolling per-user summary, updated in the background after the reply.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+from async_database import get_conversation_summary, save_conversation_summary, get_history_reset_count
+from config import LLM_INPUT_TOKEN_BUDGET
+from llm_client import SYSTEM_PROMPT, summarize_conversation
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+TOKEN_COUNT_CACHE_SIZE = 50000
+
+# Digest of a message's text -> its token count; most recently used at the end.
+# Keyed by digest so the cache never holds on to message bodies.
+_token_counts = OrderedDict()
+
+# Keeps background summary tasks referenced until they finish
+_summary_tasks = set()
+_summarizing_chats = set()
+
+
+def count_tokens(text: str) -> int:
+    """Token count of one message, cached per message digest. Uses tiktoken if installed, else ~4 chars per token."""
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    tokens = _token_counts.get(key)
+    if tokens is not None:
+        _token_counts.move_to_end(key)
+        return tokens
+
+    if _encoding is not None:
+        tokens = MESSAGE_OVERHEAD_TOKENS + len(_encoding.encode(text))
+    else:
+        tokens = MESSAGE_OVERHEAD_TOKENS + (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    _token_counts[key] = tokens
+    if len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+        _token_counts.popitem(last=False)
+    return tokens
+
+
+def get_message_fingerprint(message: dict) -> str:
+    """Short stable hash identifying a history message."""
+    return hashlib.sha1(f"{message['role']}\n{message['content']}".encode("utf-8")).hexdigest()[:16]
+
+
+async def build_context(chat_id: int, history: list[dict], preferences: dict | None = None) -> tuple[list[dict], list[dict], dict | None]:
+    """
+    Assembles the messages sent after SYSTEM_PROMPT: the newest history turns that fit the input
+    token budget, with context notes attached at the end. Returns (messages, evicted turns, current summary).
+    """
+    summary = await get_conversation_summary(chat_id)
+    notes = []
+    if summary:
+        notes.append(f"System Note: Summary of the earlier conversation: {summary['summary']}")
+    if preferences:
+        notes.append(f"System Note: User's current preferences are: {json.dumps(preferences)}")
+
+    notes_tokens = sum(count_tokens(note) for note in notes)
+    budget = LLM_INPUT_TOKEN_BUDGET - count_tokens(SYSTEM_PROMPT) - notes_tokens
+
+    kept = []
+    used_tokens = 0
+    for message in reversed(history):
+        message_tokens = count_tokens(message["content"])
+        # The newest message is always sent, even if it alone exceeds the budget
+        if kept and used_tokens + message_tokens > budget:
+            break
+        kept.append(message)
+        used_tokens += message_tokens
+    kept.reverse()
+    evicted = history[:len(history) - len(kept)]
+
+    if evicted:
+        evicted_tokens = sum(count_tokens(message["content"]) for message in evicted)
+        summary_tokens = count_tokens(notes[0]) if summary else 0
+        logging.info(
+            f"CONTEXT_BUDGET chat_id={chat_id} kept={len(kept)} evicted={len(evicted)} "
+            f"tokens={used_tokens + notes_tokens} saved_tokens={evicted_tokens - summary_tokens}"
+        )
+    return attach_context_notes(kept, notes), evicted, summary
+
+
+def attach_context_notes(history: list[dict], notes: list[str]) -> list[dict]:
+    """
+    Places per-turn notes after the history so the prompt prefix stays byte-stable across turns:
+    they are prepended to the newest user message, or sent as a trailing system message.
+    """
+    if not notes:
+        return list(history)
+    notes_text = "\n".join(notes)
+    if history and history[-1]["role"] == "user":
+        return history[:-1] + [{"role": "user", "content": f"{notes_text}\n\n{history[-1]['content']}"}]
+    return history + [{"role": "system", "content": notes_text}]
+
+
+def schedule_summary_update(chat_id: int, evicted: list[dict], summary: dict | None):
+    """Folds evicted turns not yet covered by the summary into it, in a background task."""
+    if not evicted or chat_id in _summarizing_chats:
+        return
+
+    to_fold = evicted
+    if summary and summary.get("last_folded_hash"):
+        fingerprints = [get_message_fingerprint(message) for message in evicted]
+        if summary["last_folded_hash"] in fingerprints:
+            last_folded_index = len(fingerprints) - 1 - fingerprints[::-1].index(summary["last_folded_hash"])
+            to_fold = evicted[last_folded_index + 1:]
+    if not to_fold:
+        return
+
+    _summarizing_chats.add(chat_id)
+    task = asyncio.create_task(
+        _fold_into_summary(chat_id, to_fold, summary["summary"] if summary else "", get_history_reset_count(chat_id))
+    )
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+
+async def _fold_into_summary(chat_id: int, messages: list[dict], previous_summary: str, reset_count: int):
+    """Summarizes and saves; the save is dropped if /start, /reset or a retune deleted the history meanwhile."""
+    try:
+        new_summary = await summarize_conversation(chat_id, previous_summary, messages)
+        if new_summary:
+            await save_conversation_summary(chat_id, new_summary, get_message_fingerprint(messages[-1]), reset_count)
+    except Exception as e:
+        logging.error(f"Failed to update conversation summary for chat_id={chat_id}: {e}")
+    finally:
+        _summarizing_chats.discard(chat_id)
@@ -0,0 +1,162 @@
+"""
+Streaming export/import of user profiles, conversation history and summaries as NDJSON.
+Rows are streamed through cursors and written in batched transactions, so memory
+use stays constant regardless of table size. A `.gz` path is compressed transparently.
+Import refuses a database that already holds data unless --force is given, since history is appended.
+
+    python data_transfer.py export backup.ndjson.gz
+    python data_transfer.py import backup.ndjson.gz
+"""
+import argparse
+import gzip
+import json
+import logging
+import sqlite3
+import time
+
+import database
+from config import DB_SHARDS
+
+IMPORT_BATCH_SIZE = 10000
+PROGRESS_EVERY_ROWS = 100000
+
+# Row ids are not exported: on import each shard assigns its own, and rows are written
+# back in export (id) order, so every chat keeps its message order.
+TABLE_COLUMNS = {
+    "user_profiles": ["user_id", "journey_stage", "preferences", "interaction_count", "created_at", "updated_at"],
+    "conversation_history": ["user_id", "role", "content", "timestamp"],
+    "conversation_summaries": ["user_id", "summary", "last_folded_hash", "updated_at"],
+}
+
+INSERT_SQL = {
+    "user_profiles": "INSERT OR REPLACE INTO user_profiles (user_id, journey_stage, preferences, interaction_count, created_at, updated_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+    "conversation_history": "INSERT INTO conversation_history (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+    "conversation_summaries": "INSERT OR REPLACE INTO conversation_summaries (user_id, summary, last_folded_hash, updated_at) "
+                              "VALUES (?, ?, ?, ?)",
+}
+
+
+def _open_text(path: str, mode: str):
+    """Opens an NDJSON file for text I/O, gzip-compressed when the path ends with .gz."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _log_progress(action: str, rows: int, start_time: float):
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"{action} {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+
+
+def export_data(path: str) -> dict:
+    """
+    Streams every shard's profiles, history and summaries into an NDJSON file, one object per row.
+    Each shard is read inside one read transaction, so its rows come from a single snapshot
+    even while the bot keeps writing.
+    """
+    start_time = time.perf_counter()
+    counts = {table: 0 for table in TABLE_COLUMNS}
+    total = 0
+    with _open_text(path, "w") as output:
+        for shard in range(DB_SHARDS):
+            conn = database.get_db_connection(shard=shard)
+            conn.execute("BEGIN")
+            try:
+                for table, columns in TABLE_COLUMNS.items():
+                    order_by = "id" if table == "conversation_history" else "user_id"
+                    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order_by}")
+                    for row in cursor:
+                        record = dict(zip(columns, row))
+                        record["table"] = table
+                        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        counts[table] += 1
+                        total += 1
+                        if total % PROGRESS_EVERY_ROWS == 0:
+                            _log_progress("Exported", total, start_time)
+            finally:
+                conn.execute("COMMIT")
+    _log_progress("Exported", total, start_time)
+    return counts
+
+
+def _flush_import_batches(batches: dict):
+    """Writes each (table, shard) batch with executemany inside one transaction."""
+    for (table, shard), rows in batches.items():
+        if rows:
+            with database.get_db_connection(shard=shard) as conn:
+                conn.executemany(INSERT_SQL[table], rows)
+            rows.clear()
+
+
+def _target_has_data() -> bool:
+    for shard in range(DB_SHARDS):
+        conn = database.get_db_connection(shard=shard)
+        for table in TABLE_COLUMNS:
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return True
+    return False
+
+
+def import_data(path: str, force: bool = False) -> dict:
+    """
+    Streams an NDJSON export back in, routing rows to their shards in large batched transactions.
+    History rows are appended, so importing twice duplicates conversations: a database that already
+    holds data is refused unless `force` is set.
+    """
+    database.init_db()
+    if not force and _target_has_data():
+        raise ValueError("Target database is not empty; importing again would duplicate history (use --force)")
+    start_time = time.perf_counter()
+    counts = {table: 0 for table in TABLE_COLUMNS}
+    batches = {}
+    pending = 0
+    total = 0
+    with _open_text(path, "r") as source:
+        for line in source:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            table = record.pop("table")
+            if table not in TABLE_COLUMNS:
+                logging.warning(f"Skipping row for unknown table {table}")
+                continue
+            row = tuple(record.get(column) for column in TABLE_COLUMNS[table])
+            shard = database.get_shard_index(row[0])
+            batches.setdefault((table, shard), []).append(row)
+            counts[table] += 1
+            pending += 1
+            total += 1
+            if pending >= IMPORT_BATCH_SIZE:
+                _flush_import_batches(batches)
+                pending = 0
+            if total % PROGRESS_EVERY_ROWS == 0:
+                _log_progress("Imported", total, start_time)
+    _flush_import_batches(batches)
+    _log_progress("Imported", total, start_time)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import bot user data as NDJSON.")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("path", help="NDJSON file; use a .gz suffix for gzip compression")
+    parser.add_argument("--force", action="store_true", help="Import into a database that already holds data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        if args.action == "export":
+            counts = export_data(args.path)
+        else:
+            counts = import_data(args.path, args.force)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        logging.error(f"Data {args.action} failed: {e}")
+        raise SystemExit(1)
+    finally:
+        database.close_db_connections()
+    logging.info(f"Data {args.action} finished: {counts}")
+
+
+if __name__ == "__main__":
+    main()
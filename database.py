@@ -1,55 +1,171 @@
+import os
 import sqlite3
 import json
 import logging
+import zlib
 from datetime import datetime, timezone
-from config import MAX_CONTEXT_MESSAGES
+from config import MAX_CONTEXT_MESSAGES, DB_SHARDS
 
 DB_NAME = "user_data.db"
+DB_CACHED_STATEMENTS = 256
 
-def get_db_connection():
-    """Returns a new database connection."""
-    return sqlite3.connect(DB_NAME)
+# Long-lived connections keyed by database file; access is serialized by the async DB worker(s)
+_connections = {}
 
-def init_db():
-    """Initializes the database and creates tables if they don't exist."""
+def get_shard_index(user_id: int, shard_count: int | None = None) -> int:
+    """Maps a chat_id to its shard with a stable hash."""
+    shard_count = shard_count or DB_SHARDS
+    if shard_count == 1:
+        return 0
+    return zlib.crc32(str(user_id).encode("utf-8")) % shard_count
+
+def get_shard_path(shard: int, shard_count: int | None = None, db_name: str | None = None) -> str:
+    """Returns the database file for a shard; a single shard keeps the plain DB_NAME file."""
+    shard_count = shard_count or DB_SHARDS
+    db_name = db_name or DB_NAME
+    if shard_count == 1 or db_name == ":memory:":
+        return db_name
+    stem, suffix = os.path.splitext(db_name)
+    return f"{stem}.shard{shard}of{shard_count}{suffix}"
+
+def get_db_connection(user_id: int | None = None, shard: int | None = None):
+    """
+    Returns the long-lived, tuned connection for a user's shard (or an explicit shard),
+    opening it on first use. Without either argument, shard 0 is used.
+    """
+    if shard is None:
+        shard = get_shard_index(user_id) if user_id is not None else 0
+    db_path = get_shard_path(shard)
+    conn = _connections.get(db_path)
+    if conn is None:
+        conn = open_db_connection(db_path)
+        _connections[db_path] = conn
+    return conn
+
+def open_db_connection(db_path: str):
+    """Opens a connection with the bot's pragmas. Run before the schema exists so auto_vacuum applies."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+    # Only takes effect on a brand-new file; lets the retention job return freed pages to the OS
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+def close_db_connections():
+    """Closes all long-lived database connections."""
+    for conn in _connections.values():
+        conn.close()
+    _connections.clear()
+
+def _migration_create_tables(cursor):
+    """v1: base user_profiles and conversation_history tables."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY,
+            journey_stage TEXT NOT NULL DEFAULT 'new_user',
+            preferences TEXT,
+            interaction_count INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
+        )
+    """)
+
+def _migration_add_interaction_count(cursor):
+    """v2: interaction_count column for databases created before it existed."""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(user_profiles)")]
+    if "interaction_count" not in columns:
+        cursor.execute("ALTER TABLE user_profiles ADD COLUMN interaction_count INTEGER DEFAULT 0")
+
+def _migration_index_history_by_user(cursor):
+    """v3: index so per-user history reads seek instead of scanning the whole table."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversation_history_user_id_id ON conversation_history (user_id, id)")
+
+def _migration_create_history_archive(cursor):
+    """v4: archive of pruned history, one zlib-compressed JSON batch per row."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_history_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            messages BLOB NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    """)
+
+def _migration_create_conversation_summaries(cursor):
+    """v5: rolling per-user summary of turns that no longer fit the LLM context budget."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_folded_hash TEXT,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+def _migration_create_vision_cache(cursor):
+    """v6: persisted vision results keyed by Telegram file_unique_id, with the photo's perceptual hash."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vision_cache (
+            file_unique_id TEXT PRIMARY KEY,
+            phash TEXT NOT NULL,
+            ingredients TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_vision_cache_created_at ON vision_cache (created_at)")
+
+# Ordered schema migrations; a migration's version is its position in the list (1-based)
+MIGRATIONS = [
+    _migration_create_tables,
+    _migration_add_interaction_count,
+    _migration_index_history_by_user,
+    _migration_create_history_archive,
+    _migration_create_conversation_summaries,
+    _migration_create_vision_cache,
+]
+
+def _apply_migrations(db_conn):
+    """Applies pending schema migrations to one database connection."""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_profiles (
-                    user_id INTEGER PRIMARY KEY,
-                    journey_stage TEXT NOT NULL DEFAULT 'new_user',
-                    preferences TEXT,
-                    interaction_count INTEGER DEFAULT 0,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL
-                )
-            """)
-            # Add interaction_count column if it doesn't exist for backward compatibility
-            try:
-                cursor.execute("ALTER TABLE user_profiles ADD COLUMN interaction_count INTEGER DEFAULT 0")
-            except sqlite3.OperationalError:
-                pass # column already exists
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversation_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    role TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
-                )
-            """)
-            
-            conn.commit()
-            logging.info("Database initialized successfully.")
+        cursor = db_conn.cursor()
+        current_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if version <= current_version:
+                continue
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            db_conn.commit()
+            logging.info(f"Applied database migration v{version}: {migration.__name__}")
+        logging.info("Database initialized successfully.")
     except sqlite3.Error as e:
+        db_conn.rollback()
         logging.error(f"Database initialization failed: {e}")
 
+def init_db(conn=None):
+    """Initializes every shard (or just `conn`) and applies any pending schema migrations."""
+    if conn is not None:
+        _apply_migrations(conn)
+        return
+    for shard in range(DB_SHARDS):
+        _apply_migrations(get_db_connection(shard=shard))
+
 def get_user_profile(user_id: int, conn=None) -> dict | None:
     """Retrieves a user's profile from the database."""
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
@@ -65,113 +181,111 @@ def get_user_profile(user_id: int, conn=None) -> dict | None:
 
 def create_user_profile(user_id: int, conn=None):
     """Creates a new user profile if one doesn't already exist."""
-    if get_user_profile(user_id, conn=conn):
-        logging.info(f"User profile for {user_id} already exists.")
-        return
-
     now = datetime.now(timezone.utc).isoformat()
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
             cursor.execute(
-                "INSERT INTO user_profiles (user_id, preferences, created_at, updated_at, interaction_count) VALUES (?, ?, ?, ?, 0)",
+                "INSERT INTO user_profiles (user_id, preferences, created_at, updated_at, interaction_count) VALUES (?, ?, ?, ?, 0) "
+                "ON CONFLICT(user_id) DO NOTHING",
                 (user_id, json.dumps({}), now, now)
             )
+            if cursor.rowcount == 0:
+                logging.info(f"User profile for {user_id} already exists.")
     except sqlite3.Error as e:
         logging.error(f"Failed to create user profile for {user_id}: {e}")
 
-def _get_or_create_user_profile(user_id: int, conn=None) -> dict | None:
-    """Internal helper to get a user profile, creating one if it doesn't exist."""
-    profile = get_user_profile(user_id, conn=conn)
-    if not profile:
-        create_user_profile(user_id, conn=conn)
-        profile = get_user_profile(user_id, conn=conn)
-    return profile
-
 def update_user_preferences(user_id: int, preferences: dict, conn=None):
-    """Updates a user's preferences."""
-    profile = _get_or_create_user_profile(user_id, conn=conn)
-    if not profile:
-        logging.error(f"Could not get or create profile for user {user_id} to update preferences.")
-        return
-
-    existing_preferences = profile.get('preferences', {})
-    existing_preferences.update(preferences)
-    new_preferences_json = json.dumps(existing_preferences)
+    """
+    Merges preferences into the user's stored preferences in a single statement using JSON1 json_patch
+    (RFC 7396: top-level keys are replaced, nested objects merged, null values remove a key).
+    """
+    preferences_json = json.dumps(preferences)
     now = datetime.now(timezone.utc).isoformat()
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
             cursor.execute(
-                "UPDATE user_profiles SET preferences = ?, updated_at = ? WHERE user_id = ?",
-                (new_preferences_json, now, user_id)
+                "INSERT INTO user_profiles (user_id, preferences, created_at, updated_at, interaction_count) "
+                "VALUES (?, json_patch('{}', ?), ?, ?, 0) "
+                "ON CONFLICT(user_id) DO UPDATE SET "
+                "preferences = json_patch(COALESCE(preferences, '{}'), excluded.preferences), updated_at = excluded.updated_at",
+                (user_id, preferences_json, now, now)
             )
     except sqlite3.Error as e:
         logging.error(f"Failed to update preferences for user {user_id}: {e}")
 
-def update_journey_stage(user_id: int, journey_stage: str, conn=None):
-    """Updates a user's journey stage."""
-    profile = _get_or_create_user_profile(user_id, conn=conn)
-    if not profile:
-        logging.error(f"Could not get or create profile for user {user_id} to update journey stage.")
-        return
+def find_users_by_preference(key: str, value: str, shard: int = 0, conn=None) -> list[int]:
+    """
+    Returns ids of users on a shard whose preference `key` equals `value` or is a list containing it
+    (case-insensitive). Evaluated inside SQLite, so profiles are never deserialized in Python.
+    """
+    json_path = '$."' + key.replace('"', '') + '"'
+    db_conn = conn or get_db_connection(shard=shard)
+    try:
+        cursor = db_conn.execute(
+            "SELECT DISTINCT profile.user_id FROM user_profiles AS profile, json_each(profile.preferences, ?) AS preference "
+            "WHERE lower(preference.value) = lower(?) ORDER BY profile.user_id",
+            (json_path, value)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to find users by preference {key}={value}: {e}")
+        return []
 
+def update_journey_stage(user_id: int, journey_stage: str, conn=None):
+    """Updates a user's journey stage, creating the profile if needed."""
     now = datetime.now(timezone.utc).isoformat()
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
             cursor.execute(
-                "UPDATE user_profiles SET journey_stage = ?, updated_at = ? WHERE user_id = ?",
-                (journey_stage, now, user_id)
+                "INSERT INTO user_profiles (user_id, journey_stage, preferences, created_at, updated_at, interaction_count) VALUES (?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT(user_id) DO UPDATE SET journey_stage = excluded.journey_stage, updated_at = excluded.updated_at",
+                (user_id, journey_stage, json.dumps({}), now, now)
             )
     except sqlite3.Error as e:
         logging.error(f"Failed to update journey stage for user {user_id}: {e}")
 
-def increment_interaction_count(user_id: int, conn=None):
-    """Increments the interaction count for a user."""
-    profile = _get_or_create_user_profile(user_id, conn=conn)
-    if not profile:
-        logging.error(f"Could not get or create profile for user {user_id} to increment interaction count.")
-        return
-
-    new_count = profile.get('interaction_count', 0) + 1
+def increment_interaction_count(user_id: int, conn=None) -> int | None:
+    """Atomically increments the interaction count for a user and returns the new count."""
     now = datetime.now(timezone.utc).isoformat()
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
             cursor.execute(
-                "UPDATE user_profiles SET interaction_count = ?, updated_at = ? WHERE user_id = ?",
-                (new_count, now, user_id)
+                "INSERT INTO user_profiles (user_id, preferences, created_at, updated_at, interaction_count) VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT(user_id) DO UPDATE SET interaction_count = interaction_count + 1, updated_at = excluded.updated_at "
+                "RETURNING interaction_count",
+                (user_id, json.dumps({}), now, now)
             )
+            return cursor.fetchone()[0]
     except sqlite3.Error as e:
         logging.error(f"Failed to increment interaction count for user {user_id}: {e}")
+        return None
 
 def reset_interaction_count(user_id: int, conn=None):
-    """Resets the interaction count for a user."""
-    profile = _get_or_create_user_profile(user_id, conn=conn)
-    if not profile:
-        logging.error(f"Could not get or create profile for user {user_id} to reset interaction count.")
-        return
-
+    """Resets the interaction count for a user, creating the profile if needed."""
     now = datetime.now(timezone.utc).isoformat()
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
             cursor.execute(
-                "UPDATE user_profiles SET interaction_count = 0, updated_at = ? WHERE user_id = ?",
-                (now, user_id)
+                "INSERT INTO user_profiles (user_id, preferences, created_at, updated_at, interaction_count) VALUES (?, ?, ?, ?, 0) "
+                "ON CONFLICT(user_id) DO UPDATE SET interaction_count = 0, updated_at = excluded.updated_at",
+                (user_id, json.dumps({}), now, now)
             )
     except sqlite3.Error as e:
         logging.error(f"Failed to reset interaction count for user {user_id}: {e}")
 
 def delete_user_profile(user_id: int, conn=None):
     """Deletes a user's profile from the database."""
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
@@ -184,7 +298,7 @@ def delete_user_profile(user_id: int, conn=None):
 def add_message_to_history(user_id: int, role: str, content: str, conn=None):
     """Adds a message to the conversation history."""
     now = datetime.now(timezone.utc).isoformat()
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
@@ -195,21 +309,34 @@ def add_message_to_history(user_id: int, role: str, content: str, conn=None):
     except sqlite3.Error as e:
         logging.error(f"Failed to add message to history for user {user_id}: {e}")
 
+def add_messages_to_history(messages: list[tuple], shard: int = 0, conn=None):
+    """Adds a batch of (user_id, role, content, timestamp) rows, all on one shard, to the history in one transaction."""
+    db_conn = conn or get_db_connection(shard=shard)
+    try:
+        with db_conn as conn_context:
+            cursor = conn_context.cursor()
+            cursor.executemany(
+                "INSERT INTO conversation_history (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                messages
+            )
+    except sqlite3.Error as e:
+        logging.error(f"Failed to add {len(messages)} messages to history: {e}")
+
 def get_conversation_history(user_id: int, limit: int, conn=None) -> list[dict]:
     """Retrieves the last N messages for a user, maintaining order."""
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
-            # Fetch the last `limit` messages in ascending order of their timestamp
+            # Fetch the last `limit` messages in insertion order; the monotonic id breaks timestamp ties
             cursor.execute("""
                 SELECT role, content FROM (
-                    SELECT role, content, timestamp 
-                    FROM conversation_history 
-                    WHERE user_id = ? 
-                    ORDER BY timestamp DESC 
+                    SELECT id, role, content
+                    FROM conversation_history
+                    WHERE user_id = ?
+                    ORDER BY id DESC
                     LIMIT ?
-                ) ORDER BY timestamp ASC
+                ) ORDER BY id ASC
             """, (user_id, limit))
             
             history = cursor.fetchall()
@@ -221,11 +348,153 @@ def get_conversation_history(user_id: int, limit: int, conn=None) -> list[dict]:
 
 def delete_conversation_history(user_id: int, conn=None):
     """Deletes the entire conversation history for a user."""
-    db_conn = conn or get_db_connection()
+    db_conn = conn or get_db_connection(user_id)
     try:
         with db_conn as conn_context:
             cursor = conn_context.cursor()
             cursor.execute("DELETE FROM conversation_history WHERE user_id = ?", (user_id,))
+            cursor.execute("DELETE FROM conversation_summaries WHERE user_id = ?", (user_id,))
             logging.info(f"Deleted conversation history for user {user_id}.")
     except sqlite3.Error as e:
         logging.error(f"Failed to delete conversation history for user {user_id}: {e}")
+
+def get_conversation_summary(user_id: int, conn=None) -> dict | None:
+    """Retrieves the rolling summary of a user's older turns."""
+    db_conn = conn or get_db_connection(user_id)
+    try:
+        cursor = db_conn.cursor()
+        cursor.execute("SELECT summary, last_folded_hash FROM conversation_summaries WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        if row:
+            return {"summary": row[0], "last_folded_hash": row[1]}
+        return None
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get conversation summary for user {user_id}: {e}")
+        return None
+
+def save_conversation_summary(user_id: int, summary: str, last_folded_hash: str, conn=None):
+    """Stores the rolling summary of a user's older turns."""
+    now = datetime.now(timezone.utc).isoformat()
+    db_conn = conn or get_db_connection(user_id)
+    try:
+        with db_conn as conn_context:
+            cursor = conn_context.cursor()
+            cursor.execute(
+                "INSERT INTO conversation_summaries (user_id, summary, last_folded_hash, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET summary = excluded.summary, "
+                "last_folded_hash = excluded.last_folded_hash, updated_at = excluded.updated_at",
+                (user_id, summary, last_folded_hash, now)
+            )
+    except sqlite3.Error as e:
+        logging.error(f"Failed to save conversation summary for user {user_id}: {e}")
+
+# --- Retention Functions ---
+
+def get_users_over_history_limit(after_user_id: int | None, keep_last: int, page_size: int, shard: int = 0, conn=None) -> tuple[list[int], int | None]:
+    """
+    Checks the next `page_size` users on a shard that have history, in ascending order, and returns
+    (ids of those with more than `keep_last` rows, last user id checked or None when the shard is done).
+    Each call walks only those users' entries of the (user_id, id) index, so its cost does not grow with the table.
+    """
+    db_conn = conn or get_db_connection(shard=shard)
+    try:
+        cursor = db_conn.cursor()
+        if after_user_id is None:
+            cursor.execute(
+                "SELECT user_id, COUNT(*) > ? FROM conversation_history GROUP BY user_id ORDER BY user_id LIMIT ?",
+                (keep_last, page_size)
+            )
+        else:
+            cursor.execute(
+                "SELECT user_id, COUNT(*) > ? FROM conversation_history WHERE user_id > ? "
+                "GROUP BY user_id ORDER BY user_id LIMIT ?",
+                (keep_last, after_user_id, page_size)
+            )
+        rows = cursor.fetchall()
+        return [user_id for user_id, over_limit in rows if over_limit], (rows[-1][0] if rows else None)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to list users over the history limit: {e}")
+        return [], None
+
+def prune_user_history(user_id: int, keep_last: int, batch_size: int, archive: bool = False, conn=None) -> int:
+    """
+    Deletes up to `batch_size` of the user's oldest messages beyond the newest `keep_last`.
+    With `archive`, the removed rows are first stored compressed in conversation_history_archive.
+    Returns the number of rows removed.
+    """
+    db_conn = conn or get_db_connection(user_id)
+    try:
+        with db_conn as conn_context:
+            cursor = conn_context.cursor()
+            cursor.execute(
+                "SELECT id FROM conversation_history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (user_id, keep_last)
+            )
+            cutoff = cursor.fetchone()
+            if not cutoff:
+                return 0
+
+            cursor.execute(
+                "SELECT id, role, content, timestamp FROM conversation_history WHERE user_id = ? AND id <= ? ORDER BY id LIMIT ?",
+                (user_id, cutoff[0], batch_size)
+            )
+            rows = cursor.fetchall()
+            if archive:
+                payload = zlib.compress(json.dumps(rows).encode("utf-8"))
+                cursor.execute(
+                    "INSERT INTO conversation_history_archive (user_id, first_message_id, last_message_id, message_count, messages, archived_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (user_id, rows[0][0], rows[-1][0], len(rows), payload, datetime.now(timezone.utc).isoformat())
+                )
+            cursor.execute(
+                "DELETE FROM conversation_history WHERE user_id = ? AND id BETWEEN ? AND ?",
+                (user_id, rows[0][0], rows[-1][0])
+            )
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Failed to prune history for user {user_id}: {e}")
+        return 0
+
+def compact_database(vacuum_pages: int, shard: int = 0, conn=None):
+    """Checkpoints a shard's WAL without blocking writers and releases up to `vacuum_pages` free pages."""
+    db_conn = conn or get_db_connection(shard=shard)
+    try:
+        db_conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        db_conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Database compaction failed: {e}")
+
+# --- Vision Cache Functions (global, stored on the first shard) ---
+
+def save_vision_cache_entry(file_unique_id: str, phash: str, ingredients: list[str], conn=None):
+    """Stores the vision result for a photo."""
+    now = datetime.now(timezone.utc).isoformat()
+    db_conn = conn or get_db_connection(shard=0)
+    try:
+        with db_conn as conn_context:
+            conn_context.execute(
+                "INSERT OR REPLACE INTO vision_cache (file_unique_id, phash, ingredients, created_at) VALUES (?, ?, ?, ?)",
+                (file_unique_id, phash, json.dumps(ingredients), now)
+            )
+    except sqlite3.Error as e:
+        logging.error(f"Failed to save vision cache entry {file_unique_id}: {e}")
+
+def load_vision_cache_entries(limit: int, conn=None) -> list[dict]:
+    """Returns up to `limit` newest vision results, oldest first, and deletes the older ones."""
+    db_conn = conn or get_db_connection(shard=0)
+    try:
+        with db_conn as conn_context:
+            cursor = conn_context.cursor()
+            cursor.execute(
+                "DELETE FROM vision_cache WHERE file_unique_id NOT IN "
+                "(SELECT file_unique_id FROM vision_cache ORDER BY created_at DESC, rowid DESC LIMIT ?)",
+                (limit,)
+            )
+            cursor.execute("SELECT file_unique_id, phash, ingredients FROM vision_cache ORDER BY created_at, rowid")
+            return [
+                {"file_unique_id": row[0], "phash": row[1], "ingredients": json.loads(row[2])}
+                for row in cursor.fetchall()
+            ]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to load vision cache: {e}")
+        return []
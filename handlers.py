@@ -1,12 +1,18 @@
 from aiogram import F, Router
 from aiogram.types import Message
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
-from image_processor import identify_ingredients_from_photo
+from image_processor import identify_ingredients_from_photos, merge_ingredient_lists, select_photo_size
+from vision_cache import get_by_file_id
 from audio_processor import transcribe_audio_message
-from llm_client import generate_response
-from config import MAX_CONTEXT_MESSAGES
-from database import (
+from llm_client import generate_response, stream_response
+from context_builder import build_context, schedule_summary_update
+from message_coalescer import submit_message, run_generation
+from media_groups import submit_album_message
+from metrics import track_stage
+from config import MAX_CONTEXT_MESSAGES, LLM_STREAMING, STREAM_EDIT_INTERVAL_SECONDS
+from async_database import (
     get_user_profile,
     create_user_profile,
     update_user_preferences,
@@ -18,31 +24,115 @@ from database import (
     get_conversation_history as db_get_conversation_history,
     delete_conversation_history,
 )
+import asyncio
 import logging
 import json
+import time
 
 router = Router()
 
+PREFERENCES_BLOCK_MARKER = "```json"
+TELEGRAM_MESSAGE_LIMIT = 4096
 
-def get_conversation_history(chat_id: int) -> list[dict]:
+
+async def get_conversation_history(chat_id: int) -> list[dict]:
     """
     Wrapper to retrieve conversation history from the database.
     """
-    return db_get_conversation_history(chat_id, MAX_CONTEXT_MESSAGES)
+    return await db_get_conversation_history(chat_id, MAX_CONTEXT_MESSAGES)
+
+
+def get_visible_text(text: str) -> str:
+    """
+    Returns the part of a (possibly still streaming) LLM reply that may be shown to the user:
+    everything before the ```json preferences block, holding back a trailing partial marker.
+    """
+    marker_index = text.find(PREFERENCES_BLOCK_MARKER)
+    if marker_index != -1:
+        return text[:marker_index].rstrip()
+    for length in range(len(PREFERENCES_BLOCK_MARKER) - 1, 0, -1):
+        if text.endswith(PREFERENCES_BLOCK_MARKER[:length]):
+            return text[:-length].rstrip()
+    return text.rstrip()
+
+
+async def safe_edit_text(target: Message, text: str) -> bool:
+    """
+    Edits a message, skipping the edit if Telegram rejects or rate-limits it.
+    An edit rejected because the message already shows this text counts as done.
+    """
+    try:
+        await target.edit_text(text[:TELEGRAM_MESSAGE_LIMIT])
+        return True
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return True
+        logging.warning(f"Skipped message edit for chat_id={target.chat.id}: {e}")
+        return False
+    except TelegramRetryAfter as e:
+        logging.warning(f"Skipped message edit for chat_id={target.chat.id}: {e}")
+        return False
+
+
+async def generate_reply(message: Message, chat_id: int, conversation_history: list[dict]) -> tuple[str, Message | None, str]:
+    """
+    Generates the LLM reply. With LLM_STREAMING, a placeholder is sent right away and edited
+    with the visible text at most once per STREAM_EDIT_INTERVAL_SECONDS while tokens arrive.
+    Returns the full raw reply, the placeholder message (None when not streaming) and the
+    text the placeholder currently shows.
+    """
+    if not LLM_STREAMING:
+        return await generate_response(chat_id, conversation_history), None, ""
+
+    placeholder = await message.answer("🧑‍🍳 Cooking up an answer...")
+    response = ""
+    shown_text = ""
+    last_edit_time = 0.0
+    try:
+        async for delta in stream_response(chat_id, conversation_history):
+            response += delta
+            visible_text = get_visible_text(response)
+            if visible_text and visible_text != shown_text and time.monotonic() - last_edit_time >= STREAM_EDIT_INTERVAL_SECONDS:
+                last_edit_time = time.monotonic()
+                if await safe_edit_text(placeholder, visible_text):
+                    shown_text = visible_text
+    except asyncio.CancelledError:
+        # Superseded by newer input: drop the half-written answer
+        try:
+            await placeholder.delete()
+        except TelegramBadRequest:
+            pass
+        raise
+    return response, placeholder, shown_text
+
+
+async def send_reply(message: Message, placeholder: Message | None, text: str, shown_text: str = ""):
+    """
+    Shows the final reply in the placeholder (or a new message), spilling overflow into extra messages.
+    `shown_text` is what streaming already put in the placeholder; an identical first chunk is not edited again.
+    """
+    chunks = [text[i:i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)] or [text]
+    with track_stage("send"):
+        if placeholder is None:
+            await message.answer(chunks[0])
+        elif chunks[0] != shown_text[:TELEGRAM_MESSAGE_LIMIT] and not await safe_edit_text(placeholder, chunks[0]):
+            await message.answer(chunks[0])
+        for chunk in chunks[1:]:
+            await message.answer(chunk)
 
 
 @router.message(Command("start"))
 async def start_handler(message: Message):
     """Initialize conversation and handle user profile."""
     chat_id = message.chat.id
-    user_profile = get_user_profile(chat_id)
+    user_profile = await get_user_profile(chat_id)
 
     if not user_profile:
-        create_user_profile(chat_id)
-        user_profile = get_user_profile(chat_id)
+        await create_user_profile(chat_id)
+        user_profile = await get_user_profile(chat_id)
 
     # Clear previous conversation history for a fresh start
-    delete_conversation_history(chat_id)
+    await delete_conversation_history(chat_id)
 
     journey_stage = user_profile.get("journey_stage", "new_user") if user_profile else "new_user"
 
@@ -54,7 +144,7 @@ async def start_handler(message: Message):
             "lurking in your fridge or pantry? Tell me what you have available! 🥘🔍"
         )
         # Progress the user's journey
-        update_journey_stage(chat_id, "familiar")
+        await update_journey_stage(chat_id, "familiar")
     else: # familiar or health_focused
         preferences = user_profile.get("preferences", {}) if user_profile else {}
         if preferences:
@@ -68,14 +158,14 @@ async def start_handler(message: Message):
                 f"What ingredients are we working with today?"
             )
 
-    add_message_to_history(chat_id, "assistant", welcome_message)
+    await add_message_to_history(chat_id, "assistant", welcome_message)
     await message.answer(welcome_message)
 
 @router.message(Command("preferences"))
 async def preferences_handler(message: Message):
     """Displays the user's currently stored preferences."""
     chat_id = message.chat.id
-    user_profile = get_user_profile(chat_id)
+    user_profile = await get_user_profile(chat_id)
 
     if user_profile and user_profile.get("preferences"):
         preferences = user_profile["preferences"]
@@ -92,13 +182,13 @@ async def reset_handler(message: Message):
     chat_id = message.chat.id
     
     # Clear conversation history from db
-    delete_conversation_history(chat_id)
+    await delete_conversation_history(chat_id)
     
     # Clear user profile from db
-    delete_user_profile(chat_id)
+    await delete_user_profile(chat_id)
 
     # Re-initialize profile
-    create_user_profile(chat_id)
+    await create_user_profile(chat_id)
 
     response_text = "🧹✨ Your profile has been reset! Let's start a new culinary adventure from scratch."
     await message.answer(response_text)
@@ -119,22 +209,47 @@ async def photo_help_handler(message: Message):
 
 @router.message(F.photo)
 async def photo_handler(message: Message):
-    """Handles photo messages to identify ingredients."""
-    chat_id = message.chat.id
-    
+    """Handles photo messages to identify ingredients; the photos of an album are answered together."""
+    if message.media_group_id:
+        submit_album_message(message.media_group_id, message, process_photo_messages)
+        return
+    await process_photo_messages([message])
+
+
+async def download_photo(message: Message, photo) -> bytes:
+    """Downloads one Telegram PhotoSize."""
+    photo_file = await message.bot.get_file(photo.file_id)
+    photo_bytes = await message.bot.download_file(photo_file.file_path)
+    return photo_bytes.read()
+
+
+async def process_photo_messages(messages: list[Message]):
+    """Identifies the ingredients in one or more photos of a chat and answers with a single reply."""
+    chat_id = messages[0].chat.id
+    photo_count = len(messages)
+    photo_label = "photo" if photo_count == 1 else f"{photo_count} photos"
+
     # Notify user that the photo is being processed
-    processing_message = await message.answer("📸 Analyzing your photo to identify ingredients... this might take a moment!")
+    processing_message = await messages[0].answer(f"📸 Analyzing your {photo_label} to identify ingredients... this might take a moment!")
 
     try:
-        # Get the highest resolution photo
-        photo = message.photo[-1]
-        photo_file = await message.bot.get_file(photo.file_id)
-        
-        # Download the photo into a BytesIO buffer
-        photo_bytes = await message.bot.download_file(photo_file.file_path)
-
-        # Identify ingredients
-        identified_ingredients = await identify_ingredients_from_photo(chat_id, photo_bytes.read())
+        # Get the smallest photo size that still covers the vision model's target resolution
+        photos = [select_photo_size(message.photo) for message in messages]
+
+        # Re-sent photos are answered from the vision cache without downloading them again
+        ingredient_lists = [get_by_file_id(photo.file_unique_id) for photo in photos]
+        missing = [index for index, ingredients in enumerate(ingredient_lists) if ingredients is None]
+        if missing:
+            with track_stage("telegram_download"):
+                downloads = await asyncio.gather(*(download_photo(messages[index], photos[index]) for index in missing))
+
+            # Identify ingredients
+            identified = await identify_ingredients_from_photos(
+                chat_id, [(photo_bytes, photos[index].file_unique_id) for index, photo_bytes in zip(missing, downloads)]
+            )
+            for index, ingredients in zip(missing, identified):
+                ingredient_lists[index] = ingredients
+        identified_ingredients = merge_ingredient_lists(ingredient_lists)
 
         # Update the user
         if identified_ingredients and "Error:" not in identified_ingredients[0]:
@@ -144,19 +259,20 @@ async def photo_handler(message: Message):
                 f"**{ingredients_str}**\n\n"
                 "You can add or remove items, or ask for a recipe with these!"
             )
-            add_message_to_history(chat_id, "user", f"[USER SENT A PHOTO WITH INGREDIENTS: {ingredients_str}]")
+            history_label = "A PHOTO" if photo_count == 1 else f"{photo_count} PHOTOS"
+            await add_message_to_history(chat_id, "user", f"[USER SENT {history_label} WITH INGREDIENTS: {ingredients_str}]")
         elif identified_ingredients and "Error:" in identified_ingredients[0]:
             response_text = f"😕 {identified_ingredients[0]}"
         else:
-            response_text = "🤔 I couldn't find any ingredients in your photo. Want to try another one? For tips, use /photo_help."
+            response_text = f"🤔 I couldn't find any ingredients in your {photo_label}. Want to try another one? For tips, use /photo_help."
         
-        add_message_to_history(chat_id, "assistant", response_text)
+        await add_message_to_history(chat_id, "assistant", response_text)
         
         await processing_message.edit_text(response_text, parse_mode="Markdown")
 
     except Exception as e:
         logging.error(f"Error handling photo for chat_id={chat_id}: {e}")
-        await processing_message.edit_text("😕 Sorry, something went wrong while processing your photo. Please try again!")
+        await processing_message.edit_text(f"😕 Sorry, something went wrong while processing your {photo_label}. Please try again!")
 
 
 @router.message(F.voice)
@@ -168,8 +284,9 @@ async def voice_handler(message: Message):
     processing_message = await message.answer("🎤 Listening to your message... one moment!")
 
     try:
-        voice_file = await message.bot.get_file(message.voice.file_id)
-        voice_ogg = await message.bot.download_file(voice_file.file_path)
+        with track_stage("telegram_download"):
+            voice_file = await message.bot.get_file(message.voice.file_id)
+            voice_ogg = await message.bot.download_file(voice_file.file_path)
 
         # Transcribe audio
         transcribed_text = await transcribe_audio_message(chat_id, voice_ogg)
@@ -183,12 +300,14 @@ async def voice_handler(message: Message):
         await processing_message.edit_text(feedback_text, parse_mode="Markdown")
 
         # Add to conversation and generate response
-        add_message_to_history(chat_id, "user", transcribed_text)
-        conversation_history = get_conversation_history(chat_id)
-        response = await generate_response(chat_id, conversation_history)
+        await add_message_to_history(chat_id, "user", transcribed_text)
+        conversation_history = await get_conversation_history(chat_id)
+        llm_context, evicted, summary = await build_context(chat_id, conversation_history)
+        response, placeholder, shown_text = await generate_reply(message, chat_id, llm_context)
         
-        add_message_to_history(chat_id, "assistant", response)
-        await message.answer(response)
+        await add_message_to_history(chat_id, "assistant", response)
+        await send_reply(message, placeholder, get_visible_text(response), shown_text)
+        schedule_summary_update(chat_id, evicted, summary)
 
     except Exception as e:
         logging.error(f"Error handling voice message for chat_id={chat_id}: {e}")
@@ -197,25 +316,34 @@ async def voice_handler(message: Message):
 
 @router.message()
 async def message_handler(message: Message):
-    """Handle all user messages by passing them to the LLM."""
+    """Handle all user messages by passing them to the LLM, debounced per chat."""
+    submit_message(message.chat.id, message, process_text_turn)
+
+
+async def process_text_turn(messages: list[Message]):
+    """Answers every text message collected in one debounce window as a single turn."""
+    message = messages[-1]
     chat_id = message.chat.id
-    user_message = message.text
+    user_message = "\n".join(m.text for m in messages if m.text)
+    if not user_message:
+        return
 
-    user_profile = get_user_profile(chat_id)
+    user_profile = await get_user_profile(chat_id)
     if not user_profile:
-        create_user_profile(chat_id)
-        user_profile = get_user_profile(chat_id)
+        await create_user_profile(chat_id)
+        user_profile = await get_user_profile(chat_id)
 
     # Increment interaction counter
-    increment_interaction_count(chat_id)
-    interaction_count = user_profile.get("interaction_count", 0) + 1 if user_profile else 1
+    interaction_count = await increment_interaction_count(chat_id)
+    if interaction_count is None:
+        interaction_count = user_profile.get("interaction_count", 0) + 1 if user_profile else 1
 
 
     # Check if the interaction limit is reached
     if interaction_count >= 30:
         # Reset for a new cycle
-        reset_interaction_count(chat_id)
-        delete_conversation_history(chat_id)
+        await reset_interaction_count(chat_id)
+        await delete_conversation_history(chat_id)
 
         retuning_message = (
             "🕰️✨ Wow, time flies when you're cooking with ideas! We've had quite a long chat. "
@@ -223,26 +351,27 @@ async def message_handler(message: Message):
             "What new ingredients or cravings have sparked your imagination recently? "
             "Tell me what you're working with now!"
         )
-        add_message_to_history(chat_id, "assistant", retuning_message)
+        await add_message_to_history(chat_id, "assistant", retuning_message)
         await message.answer(retuning_message)
         return
 
     # Add user message to conversation
-    add_message_to_history(chat_id, "user", user_message)
+    await add_message_to_history(chat_id, "user", user_message)
     
     # Get conversation history
-    conversation_history = get_conversation_history(chat_id)
-
-    # --- Add user preferences to the context for the LLM ---
-    if user_profile and user_profile.get("preferences"):
-        preferences = user_profile["preferences"]
-        preferences_str = json.dumps(preferences)
-        # Using a "system" role for this note makes it clear it's context, not user input
-        conversation_history.insert(0, {"role": "system", "content": f"System Note: User's current preferences are: {preferences_str}"})
+    conversation_history = await get_conversation_history(chat_id)
 
+    # --- Fit history, summary and user preferences into the LLM input token budget ---
+    preferences = user_profile.get("preferences") if user_profile else None
+    llm_context, evicted, summary = await build_context(chat_id, conversation_history, preferences)
     
-    # Generate response from LLM
-    llm_response = await generate_response(chat_id, conversation_history)
+    # Generate response from LLM (streamed into a placeholder message when enabled)
+    reply = await run_generation(chat_id, generate_reply(message, chat_id, llm_context))
+    if reply is None:
+        # Newer input arrived; the next turn answers it together with this message
+        logging.info(f"Dropped superseded reply for chat_id={chat_id}")
+        return
+    llm_response, placeholder, shown_text = reply
     
     # --- Preference Extraction Logic ---
     response_to_user = llm_response
@@ -252,7 +381,7 @@ async def message_handler(message: Message):
             preferences = json.loads(json_part)
             
             if isinstance(preferences, dict):
-                update_user_preferences(chat_id, preferences)
+                await update_user_preferences(chat_id, preferences)
                 logging.info(f"Updated preferences for chat_id={chat_id}: {preferences}")
 
             # Remove the JSON block from the response sent to the user
@@ -263,5 +392,6 @@ async def message_handler(message: Message):
         response_to_user = llm_response # Send the full response if parsing fails
     
     # Add bot response to conversation and send to user
-    add_message_to_history(chat_id, "assistant", response_to_user)
-    await message.answer(response_to_user)
+    await add_message_to_history(chat_id, "assistant", response_to_user)
+    await send_reply(message, placeholder, response_to_user, shown_text)
+    schedule_summary_update(chat_id, evicted, summary)
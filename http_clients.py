@@ -0,0 +1,82 @@
+"""
+Shared, lazily created API clients, one per upstream, each on its own tuned httpx connection pool
+(explicit limits, keep-alive, HTTP/2 when the h2 package is installed). Every module calling
+OpenRouter or OpenAI gets its client from here, so connections are reused across features.
+New connections and requests are counted per upstream to make connection reuse visible in metrics.
+"""
+import importlib.util
+import logging
+
+import httpx
+import openai
+
+from config import (
+    OPENROUTER_API_KEY,
+    OPENAI_API_KEY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_SECONDS,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP2_ENABLED,
+    UPSTREAM_ATTEMPT_TIMEOUT_SECONDS,
+)
+from metrics import inc_counter
+
+UPSTREAMS = {
+    "openrouter": {"api_key": OPENROUTER_API_KEY, "base_url": "https://openrouter.ai/api/v1"},
+    "openai": {"api_key": OPENAI_API_KEY, "base_url": None},
+}
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_clients = {}
+
+
+def _build_connection_tracer(upstream: str):
+    """Request hook that counts requests and, through httpcore's trace extension, newly opened connections."""
+    async def trace(event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            inc_counter("recipe_bot_http_connections_opened_total", "New TCP connections to an upstream", upstream=upstream)
+
+    async def on_request(request: httpx.Request):
+        inc_counter("recipe_bot_http_requests_total", "HTTP requests sent to an upstream", upstream=upstream)
+        request.extensions["trace"] = trace
+
+    return on_request
+
+
+def _build_http_client(upstream: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+        # Attempt deadlines are enforced by the resilience layer; this only bounds a stuck socket
+        timeout=httpx.Timeout(UPSTREAM_ATTEMPT_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        http2=HTTP2_ENABLED and HTTP2_AVAILABLE,
+        event_hooks={"request": [_build_connection_tracer(upstream)]},
+    )
+
+
+def get_client(upstream: str) -> openai.AsyncClient:
+    """Returns the shared client for "openrouter" or "openai", creating it on first use."""
+    client = _clients.get(upstream)
+    if client is None:
+        settings = UPSTREAMS[upstream]
+        # Retries and timeouts are handled by the resilience layer
+        client = openai.AsyncClient(
+            api_key=settings["api_key"],
+            base_url=settings["base_url"],
+            http_client=_build_http_client(upstream),
+            max_retries=0
+        )
+        _clients[upstream] = client
+        logging.info(f"Created {upstream} client (http2={HTTP2_ENABLED and HTTP2_AVAILABLE}, max_connections={HTTP_MAX_CONNECTIONS})")
+    return client
+
+
+async def close_clients():
+    """Closes every pooled connection; clients are recreated on next use."""
+    for client in _clients.values():
+        await client.close()
+    _clients.clear()
@@ -1,69 +1,164 @@
+import asyncio
 import base64
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
-import openai
 from PIL import Image
 
-from config import OPENROUTER_API_KEY, OPENROUTER_VISION_MODEL
-
-client = openai.AsyncClient(
-    api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1"
+from config import (
+    OPENROUTER_VISION_MODEL,
+    VISION_FALLBACK_MODELS,
+    VISION_IMAGE_MAX_SIZE,
+    VISION_IMAGE_FORMAT,
+    VISION_IMAGE_QUALITY,
+    IMAGE_WORKERS,
+    ALBUM_VISION_CONCURRENCY,
 )
+from resilience import call_with_fallback
+from metrics import inc_counter, track_stage
+from llm_client import record_usage
+from http_clients import get_client
+from ingredient_vocabulary import normalize_ingredient_list
+from vision_cache import compute_dhash, get_by_phash, remember
+
+# Pillow releases the GIL while decoding, resizing and encoding, so threads scale across cores
+_image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-worker")
+
+
+def select_photo_size(photo_sizes: list):
+    """
+    Picks the smallest Telegram PhotoSize whose longer side still reaches VISION_IMAGE_MAX_SIZE,
+    so no more bytes are downloaded than the resize keeps. Falls back to the largest size.
+    """
+    large_enough = [photo for photo in photo_sizes if max(photo.width, photo.height) >= VISION_IMAGE_MAX_SIZE]
+    if not large_enough:
+        return max(photo_sizes, key=lambda photo: photo.width * photo.height)
+    return min(large_enough, key=lambda photo: photo.width * photo.height)
 
-async def identify_ingredients_from_photo(chat_id: int, image_data: bytes) -> list[str]:
+
+def prepare_image(image_data: bytes) -> tuple[bytes, str, int, float]:
+    """
+    Downscales a photo to fit VISION_IMAGE_MAX_SIZE and re-encodes it as lossy JPEG or WebP.
+    JPEGs are decoded in draft mode, letting the decoder downscale by up to 8x for free.
+    Runs on a worker thread. Returns (encoded bytes, MIME type, perceptual hash, CPU milliseconds spent).
+    """
+    start_cpu = time.thread_time()
+    image = Image.open(BytesIO(image_data))
+    if image.format == "JPEG":
+        image.draft("RGB", (VISION_IMAGE_MAX_SIZE, VISION_IMAGE_MAX_SIZE))
+    image.thumbnail((VISION_IMAGE_MAX_SIZE, VISION_IMAGE_MAX_SIZE))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    phash = compute_dhash(image)
+
+    buffered = BytesIO()
+    image.save(buffered, format=VISION_IMAGE_FORMAT, quality=VISION_IMAGE_QUALITY)
+    return buffered.getvalue(), f"image/{VISION_IMAGE_FORMAT.lower()}", phash, (time.thread_time() - start_cpu) * 1000
+
+
+def shutdown_image_executor():
+    _image_executor.shutdown(wait=True)
+
+
+async def identify_ingredients_from_photo(chat_id: int, image_data: bytes, file_unique_id: str | None = None) -> list[str]:
     """
     Identifies ingredients from a given photo using a vision model.
-    Resizes the image for performance and encodes it to base64.
+    Resizes and re-encodes the image off the event loop; near-duplicates of an already analysed
+    photo are answered from the vision cache, anything else is sent base64-encoded.
     Returns a list of identified ingredients.
     """
     try:
-        # Resize image for faster processing
-        image = Image.open(BytesIO(image_data))
-        max_size = 512
-        image.thumbnail((max_size, max_size))
-
-        # Convert to BytesIO buffer
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        
+        with track_stage("image_prepare"):
+            encoded_image, mime_type, phash, cpu_ms = await asyncio.get_running_loop().run_in_executor(
+                _image_executor, prepare_image, image_data
+            )
+        inc_counter("recipe_bot_photos_total", "Photos prepared for the vision model")
+        inc_counter("recipe_bot_photo_input_bytes_total", "Photo bytes downloaded from Telegram", len(image_data))
+        inc_counter("recipe_bot_vision_upload_bytes_total", "Encoded image bytes sent to the vision model", len(encoded_image))
+        inc_counter("recipe_bot_image_cpu_seconds_total", "CPU time spent decoding, resizing and encoding photos", cpu_ms / 1000)
+        logging.info(
+            f"IMAGE_PREPARED chat_id={chat_id} input_bytes={len(image_data)} upload_bytes={len(encoded_image)} "
+            f"format={mime_type} cpu_ms={cpu_ms:.1f}"
+        )
+
+        cached_ingredients = get_by_phash(phash, file_unique_id)
+        if cached_ingredients is not None:
+            logging.info(f"Vision cache hit for chat_id={chat_id}: {', '.join(cached_ingredients)}")
+            return cached_ingredients
+
         # Encode to base64
-        base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        base64_image = base64.b64encode(encoded_image).decode('utf-8')
 
-        
-        response = await client.chat.completions.create(
-            model=OPENROUTER_VISION_MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Identify the food ingredients in this image. List them as a simple comma-separated string. For example: tomatoes, onions, garlic. If no food ingredients are visible, return an empty string."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
+        vision_messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Identify the food ingredients in this image. List them as a simple comma-separated string. For example: tomatoes, onions, garlic. If no food ingredients are visible, return an empty string."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{base64_image}"
                         }
-                    ]
-                }
-            ],
-            max_tokens=500
-        )
+                    }
+                ]
+            }
+        ]
+        vision_models = list(dict.fromkeys([OPENROUTER_VISION_MODEL] + VISION_FALLBACK_MODELS))
+        with track_stage("vision"):
+            response, model = await call_with_fallback(
+                "openrouter",
+                vision_models,
+                lambda model: get_client("openrouter").chat.completions.create(model=model, messages=vision_messages, max_tokens=500),
+                kind="vision"
+            )
+        record_usage(model, response.usage, purpose="vision")
         
         content = response.choices[0].message.content.strip()
-        logging.info(f"Vision API identified ingredients for chat_id={chat_id}: {content}")
+        logging.info(f"Vision API ({model}) identified ingredients for chat_id={chat_id}: {content}")
 
         if not content or "no ingredients found" in content.lower():
-            return []
-            
-        # Split by comma and clean up whitespace
-        ingredients = [item.strip() for item in content.split(',')]
+            ingredients = []
+        else:
+            # Split by comma; items that are exactly one known ingredient get its canonical name
+            ingredients = normalize_ingredient_list(content.split(','))
+        await remember(phash, ingredients, file_unique_id)
         return ingredients
 
     except Exception as e:
         logging.error(f"Error identifying ingredients from photo for chat_id={chat_id}: {e}")
         return ["Error: Could not analyze the image."]
+
+
+def merge_ingredient_lists(ingredient_lists: list[list[str]]) -> list[str]:
+    """
+    Merges the ingredients found in several photos, dropping case-insensitive duplicates.
+    Photos that failed to analyse are skipped; if all of them failed, the first error is returned.
+    """
+    successful = [ingredients for ingredients in ingredient_lists if not (ingredients and "Error:" in ingredients[0])]
+    if not successful:
+        return ingredient_lists[0] if ingredient_lists else []
+    merged = {}
+    for ingredients in successful:
+        for ingredient in ingredients:
+            merged.setdefault(ingredient.lower(), ingredient)
+    return list(merged.values())
+
+
+async def identify_ingredients_from_photos(chat_id: int, photos: list[tuple[bytes, str | None]]) -> list[list[str]]:
+    """
+    Identifies ingredients in several photos, e.g. an album, with at most ALBUM_VISION_CONCURRENCY
+    vision requests in flight. `photos` holds (image bytes, file_unique_id) pairs; returns one
+    ingredient list per photo, in order.
+    """
+    semaphore = asyncio.Semaphore(ALBUM_VISION_CONCURRENCY)
+
+    async def identify(image_data: bytes, file_unique_id: str | None) -> list[str]:
+        async with semaphore:
+            return await identify_ingredients_from_photo(chat_id, image_data, file_unique_id)
+
+    return await asyncio.gather(*(identify(image_data, file_unique_id) for image_data, file_unique_id in photos))
@@ -4,6 +4,8 @@ Following @conventions.md: functions only, simple data structures, KISS principl
 """
 import random
 
+from ingredient_vocabulary import find_ingredients, normalize_text
+
 # Local ingredient database by region/country
 LOCAL_INGREDIENTS = {
     "italy": ["parmigiano-reggiano", "balsamic vinegar", "prosciutto", "basil", "pine nuts", "mascarpone", "pancetta", "romano cheese"],
@@ -42,6 +44,13 @@ CULTURAL_CONTEXTS = {
     "brazil": "Indigenous ingredients meet Portuguese colonial fusion"
 }
 
+# Canonical ingredient ids of every local ingredient, resolved once at import
+_LOCAL_INGREDIENT_IDS = {
+    ingredient: set(find_ingredients(ingredient))
+    for ingredients in LOCAL_INGREDIENTS.values()
+    for ingredient in ingredients
+}
+
 def normalize_location(location: str) -> str:
     """Normalize location string for database lookup"""
     if not location:
@@ -82,20 +91,18 @@ def select_surprise_ingredients(user_location: str, user_ingredients: list, coun
     
     available_ingredients = LOCAL_INGREDIENTS[normalized_location]
     
-    # Convert user ingredients to lowercase for comparison
-    user_ingredients_lower = [ing.lower().strip() for ing in user_ingredients if ing]
+    # Canonical ids of everything the user mentioned, found in one pass over their ingredients
+    user_ingredient_ids = set(find_ingredients(", ".join(ing for ing in user_ingredients if ing)))
+    user_ingredient_names = {normalize_text(ing).strip() for ing in user_ingredients if ing}
     
     # Filter out ingredients user already has (avoid duplicates)
     surprise_candidates = []
     for ingredient in available_ingredients:
-        # Check if ingredient or part of it is already mentioned by user
-        already_mentioned = False
-        for user_ing in user_ingredients_lower:
-            if (ingredient.lower() in user_ing or 
-                user_ing in ingredient.lower() or
-                any(word in ingredient.lower() for word in user_ing.split() if len(word) > 3)):
-                already_mentioned = True
-                break
+        ingredient_ids = _LOCAL_INGREDIENT_IDS[ingredient]
+        if ingredient_ids:
+            already_mentioned = bool(ingredient_ids & user_ingredient_ids)
+        else:
+            already_mentioned = normalize_text(ingredient) in user_ingredient_names
         
         if not already_mentioned:
             surprise_candidates.append(ingredient)
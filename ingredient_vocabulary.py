@@ -0,0 +1,247 @@
+"""
+Shared ingredient vocabulary: canonical ingredient ids with plurals and synonyms in the
+languages the bot speaks (English, Russian, Dutch, French), compiled once into an
+Aho-Corasick automaton so free text is mapped to canonical ids in a single pass.
+Following @conventions.md: functions only, simple data structures, KISS principle.
+"""
+import unicodedata
+from collections import deque
+
+# canonical id -> {"category": food category or None, "aliases": [...]}
+INGREDIENT_VOCABULARY = {
+    # Meats
+    "chicken": {"category": "meats", "aliases": ["chicken", "chickens", "курица", "курицу", "курицы", "курятина", "kip", "poulet"]},
+    "beef": {"category": "meats", "aliases": ["beef", "говядина", "говядину", "rundvlees", "boeuf", "bœuf"]},
+    "pork": {"category": "meats", "aliases": ["pork", "свинина", "свинину", "varkensvlees", "porc"]},
+    "lamb": {"category": "meats", "aliases": ["lamb", "баранина", "баранину", "lamsvlees", "agneau"]},
+    "turkey": {"category": "meats", "aliases": ["turkey", "индейка", "индейку", "kalkoen", "dinde"]},
+    "duck": {"category": "meats", "aliases": ["duck", "утка", "утку", "eend", "canard"]},
+    "steak": {"category": "meats", "aliases": ["steak", "steaks", "стейк", "biefstuk"]},
+    "bacon": {"category": "meats", "aliases": ["bacon", "бекон", "spek", "lardons"]},
+    "sausage": {"category": "meats", "aliases": ["sausage", "sausages", "колбаса", "сосиски", "worst", "saucisse", "saucisses"]},
+    "ham": {"category": "meats", "aliases": ["ham", "ветчина", "jambon"]},
+    "prosciutto": {"category": "meats", "aliases": ["prosciutto", "прошутто"]},
+    "pancetta": {"category": "meats", "aliases": ["pancetta", "панчетта"]},
+    "meat": {"category": "meats", "aliases": ["meat", "мясо", "vlees", "viande"]},
+    # Seafood
+    "fish": {"category": "seafood", "aliases": ["fish", "рыба", "рыбу", "vis", "poisson"]},
+    "salmon": {"category": "seafood", "aliases": ["salmon", "лосось", "семга", "zalm", "saumon"]},
+    "tuna": {"category": "seafood", "aliases": ["tuna", "тунец", "tonijn", "thon"]},
+    "cod": {"category": "seafood", "aliases": ["cod", "треска", "треску", "kabeljauw", "cabillaud"]},
+    "shrimp": {"category": "seafood", "aliases": ["shrimp", "shrimps", "prawn", "prawns", "креветки", "креветка", "garnalen", "garnaal", "crevette", "crevettes"]},
+    "lobster": {"category": "seafood", "aliases": ["lobster", "омар", "kreeft", "homard"]},
+    "seafood": {"category": "seafood", "aliases": ["seafood", "морепродукты", "zeevruchten", "fruits de mer"]},
+    # Dairy
+    "milk": {"category": "dairy", "aliases": ["milk", "молоко", "melk", "lait"]},
+    "cheese": {"category": "dairy", "aliases": ["cheese", "cheeses", "сыр", "kaas", "fromage"]},
+    "mozzarella": {"category": "dairy", "aliases": ["mozzarella", "моцарелла"]},
+    "cheddar": {"category": "dairy", "aliases": ["cheddar", "чеддер"]},
+    "parmesan": {"category": "dairy", "aliases": ["parmesan", "parmigiano-reggiano", "parmigiano", "пармезан", "parmezaan"]},
+    "feta": {"category": "dairy", "aliases": ["feta", "фета"]},
+    "mascarpone": {"category": "dairy", "aliases": ["mascarpone", "маскарпоне"]},
+    "yogurt": {"category": "dairy", "aliases": ["yogurt", "yoghurt", "йогурт", "yaourt"]},
+    "cream": {"category": "dairy", "aliases": ["cream", "сливки", "slagroom", "crème", "crème fraîche"]},
+    "butter": {"category": "dairy", "aliases": ["butter", "сливочное масло", "boter", "beurre", "ghee"]},
+    # Sweets
+    "chocolate": {"category": "sweets", "aliases": ["chocolate", "шоколад", "chocolade", "chocolat"]},
+    "sugar": {"category": "sweets", "aliases": ["sugar", "сахар", "suiker", "sucre", "palm sugar"]},
+    "honey": {"category": "sweets", "aliases": ["honey", "мёд", "honing", "miel"]},
+    "vanilla": {"category": "sweets", "aliases": ["vanilla", "ваниль", "vanille"]},
+    "cake": {"category": "sweets", "aliases": ["cake", "cakes", "торт", "taart", "gâteau"]},
+    "candy": {"category": "sweets", "aliases": ["candy", "candies", "конфеты", "snoep", "bonbons"]},
+    "ice cream": {"category": "sweets", "aliases": ["ice cream", "мороженое", "ijs", "glace"]},
+    "caramel": {"category": "sweets", "aliases": ["caramel", "карамель", "karamel"]},
+    "dessert": {"category": "sweets", "aliases": ["dessert", "десерт"]},
+    # Fruits
+    "apple": {"category": "fruits", "aliases": ["apple", "apples", "яблоко", "яблоки", "appel", "appels", "pomme", "pommes"]},
+    "banana": {"category": "fruits", "aliases": ["banana", "bananas", "банан", "бананы", "banaan", "bananen", "banane", "bananes"]},
+    "orange": {"category": "fruits", "aliases": ["orange", "oranges", "апельсин", "апельсины", "sinaasappel"]},
+    "strawberry": {"category": "fruits", "aliases": ["strawberry", "strawberries", "клубника", "aardbei", "aardbeien", "fraise", "fraises"]},
+    "blueberry": {"category": "fruits", "aliases": ["blueberry", "blueberries", "черника", "bosbessen", "myrtilles"]},
+    "berry": {"category": "fruits", "aliases": ["berry", "berries", "ягоды", "bessen", "baies"]},
+    "mango": {"category": "fruits", "aliases": ["mango", "mangoes", "манго", "mangue"]},
+    "peach": {"category": "fruits", "aliases": ["peach", "peaches", "персик", "персики", "perzik", "pêche"]},
+    "lemon": {"category": "fruits", "aliases": ["lemon", "lemons", "лимон", "лимоны", "citroen", "citron", "preserved lemons"]},
+    "lime": {"category": "fruits", "aliases": ["lime", "limes", "лайм", "limoen", "citron vert"]},
+    "watermelon": {"category": "fruits", "aliases": ["watermelon", "арбуз", "watermeloen", "pastèque"]},
+    "avocado": {"category": "fruits", "aliases": ["avocado", "avocados", "авокадо", "avocat"]},
+    "coconut": {"category": "fruits", "aliases": ["coconut", "кокос", "kokos", "noix de coco"]},
+    "dates": {"category": "fruits", "aliases": ["dates", "финики", "dadels", "dattes"]},
+    "pomegranate": {"category": "fruits", "aliases": ["pomegranate", "гранат", "granaatappel", "grenade"]},
+    "fruit": {"category": "fruits", "aliases": ["fruit", "fruits", "фрукты", "vruchten"]},
+    # Vegetables
+    "tomato": {"category": "vegetables", "aliases": ["tomato", "tomatoes", "помидор", "помидоры", "томат", "томаты", "tomaat", "tomaten", "tomate", "tomates"]},
+    "onion": {"category": "vegetables", "aliases": ["onion", "onions", "лук", "ui", "uien", "oignon", "oignons", "shallots", "scallions"]},
+    "potato": {"category": "vegetables", "aliases": ["potato", "potatoes", "картофель", "картошка", "aardappel", "aardappelen", "pomme de terre", "pommes de terre"]},
+    "carrot": {"category": "vegetables", "aliases": ["carrot", "carrots", "морковь", "wortel", "wortels", "carotte", "carottes"]},
+    "broccoli": {"category": "vegetables", "aliases": ["broccoli", "брокколи", "brocoli"]},
+    "spinach": {"category": "vegetables", "aliases": ["spinach", "шпинат", "spinazie", "épinards"]},
+    "lettuce": {"category": "vegetables", "aliases": ["lettuce", "салат латук", "sla", "laitue"]},
+    "cabbage": {"category": "vegetables", "aliases": ["cabbage", "капуста", "kool", "chou"]},
+    "cucumber": {"category": "vegetables", "aliases": ["cucumber", "cucumbers", "огурец", "огурцы", "komkommer", "concombre"]},
+    "mushroom": {"category": "vegetables", "aliases": ["mushroom", "mushrooms", "грибы", "гриб", "champignon", "champignons", "shiitake"]},
+    "zucchini": {"category": "vegetables", "aliases": ["zucchini", "courgette", "courgettes", "кабачок", "кабачки"]},
+    "eggplant": {"category": "vegetables", "aliases": ["eggplant", "aubergine", "aubergines", "баклажан", "баклажаны"]},
+    "bell pepper": {"category": "vegetables", "aliases": ["bell pepper", "bell peppers", "болгарский перец", "poivron", "poivrons"]},
+    "vegetable": {"category": "vegetables", "aliases": ["vegetable", "vegetables", "овощи", "groente", "groenten", "légumes"]},
+    # Grains
+    "rice": {"category": "grains", "aliases": ["rice", "рис", "rijst", "riz"]},
+    "bread": {"category": "grains", "aliases": ["bread", "хлеб", "brood", "pain"]},
+    "pasta": {"category": "grains", "aliases": ["pasta", "spaghetti", "паста", "макароны", "pâtes"]},
+    "noodles": {"category": "grains", "aliases": ["noodles", "лапша", "noedels", "nouilles"]},
+    "flour": {"category": "grains", "aliases": ["flour", "мука", "bloem", "farine"]},
+    "quinoa": {"category": "grains", "aliases": ["quinoa", "киноа"]},
+    "oats": {"category": "grains", "aliases": ["oats", "oatmeal", "овсянка", "havermout", "avoine"]},
+    "bulgur": {"category": "grains", "aliases": ["bulgur", "булгур", "boulgour"]},
+    # Spices and herbs
+    "cumin": {"category": "spices", "aliases": ["cumin", "cumin seeds", "зира", "кумин", "komijn"]},
+    "paprika": {"category": "spices", "aliases": ["paprika", "паприка", "pimentón"]},
+    "cinnamon": {"category": "spices", "aliases": ["cinnamon", "корица", "kaneel", "cannelle"]},
+    "ginger": {"category": "spices", "aliases": ["ginger", "имбирь", "gember", "gingembre"]},
+    "garlic": {"category": "spices", "aliases": ["garlic", "чеснок", "knoflook", "ail"]},
+    "basil": {"category": "spices", "aliases": ["basil", "thai basil", "базилик", "basilicum", "basilic"]},
+    "oregano": {"category": "spices", "aliases": ["oregano", "орегано", "origan"]},
+    "thyme": {"category": "spices", "aliases": ["thyme", "тимьян", "tijm", "thym"]},
+    "dill": {"category": "spices", "aliases": ["dill", "укроп", "dille", "aneth"]},
+    "parsley": {"category": "spices", "aliases": ["parsley", "петрушка", "peterselie", "persil"]},
+    "cilantro": {"category": "spices", "aliases": ["cilantro", "coriander", "кинза", "кориандр", "koriander", "coriandre"]},
+    "black pepper": {"category": "spices", "aliases": ["black pepper", "pepper", "черный перец", "перец", "peper", "poivre"]},
+    "chili": {"category": "spices", "aliases": ["chili", "chilli", "chile", "чили", "piment", "jalapeños", "jalapeno", "chipotle"]},
+    "salt": {"category": "spices", "aliases": ["salt", "соль", "zout", "sel"]},
+    "saffron": {"category": "spices", "aliases": ["saffron", "шафран", "saffraan", "safran"]},
+    "cardamom": {"category": "spices", "aliases": ["cardamom", "кардамон", "kardemom", "cardamome"]},
+    "sumac": {"category": "spices", "aliases": ["sumac", "сумах", "sumak"]},
+    # Sauces
+    "soy sauce": {"category": "sauces", "aliases": ["soy sauce", "soy", "соевый соус", "sojasaus", "sauce soja"]},
+    "fish sauce": {"category": "sauces", "aliases": ["fish sauce", "рыбный соус", "vissaus", "sauce de poisson"]},
+    "ketchup": {"category": "sauces", "aliases": ["ketchup", "кетчуп"]},
+    "mustard": {"category": "sauces", "aliases": ["mustard", "горчица", "mosterd", "moutarde"]},
+    "mayonnaise": {"category": "sauces", "aliases": ["mayonnaise", "mayo", "майонез"]},
+    "sauce": {"category": "sauces", "aliases": ["sauce", "соус", "saus"]},
+    # Other pantry items
+    "egg": {"category": None, "aliases": ["egg", "eggs", "яйцо", "яйца", "ei", "eieren", "œuf", "œufs", "oeuf", "oeufs"]},
+    "olive oil": {"category": None, "aliases": ["olive oil", "оливковое масло", "olijfolie", "huile d'olive"]},
+    "sesame oil": {"category": None, "aliases": ["sesame oil", "кунжутное масло", "sesamolie", "huile de sésame"]},
+    "olives": {"category": None, "aliases": ["olives", "olive", "оливки", "маслины", "olijven"]},
+    "vinegar": {"category": None, "aliases": ["vinegar", "уксус", "azijn", "vinaigre"]},
+    "balsamic vinegar": {"category": None, "aliases": ["balsamic vinegar", "бальзамический уксус", "vinaigre balsamique"]},
+    "coffee": {"category": None, "aliases": ["coffee", "кофе", "koffie", "café"]},
+    "peanut butter": {"category": None, "aliases": ["peanut butter", "арахисовая паста", "pindakaas", "beurre de cacahuète"]},
+    "almonds": {"category": None, "aliases": ["almonds", "almond", "миндаль", "amandelen", "amandes"]},
+    "pistachios": {"category": None, "aliases": ["pistachios", "фисташки", "pistachenoten", "pistaches"]},
+    "cashews": {"category": None, "aliases": ["cashews", "кешью", "cashewnoten", "noix de cajou"]},
+    "pine nuts": {"category": None, "aliases": ["pine nuts", "кедровые орехи", "pijnboompitten", "pignons"]},
+    "sesame seeds": {"category": None, "aliases": ["sesame seeds", "sesame", "кунжут", "sesamzaad", "sésame"]},
+    "beans": {"category": None, "aliases": ["beans", "фасоль", "bonen", "haricots"]},
+    "tofu": {"category": None, "aliases": ["tofu", "тофу"]},
+}
+
+
+def normalize_text(text: str) -> str:
+    """Case-folds text and strips accents so that e.g. "Crème" and "creme" match."""
+    decomposed = unicodedata.normalize("NFKD", text.replace("’", "'"))
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def _build_automaton(vocabulary: dict) -> dict:
+    """
+    Compiles every alias into an Aho-Corasick automaton.
+    State i has goto[i] (char -> state), fail[i] (longest proper suffix state) and
+    output[i] (list of (alias length, canonical id) ending at this state).
+    """
+    goto, fail, output = [{}], [0], [[]]
+    for ingredient_id, entry in vocabulary.items():
+        for alias in entry["aliases"] + [ingredient_id]:
+            pattern = normalize_text(alias)
+            state = 0
+            for char in pattern:
+                if char not in goto[state]:
+                    goto.append({})
+                    fail.append(0)
+                    output.append([])
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            if (len(pattern), ingredient_id) not in output[state]:
+                output[state].append((len(pattern), ingredient_id))
+
+    # Breadth-first pass to fill failure links and merge outputs along them
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(char, 0)
+            output[next_state] = output[next_state] + output[fail[next_state]]
+    return {"goto": goto, "fail": fail, "output": output}
+
+
+_automaton = _build_automaton(INGREDIENT_VOCABULARY)
+
+
+def _scan(text: str) -> list[tuple[int, int, str]]:
+    """All whole-word alias matches in normalized text as (start, end, canonical id)."""
+    goto, fail, output = _automaton["goto"], _automaton["fail"], _automaton["output"]
+    matches = []
+    state = 0
+    for position, char in enumerate(text):
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        for length, ingredient_id in output[state]:
+            start, end = position - length + 1, position + 1
+            if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                matches.append((start, end, ingredient_id))
+    return matches
+
+
+def find_ingredients(text: str) -> list[str]:
+    """
+    Canonical ingredient ids mentioned in free text, in order of appearance and without duplicates.
+    Overlapping matches resolve to the longest one, so "ice cream" is not also "cream".
+    """
+    if not text:
+        return []
+    found = []
+    covered_until = 0
+    for start, end, ingredient_id in sorted(_scan(normalize_text(text)), key=lambda match: (match[0], -match[1])):
+        if start < covered_until:
+            continue
+        covered_until = end
+        if ingredient_id not in found:
+            found.append(ingredient_id)
+    return found
+
+
+def get_ingredient_category(ingredient_id: str) -> str | None:
+    """Food category of a canonical ingredient, or None if unknown."""
+    entry = INGREDIENT_VOCABULARY.get(ingredient_id)
+    return entry["category"] if entry else None
+
+
+def canonical_ingredient(item: str) -> str | None:
+    """Canonical id if a single vocabulary entry covers the whole item (e.g. "Tomatoes"), else None."""
+    text = normalize_text(item).strip()
+    for start, end, ingredient_id in _scan(text):
+        if start == 0 and end == len(text):
+            return ingredient_id
+    return None
+
+
+def normalize_ingredient_list(items: list[str]) -> list[str]:
+    """
+    Cleans a list of free-text ingredient names (e.g. a vision model's comma-separated reply) for display.
+    Items that are exactly one known ingredient become its canonical id; anything more specific,
+    like "sweet potatoes" or "cream cheese", is kept as written. Duplicates are dropped.
+    """
+    normalized = []
+    for item in items:
+        item = item.strip().strip(".").strip()
+        if not item:
+            continue
+        ingredient = canonical_ingredient(item) or item
+        if ingredient.lower() not in (existing.lower() for existing in normalized):
+            normalized.append(ingredient)
+    return normalized
@@ -1,12 +1,19 @@
-import openai
 import logging
 import time
-from config import OPENROUTER_API_KEY, OPENROUTER_MODEL, LLM_TEMPERATURE, LLM_MAX_TOKENS
-
-client = openai.AsyncClient(
-    api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1"
+from config import (
+    OPENROUTER_MODEL,
+    LLM_TEMPERATURE,
+    LLM_MAX_TOKENS,
+    LLM_SUMMARY_MAX_TOKENS,
+    LLM_CACHE_CONTROL_MODEL_PREFIXES,
+    LLM_FALLBACK_MODELS,
 )
+from resilience import call_with_fallback
+from metrics import record_llm_usage, get_model_price, observe_stage, count_error
+from http_clients import get_client
+
+# Rough prompt size for cost estimates made before a call; actual usage is billed from the response
+PROMPT_CHARS_PER_TOKEN = 4
 
 SYSTEM_PROMPT = """You are a witty, clever, and encouraging AI cooking companion. Your goal is to make cooking a fun and engaging adventure, starting with surprising recipes and gradually guiding users towards healthier eating habits while maintaining a joyful spirit.
 
@@ -66,30 +73,220 @@ SYSTEM_PROMPT = """You are a witty, clever, and encouraging AI cooking companion
   ```
 """
 
+LLM_ERROR_MESSAGE = "I seem to be lost for words... could you please try that again? 🤔"
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def supports_cache_control(model: str) -> bool:
+    """True for models whose providers need explicit cache_control breakpoints through OpenRouter."""
+    return any(model.startswith(prefix) for prefix in LLM_CACHE_CONTROL_MODEL_PREFIXES)
+
+
+def _with_cache_breakpoint(message: dict) -> dict:
+    """Returns a copy of a text message as a content part carrying a cache_control marker."""
+    return {"role": message["role"], "content": [{"type": "text", "text": message["content"], "cache_control": CACHE_CONTROL}]}
+
+
+def build_llm_messages(conversation_history: list[dict], model: str = OPENROUTER_MODEL) -> list[dict]:
+    """
+    Lays out the request so the longest possible prefix is byte-stable: the static SYSTEM_PROMPT
+    (identical for every user), then the append-only history. Per-turn notes are expected at the end.
+    For models that need it, cache breakpoints are set after the system prompt and after the
+    stable history (everything before the newest message).
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + conversation_history
+    if not supports_cache_control(model):
+        return messages
+
+    messages[0] = _with_cache_breakpoint(messages[0])
+    if len(messages) > 2:
+        messages[-2] = _with_cache_breakpoint(messages[-2])
+    return messages
+
+
+def get_cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's prompt cache, if reported."""
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+
+def record_usage(model: str, usage, purpose: str = "reply") -> float:
+    """Feeds a completion's token usage into the metrics registry and returns its cost in USD."""
+    if not usage:
+        return 0.0
+    return record_llm_usage(model, usage.prompt_tokens or 0, usage.completion_tokens or 0, get_cached_tokens(usage), purpose)
+
+
+def get_llm_models() -> list[str]:
+    """The primary model followed by the configured fallback chain."""
+    return list(dict.fromkeys([OPENROUTER_MODEL] + LLM_FALLBACK_MODELS))
+
+
+def estimate_candidate_cost(conversation_history: list[dict], max_tokens: int = LLM_MAX_TOKENS) -> float:
+    """
+    Cost in USD a generate_candidate call may reach, known before it runs: the prompt at ~4 characters
+    per token plus a full `max_tokens` completion, priced for the most expensive model in the chain.
+    """
+    prompt_chars = len(SYSTEM_PROMPT) + sum(len(str(message["content"])) for message in conversation_history)
+    prompt_tokens = prompt_chars // PROMPT_CHARS_PER_TOKEN
+    return max(
+        (prompt_tokens * price["prompt"] + max_tokens * price["completion"]) / 1_000_000
+        for price in map(get_model_price, get_llm_models())
+    )
+
+
+async def _create_completion(conversation_history: list[dict], model: str, max_tokens: int = LLM_MAX_TOKENS):
+    return await get_client("openrouter").chat.completions.create(
+        model=model,
+        messages=build_llm_messages(conversation_history, model),
+        temperature=LLM_TEMPERATURE,
+        max_tokens=max_tokens
+    )
+
+
+async def _open_stream(conversation_history: list[dict], model: str):
+    """Starts a streamed completion and waits for its first chunk, so time to first token is bounded."""
+    stream = await get_client("openrouter").chat.completions.create(
+        model=model,
+        messages=build_llm_messages(conversation_history, model),
+        temperature=LLM_TEMPERATURE,
+        max_tokens=LLM_MAX_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    try:
+        return stream, await anext(stream)
+    except BaseException:
+        # Cancelled hedges and failed first reads would otherwise keep the connection open
+        await stream.close()
+        raise
+
+
+async def _close_stream(opened_stream):
+    stream, _ = opened_stream
+    await stream.close()
+
+
+async def _iterate_stream(stream, first_chunk):
+    yield first_chunk
+    async for chunk in stream:
+        yield chunk
+
+async def generate_candidate(conversation_history: list[dict], purpose: str = "surprise",
+                             max_tokens: int = LLM_MAX_TOKENS) -> tuple[str, float]:
+    """
+    One non-streamed completion for pipelines that generate and score several candidates.
+    Not hedged, since candidates already run in parallel. Raises on failure. Returns (text, cost in USD).
+    """
+    response, model = await call_with_fallback(
+        "openrouter", get_llm_models(), lambda model: _create_completion(conversation_history, model, max_tokens),
+        hedge=False, kind="chat"
+    )
+    return response.choices[0].message.content or "", record_usage(model, response.usage, purpose)
+
+
 async def generate_response(chat_id: int, conversation_history: list[dict]) -> str:
     """Generate a response using the LLM with the unified system prompt."""
     
     start_time = time.time()
     
     try:
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT}
-        ] + conversation_history
-        
-        response = await client.chat.completions.create(
-            model=OPENROUTER_MODEL,
-            messages=messages,
-            temperature=LLM_TEMPERATURE,
-            max_tokens=LLM_MAX_TOKENS
+        response, model = await call_with_fallback(
+            "openrouter", get_llm_models(), lambda model: _create_completion(conversation_history, model), kind="chat"
         )
         
         duration = time.time() - start_time
+        observe_stage("llm", duration)
         tokens = response.usage.total_tokens if response.usage else 0
-        estimated_cost = (tokens * 0.75) / 1_000_000
+        cached_tokens = get_cached_tokens(response.usage)
+        cost = record_usage(model, response.usage)
         
-        logging.info(f"LLM_SUCCESS chat_id={chat_id} tokens={tokens} time={duration:.2f}s cost=${estimated_cost:.4f}")
+        logging.info(f"LLM_SUCCESS chat_id={chat_id} model={model} tokens={tokens} cached_tokens={cached_tokens} time={duration:.2f}s cost=${cost:.4f}")
         return response.choices[0].message.content
         
     except Exception as e:
+        count_error("llm")
         logging.error(f"LLM_ERROR chat_id={chat_id}: {e}")
-        return "I seem to be lost for words... could you please try that again? 🤔"
+        return LLM_ERROR_MESSAGE
+
+
+async def stream_response(chat_id: int, conversation_history: list[dict]):
+    """
+    Streaming variant of generate_response: yields text deltas as the model produces them.
+    If the call fails before anything was produced, yields the same fallback text instead.
+    """
+    start_time = time.time()
+    first_token_time = None
+    usage = None
+
+    try:
+        (stream, first_chunk), model = await call_with_fallback(
+            "openrouter", get_llm_models(), lambda model: _open_stream(conversation_history, model),
+            discard_result=_close_stream, kind="stream"
+        )
+
+        async for chunk in _iterate_stream(stream, first_chunk):
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                    observe_stage("llm_first_token", first_token_time)
+                yield delta
+
+        duration = time.time() - start_time
+        observe_stage("llm", duration)
+        tokens = usage.total_tokens if usage else 0
+        cost = record_usage(model, usage)
+        logging.info(
+            f"LLM_SUCCESS chat_id={chat_id} model={model} tokens={tokens} cached_tokens={get_cached_tokens(usage)} "
+            f"first_token={first_token_time or 0:.2f}s time={duration:.2f}s cost=${cost:.4f} stream=true"
+        )
+
+    except Exception as e:
+        count_error("llm")
+        logging.error(f"LLM_ERROR chat_id={chat_id}: {e}")
+        if first_token_time is None:
+            yield LLM_ERROR_MESSAGE
+
+
+SUMMARY_PROMPT = """You maintain a compact memory of a cooking chat between a user and a recipe bot.
+Merge the previous summary with the new messages into one short summary (at most 120 words).
+Keep only what matters for future recipes: ingredients on hand, preferences, dislikes, allergies, goals,
+location, mood, skill level, and recipes already suggested. Write plain sentences, no lists, no JSON."""
+
+async def summarize_conversation(chat_id: int, previous_summary: str, messages: list[dict]) -> str | None:
+    """Folds older messages into the rolling conversation summary. Returns None on failure."""
+    start_time = time.time()
+
+    try:
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        # Background work: no hedging, the extra request would only add cost
+        response, model = await call_with_fallback(
+            "openrouter",
+            get_llm_models(),
+            lambda model: get_client("openrouter").chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Previous summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"}
+                ],
+                temperature=0.2,
+                max_tokens=LLM_SUMMARY_MAX_TOKENS
+            ),
+            hedge=False,
+            kind="summary"
+        )
+
+        duration = time.time() - start_time
+        tokens = response.usage.total_tokens if response.usage else 0
+        cost = record_usage(model, response.usage, purpose="summary")
+        logging.info(f"LLM_SUMMARY chat_id={chat_id} model={model} folded={len(messages)} tokens={tokens} time={duration:.2f}s cost=${cost:.4f}")
+        return response.choices[0].message.content.strip()
+
+    except Exception as e:
+        logging.error(f"LLM_SUMMARY_ERROR chat_id={chat_id}: {e}")
+        return None
@@ -0,0 +1,351 @@
+"""
+End-to-end load test without real credentials.
+Starts a local stand-in server for the OpenRouter/OpenAI endpoints (chat completions, streaming,
+vision, audio transcription) and the Telegram Bot API, with configurable latency distributions
+and error rates. Then feeds synthetic updates from N concurrent simulated users straight into
+the bot's Dispatcher and reports throughput, per-handler end-to-end latency and event-loop lag.
+
+    python load_test.py --users 200 --turns 5 --latency-ms 800 --error-rate 0.02
+    python load_test.py --users 50 --mix text=1 --output load.json
+"""
+import os
+
+# Dummy credentials: every request goes to the local stand-in server, never to real APIs
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:LOADTEST")
+os.environ.setdefault("OPENROUTER_API_KEY", "load-test")
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import tempfile
+import time
+from io import BytesIO
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+from aiohttp import web
+from PIL import Image
+
+import async_database
+import database
+import http_clients
+import message_coalescer
+from benchmark_database import current_commit, percentile
+from main import create_dispatcher
+
+MOCK_BOT_TOKEN = "123456:LOADTEST"
+IDLE_POLL_SECONDS = 0.005
+LOOP_LAG_INTERVAL_SECONDS = 0.01
+STREAM_WORDS_PER_CHUNK = 4
+
+MOCK_REPLY = (
+    "Behold the Chaotic Good Breakfast Skillet! Crack the eggs over the spinach, "
+    "grate a whisper of chocolate on top and let the pan do the talking.\n\n"
+    "**Ingredients:**\n- eggs\n- spinach\n- dark chocolate\n\n"
+    "**Instructions:**\n1. Heat the pan.\n2. Add everything.\n3. Act surprised.\n"
+    "```json\n{\"likes\": [\"eggs\"]}\n```"
+)
+MOCK_INGREDIENTS = "tomatoes, onions, garlic, eggs"
+MOCK_TRANSCRIPT = "I have eggs, spinach and a little bit of chocolate"
+SAMPLE_TEXTS = [
+    "I have chicken and chocolate, surprise me!",
+    "Something quick for dinner, I'm tired",
+    "I'm allergic to peanuts but love spicy food",
+    "What can I make with rice and a sad carrot?",
+]
+
+# Stand-in server behaviour, set from the command line
+mock_settings = {"latency_ms": 800.0, "latency_sigma": 0.5, "token_delay_ms": 20.0, "error_rate": 0.0, "telegram_latency_ms": 30.0}
+mock_stats = {"chat_completions": 0, "streams": 0, "vision": 0, "transcriptions": 0, "upstream_errors": 0, "telegram_calls": 0}
+_mock_files = {}
+_message_ids = [0]
+
+logger = logging.getLogger("load_test")
+
+
+def sample_latency(median_ms: float) -> float:
+    """Log-normally distributed latency in seconds around the given median."""
+    if median_ms <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(median_ms / 1000), mock_settings["latency_sigma"])
+
+
+async def _simulate_upstream():
+    """Waits one sampled upstream latency; returns an error response at the configured error rate."""
+    await asyncio.sleep(sample_latency(mock_settings["latency_ms"]))
+    if random.random() < mock_settings["error_rate"]:
+        mock_stats["upstream_errors"] += 1
+        return web.json_response({"error": {"message": "mock upstream error", "type": "server_error"}}, status=500)
+    return None
+
+
+def _is_vision_request(body: dict) -> bool:
+    return any(
+        isinstance(message.get("content"), list) and any(part.get("type") == "image_url" for part in message["content"])
+        for message in body.get("messages", [])
+    )
+
+
+async def _handle_chat_completions(request):
+    body = await request.json()
+    mock_stats["chat_completions"] += 1
+    error = await _simulate_upstream()
+    if error is not None:
+        return error
+
+    is_vision = _is_vision_request(body)
+    mock_stats["vision"] += is_vision
+    text = MOCK_INGREDIENTS if is_vision else MOCK_REPLY
+    prompt_tokens = sum(len(json.dumps(message)) for message in body.get("messages", [])) // 4
+    completion_tokens = len(text) // 4
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+    base = {"id": f"mock-{mock_stats['chat_completions']}", "created": int(time.time()), "model": body.get("model", "mock")}
+
+    if not body.get("stream"):
+        return web.json_response({
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    mock_stats["streams"] += 1
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    words = text.split(" ")
+    for index in range(0, len(words), STREAM_WORDS_PER_CHUNK):
+        piece = " ".join(words[index:index + STREAM_WORDS_PER_CHUNK]) + (" " if index + STREAM_WORDS_PER_CHUNK < len(words) else "")
+        chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await asyncio.sleep(mock_settings["token_delay_ms"] / 1000)
+    usage_chunk = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+    await response.write(f"data: {json.dumps(usage_chunk)}\n\ndata: [DONE]\n\n".encode())
+    await response.write_eof()
+    return response
+
+
+async def _handle_transcriptions(request):
+    await request.post()
+    mock_stats["transcriptions"] += 1
+    error = await _simulate_upstream()
+    if error is not None:
+        return error
+    return web.json_response({"text": MOCK_TRANSCRIPT})
+
+
+def _mock_message(chat_id, text: str, message_id: int | None = None) -> dict:
+    if message_id is None:
+        _message_ids[0] += 1
+        message_id = _message_ids[0]
+    return {"message_id": message_id, "date": int(time.time()), "chat": {"id": int(chat_id), "type": "private"}, "text": text}
+
+
+async def _handle_bot_method(request):
+    """Minimal Telegram Bot API: answers the methods the handlers call with plausible results."""
+    method = request.match_info["method"]
+    data = await request.post()
+    mock_stats["telegram_calls"] += 1
+    await asyncio.sleep(sample_latency(mock_settings["telegram_latency_ms"]))
+
+    if method == "sendMessage":
+        result = _mock_message(data["chat_id"], data.get("text", ""))
+    elif method == "editMessageText":
+        result = _mock_message(data["chat_id"], data.get("text", ""), int(data["message_id"]))
+    elif method == "getFile":
+        file_id = data["file_id"]
+        kind = "photo" if file_id.startswith("photo-") else "voice"
+        result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(_mock_files[kind]), "file_path": f"{kind}/{file_id}"}
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+async def _handle_file_download(request):
+    kind = request.match_info["path"].split("/")[0]
+    await asyncio.sleep(sample_latency(mock_settings["telegram_latency_ms"]))
+    return web.Response(body=_mock_files[kind])
+
+
+def build_mock_app() -> web.Application:
+    """The stand-in server: OpenAI-compatible endpoints under /v1, the Bot API under /bot<token>/."""
+    photo = BytesIO()
+    Image.effect_noise((1280, 960), 64).convert("RGB").save(photo, format="JPEG", quality=85)
+    _mock_files["photo"] = photo.getvalue()
+    _mock_files["voice"] = b"OggS" + bytes(16000)
+
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app.router.add_post("/v1/chat/completions", _handle_chat_completions)
+    app.router.add_post("/v1/audio/transcriptions", _handle_transcriptions)
+    app.router.add_post("/bot{token}/{method}", _handle_bot_method)
+    app.router.add_get("/file/bot{token}/{path:.+}", _handle_file_download)
+    return app
+
+
+def build_update(bot: Bot, update_id: int, chat_id: int, kind: str, turn: int) -> Update:
+    """A synthetic private-chat update carrying a text, photo or voice message."""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"LoadUser{chat_id}"},
+    }
+    file_id = f"{kind}-{chat_id}-{turn}"
+    if kind == "photo":
+        message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]
+    elif kind == "voice":
+        message["voice"] = {"file_id": file_id, "file_unique_id": file_id, "duration": 3}
+    else:
+        message["text"] = random.choice(SAMPLE_TEXTS)
+    return Update.model_validate({"update_id": update_id, "message": message}, context={"bot": bot})
+
+
+async def simulate_user(dp, bot: Bot, chat_id: int, turns: int, mix: dict, think_ms: float, latencies: dict, next_update_id: list):
+    """Sends `turns` messages, each after the previous reply finished, and records end-to-end latency."""
+    kinds = list(mix)
+    weights = list(mix.values())
+    for turn in range(turns):
+        kind = random.choices(kinds, weights)[0]
+        next_update_id[0] += 1
+        update = build_update(bot, next_update_id[0], chat_id, kind, turn)
+        start_time = time.perf_counter()
+        await dp.feed_update(bot, update)
+        # Text turns are debounced and answered in the background; wait for the reply to be sent
+        while not message_coalescer.is_chat_idle(chat_id):
+            await asyncio.sleep(IDLE_POLL_SECONDS)
+        latencies[kind].append((time.perf_counter() - start_time) * 1000)
+        if think_ms:
+            await asyncio.sleep(random.uniform(0, 2 * think_ms) / 1000)
+
+
+async def monitor_loop_lag(samples: list, stop: asyncio.Event):
+    """Measures how late a short sleep wakes up, i.e. how long the event loop was blocked."""
+    while not stop.is_set():
+        start_time = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        samples.append(max(0.0, (time.perf_counter() - start_time - LOOP_LAG_INTERVAL_SECONDS) * 1000))
+
+
+def summarize_latencies(values: list[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50),
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": values[-1] if values else 0.0,
+    }
+
+
+async def run_load_test(args, mix: dict) -> dict:
+    runner = web.AppRunner(build_mock_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    for upstream in http_clients.UPSTREAMS.values():
+        upstream["base_url"] = f"{base_url}/v1"
+
+    bot = Bot(token=MOCK_BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    dp = create_dispatcher()
+    await async_database.init_db()
+    async_database.start_history_writer()
+
+    latencies = {kind: [] for kind in mix}
+    loop_lag = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(loop_lag, stop))
+    next_update_id = [0]
+
+    start_time = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            simulate_user(dp, bot, 1000 + user, args.turns, mix, args.think_ms, latencies, next_update_id)
+            for user in range(args.users)
+        ))
+    finally:
+        elapsed = time.perf_counter() - start_time
+        stop.set()
+        await lag_task
+        await async_database.stop_history_writer()
+        await bot.session.close()
+        await http_clients.close_clients()
+        await runner.cleanup()
+
+    interactions = sum(len(values) for values in latencies.values())
+    return {
+        "interactions": interactions,
+        "elapsed_seconds": elapsed,
+        "throughput_per_sec": interactions / elapsed if elapsed else 0.0,
+        "handlers": {kind: summarize_latencies(values) for kind, values in latencies.items()},
+        "loop_lag_ms": summarize_latencies(loop_lag),
+        "mock_server": dict(mock_stats),
+    }
+
+
+def parse_mix(values: list[str]) -> dict:
+    """Parses `text=3 photo=1 voice=1` into handler weights."""
+    mix = {}
+    for value in values:
+        kind, _, weight = value.partition("=")
+        if kind not in ("text", "photo", "voice"):
+            raise SystemExit(f"Unknown message kind in --mix: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the bot end to end against local mock LLM and Telegram servers.")
+    parser.add_argument("--users", type=int, default=100, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="Messages sent by each user")
+    parser.add_argument("--mix", nargs="*", default=["text=3", "photo=1", "voice=1"], help="Message kinds and weights")
+    parser.add_argument("--think-ms", type=float, default=500, help="Mean pause between a reply and the next message")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Median upstream latency to first byte")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of upstream latency")
+    parser.add_argument("--token-delay-ms", type=float, default=20, help="Delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream calls failing with HTTP 500")
+    parser.add_argument("--telegram-latency-ms", type=float, default=30, help="Median Telegram Bot API latency")
+    parser.add_argument("--debounce-ms", type=int, help="Override MESSAGE_DEBOUNCE_MS for the run")
+    parser.add_argument("--port", type=int, default=8089, help="Port of the local stand-in server")
+    parser.add_argument("--output", help="Write JSON results to this path")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    mock_settings.update({
+        "latency_ms": args.latency_ms,
+        "latency_sigma": args.latency_sigma,
+        "token_delay_ms": args.token_delay_ms,
+        "error_rate": args.error_rate,
+        "telegram_latency_ms": args.telegram_latency_ms,
+    })
+    if args.debounce_ms is not None:
+        message_coalescer.MESSAGE_DEBOUNCE_MS = args.debounce_ms
+
+    with tempfile.TemporaryDirectory(prefix="recipe-bot-load-") as tmp_dir:
+        database.DB_NAME = os.path.join(tmp_dir, "load.db")
+        results = asyncio.run(run_load_test(args, mix))
+        async_database.shutdown_db_executor()
+
+    report = {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
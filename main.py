@@ -5,7 +5,13 @@ from logging.handlers import RotatingFileHandler
 from aiogram import Bot, Dispatcher
 from config import TELEGRAM_BOT_TOKEN
 from handlers import router
-from database import init_db
+from async_database import init_db, shutdown_db_executor, start_history_writer, stop_history_writer
+from retention import start_retention_job, stop_retention_job
+from metrics import start_metrics_server, stop_metrics_server
+from http_clients import close_clients
+from image_processor import shutdown_image_executor
+from audio_processor import shutdown_audio_executor
+from vision_cache import load_vision_cache
 
 def setup_logging():
     """Setup logging with rotating file handler and console output for Docker"""
@@ -24,17 +30,35 @@ def setup_logging():
         ]
     )
 
+def create_dispatcher() -> Dispatcher:
+    """Dispatcher with every bot handler registered."""
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
 async def main():
     setup_logging()
     logging.info("Starting Funny Recipe Bot...")
     
-    init_db()
+    await init_db()
+    start_history_writer()
+    await load_vision_cache()
+    start_retention_job()
+    await start_metrics_server()
     
     bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    dp = Dispatcher()
-    dp.include_router(router)
+    dp = create_dispatcher()
     
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await stop_metrics_server()
+        await stop_retention_job()
+        await stop_history_writer()
+        shutdown_db_executor()
+        shutdown_image_executor()
+        shutdown_audio_executor()
+        await close_clients()
 
 if __name__ == "__main__":
     asyncio.run(main())
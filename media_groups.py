@@ -0,0 +1,55 @@
+"""
+Collects the photos of a Telegram album (media group).
+Telegram delivers every album item as its own update, all sharing a media_group_id; items
+arriving within MEDIA_GROUP_WINDOW_MS of each other are handed over as one batch.
+"""
+import asyncio
+import logging
+
+from config import MEDIA_GROUP_WINDOW_MS
+from metrics import register_gauge
+
+# media_group_id -> {"messages": [...], "timer": Task}
+_groups = {}
+media_group_stats = {"albums": 0, "album_photos": 0}
+
+
+def submit_album_message(media_group_id: str, message, run_album):
+    """
+    Adds a message to its album and (re)starts the collection window.
+    `run_album(messages)` is awaited once with every message of the album, in message order.
+    """
+    group = _groups.get(media_group_id)
+    if group is None:
+        group = {"messages": [], "timer": None}
+        _groups[media_group_id] = group
+    group["messages"].append(message)
+
+    if group["timer"] is not None:
+        group["timer"].cancel()
+    group["timer"] = asyncio.create_task(_run_after_window(media_group_id, run_album))
+
+
+async def _run_after_window(media_group_id: str, run_album):
+    await asyncio.sleep(MEDIA_GROUP_WINDOW_MS / 1000)
+
+    messages = sorted(_groups.pop(media_group_id)["messages"], key=lambda message: message.message_id)
+    media_group_stats["albums"] += 1
+    media_group_stats["album_photos"] += len(messages)
+    logging.info(f"MEDIA_GROUP media_group_id={media_group_id} collected={len(messages)} messages")
+    try:
+        await run_album(messages)
+    except Exception as e:
+        logging.error(f"Error handling album {media_group_id}: {e}")
+
+
+register_gauge(
+    "recipe_bot_media_group_pending_messages",
+    "Album messages waiting for their collection window to close",
+    lambda: [({}, sum(len(group["messages"]) for group in _groups.values()))]
+)
+
+
+def get_media_group_stats() -> dict:
+    """Returns album and album-photo counters."""
+    return dict(media_group_stats)
@@ -0,0 +1,109 @@
+"""
+Per-chat debounce for text messages.
+Messages arriving within MESSAGE_DEBOUNCE_MS of each other are merged into one turn,
+turns of a chat run one at a time, and an LLM generation still in flight is cancelled
+as soon as newer input for the same chat arrives.
+"""
+import asyncio
+import logging
+
+from config import MESSAGE_DEBOUNCE_MS
+from metrics import register_gauge
+
+# chat_id -> {"messages": [...], "timer": Task | None, "generation": Task | None, "lock": Lock,
+#             "turns": number of turns running or waiting for the lock}
+_chats = {}
+coalescing_stats = {"turns": 0, "merged_messages": 0, "cancelled_generations": 0}
+
+
+def _get_chat_state(chat_id: int) -> dict:
+    state = _chats.get(chat_id)
+    if state is None:
+        state = {"messages": [], "timer": None, "generation": None, "lock": asyncio.Lock(), "turns": 0}
+        _chats[chat_id] = state
+    return state
+
+
+def submit_message(chat_id: int, message, run_turn):
+    """
+    Queues a message for the chat's next turn and (re)starts the debounce window.
+    `run_turn(messages)` is awaited with every message collected in the window.
+    """
+    state = _get_chat_state(chat_id)
+    state["messages"].append(message)
+
+    generation = state["generation"]
+    if generation is not None and not generation.done():
+        generation.cancel()
+        coalescing_stats["cancelled_generations"] += 1
+        logging.info(f"COALESCE chat_id={chat_id} superseded in-flight generation")
+
+    if state["timer"] is not None:
+        state["timer"].cancel()
+    state["timer"] = asyncio.create_task(_run_after_window(chat_id, run_turn))
+
+
+async def _run_after_window(chat_id: int, run_turn):
+    state = _chats[chat_id]
+    await asyncio.sleep(MESSAGE_DEBOUNCE_MS / 1000)
+
+    messages = state["messages"]
+    state["messages"] = []
+    state["timer"] = None
+    coalescing_stats["turns"] += 1
+    if len(messages) > 1:
+        coalescing_stats["merged_messages"] += len(messages) - 1
+        logging.info(f"COALESCE chat_id={chat_id} merged={len(messages)} messages into one turn")
+
+    # Counted before waiting for the lock: the state (and its lock) must outlive every queued turn
+    state["turns"] += 1
+    try:
+        async with state["lock"]:
+            await run_turn(messages)
+    except Exception as e:
+        logging.error(f"Error handling coalesced turn for chat_id={chat_id}: {e}")
+    finally:
+        state["turns"] -= 1
+        if not state["messages"] and state["timer"] is None and state["turns"] == 0:
+            _chats.pop(chat_id, None)
+
+
+async def run_generation(chat_id: int, coroutine):
+    """
+    Runs the chat's LLM generation as a task that newer input can cancel.
+    Returns its result, or None if it was superseded.
+    Called from a turn, which keeps the chat's state alive until it ends; outside a turn the
+    generation simply runs without being cancellable.
+    """
+    state = _chats.get(chat_id)
+    if state is None:
+        return await coroutine
+    generation = asyncio.create_task(coroutine)
+    state["generation"] = generation
+    try:
+        return await generation
+    except asyncio.CancelledError:
+        # Re-raise if the turn itself is being cancelled rather than just its generation
+        if asyncio.current_task().cancelling():
+            raise
+        return None
+    finally:
+        if state["generation"] is generation:
+            state["generation"] = None
+
+
+register_gauge(
+    "recipe_bot_debounce_pending_messages",
+    "Text messages waiting for their chat's debounce window to close",
+    lambda: [({}, sum(len(state["messages"]) for state in _chats.values()))]
+)
+
+
+def is_chat_idle(chat_id: int) -> bool:
+    """True when the chat has no messages waiting for a turn and no turn running."""
+    return chat_id not in _chats
+
+
+def get_coalescing_stats() -> dict:
+    """Returns turn, merged-message and cancelled-generation counters."""
+    return dict(coalescing_stats)
@@ -0,0 +1,178 @@
+"""
+In-process metrics registry exposed in the Prometheus text format.
+Counters and histograms are updated in place on the event loop; gauges for queue depths are
+read from registered callbacks at scrape time. Served on METRICS_HOST:METRICS_PORT/metrics.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT, LLM_PRICING
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# USD per 1M tokens; "cached" is the price of prompt tokens served from the provider's cache.
+# Entries from LLM_PRICING override these, "default" prices models missing from the table.
+DEFAULT_LLM_PRICING = {
+    "anthropic/claude-3.5-haiku": {"prompt": 0.80, "completion": 4.00, "cached": 0.08},
+    "anthropic/claude-3.5-sonnet": {"prompt": 3.00, "completion": 15.00, "cached": 0.30},
+    "openai/gpt-4o-mini": {"prompt": 0.15, "completion": 0.60, "cached": 0.075},
+    "google/gemini-2.0-flash-exp:free": {"prompt": 0.0, "completion": 0.0},
+    "default": {"prompt": 0.75, "completion": 0.75},
+}
+llm_pricing = {**DEFAULT_LLM_PRICING, **LLM_PRICING}
+
+# name -> {"type": ..., "help": ..., "values": {labels tuple: value}}
+_metrics = {}
+# name -> {"help": ..., "collect": callable returning [(labels dict, value), ...]}
+_gauge_callbacks = {}
+_server = {"runner": None}
+
+
+def _get_metric(name: str, metric_type: str, help_text: str) -> dict:
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = {"type": metric_type, "help": help_text, "values": {}}
+        _metrics[name] = metric
+    return metric
+
+
+def inc_counter(name: str, help_text: str, value: float = 1, **labels):
+    """Adds `value` to a counter."""
+    values = _get_metric(name, "counter", help_text)["values"]
+    key = tuple(sorted(labels.items()))
+    values[key] = values.get(key, 0) + value
+
+
+def observe_histogram(name: str, help_text: str, value: float, **labels):
+    """Records one observation in a histogram with LATENCY_BUCKETS."""
+    values = _get_metric(name, "histogram", help_text)["values"]
+    key = tuple(sorted(labels.items()))
+    histogram = values.get(key)
+    if histogram is None:
+        histogram = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        values[key] = histogram
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if value <= bound:
+            histogram["buckets"][index] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+
+def register_gauge(name: str, help_text: str, collect):
+    """Registers a gauge read at scrape time; `collect()` returns [(labels dict, value), ...]."""
+    _gauge_callbacks[name] = {"help": help_text, "collect": collect}
+
+
+def observe_stage(stage: str, seconds: float):
+    observe_histogram("recipe_bot_stage_seconds", "Latency of request pipeline stages", seconds, stage=stage)
+
+
+def count_error(stage: str):
+    inc_counter("recipe_bot_errors_total", "Errors by pipeline stage", stage=stage)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Times the enclosed block as a pipeline stage and counts it as an error if it raises."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        count_error(stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start_time)
+
+
+def get_model_price(model: str) -> dict:
+    return llm_pricing.get(model) or llm_pricing["default"]
+
+
+def record_llm_usage(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, purpose: str = "reply") -> float:
+    """Counts prompt, cached and completion tokens and their cost for one completion. Returns the cost in USD."""
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    price = get_model_price(model)
+    cost = (
+        (prompt_tokens - cached_tokens) * price["prompt"]
+        + cached_tokens * price.get("cached", price["prompt"])
+        + completion_tokens * price["completion"]
+    ) / 1_000_000
+
+    help_text = "LLM tokens by model and kind"
+    inc_counter("recipe_bot_llm_tokens_total", help_text, prompt_tokens - cached_tokens, model=model, kind="prompt", purpose=purpose)
+    inc_counter("recipe_bot_llm_tokens_total", help_text, cached_tokens, model=model, kind="cached_prompt", purpose=purpose)
+    inc_counter("recipe_bot_llm_tokens_total", help_text, completion_tokens, model=model, kind="completion", purpose=purpose)
+    inc_counter("recipe_bot_llm_cost_usd_total", "Estimated LLM spend from the pricing table", cost, model=model, purpose=purpose)
+    inc_counter("recipe_bot_llm_requests_total", "Successful LLM completions", model=model, purpose=purpose)
+    return cost
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in pairs) + "}"
+
+
+def render_metrics() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in sorted(_metrics.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric["values"].items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+
+    for name, gauge in sorted(_gauge_callbacks.items()):
+        try:
+            samples = gauge["collect"]()
+        except Exception as e:
+            logging.warning(f"Metrics gauge {name} failed: {e}")
+            continue
+        lines.append(f"# HELP {name} {gauge['help']}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_metrics(request):
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server():
+    """Serves /metrics on METRICS_HOST:METRICS_PORT; a port of 0 disables the endpoint."""
+    if not METRICS_PORT or _server["runner"] is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    _server["runner"] = runner
+    logging.info(f"Metrics endpoint listening on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def stop_metrics_server():
+    if _server["runner"] is not None:
+        await _server["runner"].cleanup()
+        _server["runner"] = None
+
+
+def reset_metrics():
+    """Drops all recorded counters and histograms (registered gauges are kept)."""
+    _metrics.clear()
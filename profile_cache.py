@@ -0,0 +1,89 @@
+"""
+Bounded LRU/TTL cache of parsed user profiles sitting in front of user_profiles.
+Writers update or invalidate entries so hot chats need no DB reads for profile data.
+"""
+import time
+from collections import OrderedDict
+
+from config import PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS
+
+# user_id -> (stored_at, profile dict); most recently used entries at the end
+_profiles = OrderedDict()
+profile_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+
+def _copy_profile(profile: dict) -> dict:
+    """Returns a copy callers can mutate without touching the cached entry."""
+    return {**profile, "preferences": dict(profile.get("preferences") or {})}
+
+
+def get_cached_profile(user_id: int) -> dict | None:
+    """Returns a cached profile, or None on a miss or an expired entry."""
+    entry = _profiles.get(user_id)
+    if entry is None:
+        profile_cache_stats["misses"] += 1
+        return None
+
+    stored_at, profile = entry
+    if time.monotonic() - stored_at > PROFILE_CACHE_TTL_SECONDS:
+        del _profiles[user_id]
+        profile_cache_stats["expirations"] += 1
+        profile_cache_stats["misses"] += 1
+        return None
+
+    _profiles.move_to_end(user_id)
+    profile_cache_stats["hits"] += 1
+    return _copy_profile(profile)
+
+
+def cache_profile(user_id: int, profile: dict):
+    """Stores a parsed profile, evicting the least recently used entries beyond PROFILE_CACHE_SIZE."""
+    _profiles[user_id] = (time.monotonic(), _copy_profile(profile))
+    _profiles.move_to_end(user_id)
+    while len(_profiles) > PROFILE_CACHE_SIZE:
+        _profiles.popitem(last=False)
+        profile_cache_stats["evictions"] += 1
+
+
+def update_cached_profile(user_id: int, **fields):
+    """Write-through update of selected fields of a cached profile; no-op if the user isn't cached."""
+    entry = _profiles.get(user_id)
+    if entry is None:
+        return
+    entry[1].update(fields)
+
+
+def _json_merge_patch(target: dict, patch: dict) -> dict:
+    """Applies an RFC 7396 merge patch, the same rules SQLite's json_patch uses."""
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            existing = target.get(key)
+            target[key] = _json_merge_patch(existing if isinstance(existing, dict) else {}, value)
+        else:
+            target[key] = value
+    return target
+
+
+def merge_cached_preferences(user_id: int, preferences: dict):
+    """Write-through merge of preferences into a cached profile, mirroring update_user_preferences."""
+    entry = _profiles.get(user_id)
+    if entry is None:
+        return
+    _json_merge_patch(entry[1]["preferences"], preferences)
+
+
+def invalidate_profile(user_id: int):
+    """Drops a user's cached profile."""
+    _profiles.pop(user_id, None)
+
+
+def clear_profile_cache():
+    """Drops every cached profile."""
+    _profiles.clear()
+
+
+def get_profile_cache_stats() -> dict:
+    """Returns hit/miss/eviction counters plus the current cache size."""
+    return {**profile_cache_stats, "size": len(_profiles)}
@@ -0,0 +1,117 @@
+"""
+Re-shard tool: copies every user profile, history row, archive batch and summary from the
+current shard layout into a new one, routing each chat_id to its new shard. The global
+vision cache is copied from the first shard to the first shard.
+
+Run while the bot is stopped, then move the new files next to DB_NAME and set DB_SHARDS:
+    python reshard.py --from-shards 1 --to-shards 4 --output-dir resharded/
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import time
+
+import database
+
+COPY_BATCH_SIZE = 5000
+
+# Row ids are not copied: shards number rows independently, and a chat's rows all come
+# from one source shard in id order, so per-chat message order is preserved.
+TABLE_COPIES = {
+    "user_profiles": (
+        "SELECT user_id, journey_stage, preferences, interaction_count, created_at, updated_at FROM user_profiles ORDER BY user_id",
+        "INSERT OR REPLACE INTO user_profiles (user_id, journey_stage, preferences, interaction_count, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+    ),
+    "conversation_history": (
+        "SELECT user_id, role, content, timestamp FROM conversation_history ORDER BY id",
+        "INSERT INTO conversation_history (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+    ),
+    "conversation_history_archive": (
+        "SELECT user_id, first_message_id, last_message_id, message_count, messages, archived_at "
+        "FROM conversation_history_archive ORDER BY id",
+        "INSERT INTO conversation_history_archive (user_id, first_message_id, last_message_id, message_count, messages, archived_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+    ),
+    "conversation_summaries": (
+        "SELECT user_id, summary, last_folded_hash, updated_at FROM conversation_summaries ORDER BY user_id",
+        "INSERT OR REPLACE INTO conversation_summaries (user_id, summary, last_folded_hash, updated_at) VALUES (?, ?, ?, ?)",
+    ),
+}
+
+# Not keyed by chat: lives on the first shard in every layout
+VISION_CACHE_COPY = (
+    "SELECT file_unique_id, phash, ingredients, created_at FROM vision_cache ORDER BY created_at, rowid",
+    "INSERT OR REPLACE INTO vision_cache (file_unique_id, phash, ingredients, created_at) VALUES (?, ?, ?, ?)",
+)
+
+
+def _flush_batches(target_conns: list, insert_sql: str, batches: list[list]):
+    """Writes every non-empty per-shard batch inside one transaction per target shard."""
+    for target_conn, batch in zip(target_conns, batches):
+        if batch:
+            with target_conn:
+                target_conn.executemany(insert_sql, batch)
+            batch.clear()
+
+
+def reshard(from_shards: int, to_shards: int, output_dir: str, db_name: str | None = None) -> dict:
+    """Streams all rows from the source layout into freshly initialized target shards and returns row counts."""
+    db_name = db_name or database.DB_NAME
+    os.makedirs(output_dir, exist_ok=True)
+    target_base = os.path.join(output_dir, os.path.basename(db_name))
+    target_conns = []
+    for shard in range(to_shards):
+        # Same pragmas as live shards (incremental auto_vacuum, WAL), set before init_db creates the tables
+        conn = database.open_db_connection(database.get_shard_path(shard, to_shards, target_base))
+        database.init_db(conn=conn)
+        target_conns.append(conn)
+
+    copied = {table: 0 for table in TABLE_COPIES}
+    copied["vision_cache"] = 0
+    for source_shard in range(from_shards):
+        source_path = database.get_shard_path(source_shard, from_shards, db_name)
+        source_conn = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        for table, (select_sql, insert_sql) in TABLE_COPIES.items():
+            batches = [[] for _ in range(to_shards)]
+            pending = 0
+            for row in source_conn.execute(select_sql):
+                batches[database.get_shard_index(row[0], to_shards)].append(row)
+                pending += 1
+                if pending >= COPY_BATCH_SIZE:
+                    _flush_batches(target_conns, insert_sql, batches)
+                    pending = 0
+                copied[table] += 1
+            _flush_batches(target_conns, insert_sql, batches)
+        if source_shard == 0:
+            select_sql, insert_sql = VISION_CACHE_COPY
+            cursor = source_conn.execute(select_sql)
+            while rows := cursor.fetchmany(COPY_BATCH_SIZE):
+                with target_conns[0]:
+                    target_conns[0].executemany(insert_sql, rows)
+                copied["vision_cache"] += len(rows)
+        source_conn.close()
+        logging.info(f"Copied shard {source_shard + 1}/{from_shards} from {source_path}")
+
+    for conn in target_conns:
+        conn.close()
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the bot database into a new shard layout.")
+    parser.add_argument("--from-shards", type=int, required=True, help="Current DB_SHARDS value")
+    parser.add_argument("--to-shards", type=int, required=True, help="New DB_SHARDS value")
+    parser.add_argument("--output-dir", required=True, help="Directory for the new shard files")
+    parser.add_argument("--db-name", default=database.DB_NAME, help="Base database file name")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    start_time = time.perf_counter()
+    copied = reshard(args.from_shards, args.to_shards, args.output_dir, args.db_name)
+    logging.info(f"Re-shard finished in {time.perf_counter() - start_time:.1f}s: {copied}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Shared resilience layer for upstream API calls (OpenRouter, OpenAI).
+Every call gets a per-attempt timeout and an overall deadline, retries transient errors with
+jittered exponential backoff, and is hedged with a second attempt once it runs longer than the
+observed p95 latency. Calls are grouped by kind ("openrouter:chat", "openrouter:vision", ...):
+each kind of each upstream and each model within it has its own circuit breaker and latency
+window, so failing vision calls never block chat replies and first-chunk latencies of streams
+are not mixed with full completions. Fallback models are tried in order of their observed
+latency and error rate.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+import openai
+
+from metrics import register_gauge
+
+from config import (
+    UPSTREAM_ATTEMPT_TIMEOUT_SECONDS,
+    UPSTREAM_DEADLINE_SECONDS,
+    UPSTREAM_MAX_RETRIES,
+    UPSTREAM_BACKOFF_BASE_MS,
+    UPSTREAM_HEDGING,
+    CIRCUIT_BREAKER_FAILURES,
+    CIRCUIT_BREAKER_RESET_SECONDS,
+)
+
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+RANKING_MIN_SAMPLES = 5
+ERROR_RATE_ALPHA = 0.2
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+# "upstream" or "upstream:model" -> breaker and latency/error statistics
+_targets = {}
+# Cleanups of hedged attempts that completed after another attempt had already won
+_discard_tasks = set()
+
+
+def _get_target(key: str) -> dict:
+    target = _targets.get(key)
+    if target is None:
+        target = {
+            "state": "closed",
+            "consecutive_failures": 0,
+            "opened_at": 0.0,
+            "probing": False,
+            "latencies": deque(maxlen=LATENCY_WINDOW),
+            "error_rate": 0.0,
+            "calls": 0,
+            "failures": 0,
+            "retries": 0,
+            "hedges": 0,
+        }
+        _targets[key] = target
+    return target
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for timeouts, connection problems, rate limits and server-side errors."""
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def breaker_allows(key: str) -> bool:
+    """Closed breakers allow calls; an open one lets a single probe through after the reset period."""
+    target = _get_target(key)
+    if target["state"] == "closed":
+        return True
+    if target["state"] == "open" and time.monotonic() - target["opened_at"] >= CIRCUIT_BREAKER_RESET_SECONDS:
+        target["state"] = "half_open"
+        target["probing"] = False
+    if target["state"] == "half_open" and not target["probing"]:
+        target["probing"] = True
+        return True
+    return False
+
+
+def record_success(key: str, latency: float | None = None):
+    target = _get_target(key)
+    target["calls"] += 1
+    if latency is not None:
+        target["latencies"].append(latency)
+    target["error_rate"] *= 1 - ERROR_RATE_ALPHA
+    target["consecutive_failures"] = 0
+    if target["state"] != "closed":
+        logging.info(f"CIRCUIT_CLOSED {key}")
+    target["state"] = "closed"
+    target["probing"] = False
+
+
+def release_probe(key: str):
+    """Lets the next call probe a half-open breaker when this one ended without a verdict."""
+    _get_target(key)["probing"] = False
+
+
+def record_failure(key: str):
+    target = _get_target(key)
+    target["calls"] += 1
+    target["failures"] += 1
+    target["error_rate"] = target["error_rate"] * (1 - ERROR_RATE_ALPHA) + ERROR_RATE_ALPHA
+    target["consecutive_failures"] += 1
+    if target["state"] == "half_open" or target["consecutive_failures"] >= CIRCUIT_BREAKER_FAILURES:
+        if target["state"] != "open":
+            logging.warning(f"CIRCUIT_OPEN {key} after {target['consecutive_failures']} consecutive failures")
+        target["state"] = "open"
+        target["opened_at"] = time.monotonic()
+        target["probing"] = False
+
+
+def get_latency_percentile(key: str, fraction: float) -> float | None:
+    """Observed latency percentile of successful calls, or None without enough samples."""
+    latencies = sorted(_get_target(key)["latencies"])
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+def rank_models(upstream: str, models: list[str]) -> list[str]:
+    """
+    Keeps the primary model first while its breaker is closed and orders the fallbacks by
+    expected time to a successful answer (p50 latency inflated by error rate). Once the primary's
+    breaker has opened it is ranked like any other model. Models without enough samples keep
+    their configured order behind the measured ones.
+    """
+    def expected_latency(model: str) -> float:
+        target = _get_target(f"{upstream}:{model}")
+        if len(target["latencies"]) < RANKING_MIN_SAMPLES:
+            return float("inf")
+        return get_latency_percentile(f"{upstream}:{model}", 0.5) / max(1 - target["error_rate"], 0.05)
+
+    if models and _get_target(f"{upstream}:{models[0]}")["state"] == "closed":
+        return [models[0]] + sorted(models[1:], key=expected_latency)
+    return sorted(models, key=expected_latency)
+
+
+async def _timed_attempt(make_call, timeout: float):
+    start_time = time.monotonic()
+    result = await asyncio.wait_for(make_call(), timeout)
+    return result, time.monotonic() - start_time
+
+
+async def _discard(discard_result, result):
+    try:
+        await discard_result(result)
+    except Exception as e:
+        logging.warning(f"Failed to release a losing hedged result: {e!r}")
+
+
+def _discard_if_completed(task: asyncio.Task, discard_result):
+    """Done callback of a losing attempt: releases its result if it completed anyway."""
+    if task.cancelled() or task.exception() is not None:
+        return
+    result, _ = task.result()
+    cleanup = asyncio.get_running_loop().create_task(_discard(discard_result, result))
+    _discard_tasks.add(cleanup)
+    cleanup.add_done_callback(_discard_tasks.discard)
+
+
+async def _hedged_attempt(key: str, make_call, timeout: float, hedge: bool, discard_result=None):
+    """
+    Runs one attempt; if it is still pending after the observed p95 latency, fires a duplicate
+    and returns whichever finishes successfully first. Losing attempts are cancelled, and
+    `discard_result(result)` is awaited for any of them that completed anyway (e.g. to close a stream).
+    """
+    hedge_after = get_latency_percentile(key, 0.95) if hedge and len(_get_target(key)["latencies"]) >= HEDGE_MIN_SAMPLES else None
+    attempts = [asyncio.create_task(_timed_attempt(make_call, timeout))]
+    winner = None
+    try:
+        if hedge_after is not None and hedge_after < timeout:
+            done, _ = await asyncio.wait(attempts, timeout=hedge_after)
+            if not done:
+                _get_target(key)["hedges"] += 1
+                logging.info(f"UPSTREAM_HEDGE {key} after {hedge_after:.2f}s")
+                attempts.append(asyncio.create_task(_timed_attempt(make_call, timeout - hedge_after)))
+
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in attempts:
+            if task is winner:
+                continue
+            task.cancel()
+            if discard_result is not None:
+                task.add_done_callback(lambda task: _discard_if_completed(task, discard_result))
+
+
+async def call_with_retries(key: str, make_call, deadline: float, hedge: bool = UPSTREAM_HEDGING, discard_result=None):
+    """
+    Calls `make_call()` (a coroutine factory) against one target until it succeeds, a non-retryable
+    error occurs, retries run out or the deadline (monotonic time) passes. Feeds the target's breaker.
+    `discard_result` releases results of hedged attempts that lost the race.
+    """
+    for attempt in range(UPSTREAM_MAX_RETRIES + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError(f"{key} deadline exceeded")
+        try:
+            result, latency = await _hedged_attempt(
+                key, make_call, min(UPSTREAM_ATTEMPT_TIMEOUT_SECONDS, remaining), hedge, discard_result
+            )
+            record_success(key, latency)
+            return result
+        except asyncio.CancelledError:
+            release_probe(key)
+            raise
+        except Exception as e:
+            # Client-side errors (bad request, auth) say nothing about the target's health
+            if not is_retryable(e):
+                release_probe(key)
+                raise
+            record_failure(key)
+            if attempt == UPSTREAM_MAX_RETRIES or not breaker_allows(key):
+                raise
+            backoff = random.uniform(0, UPSTREAM_BACKOFF_BASE_MS / 1000 * 2 ** attempt)
+            if time.monotonic() + backoff >= deadline:
+                raise
+            _get_target(key)["retries"] += 1
+            logging.warning(f"UPSTREAM_RETRY {key} attempt={attempt + 1} backoff={backoff:.2f}s: {e!r}")
+            await asyncio.sleep(backoff)
+
+
+async def call_with_fallback(upstream: str, models: list[str], make_call, hedge: bool = UPSTREAM_HEDGING,
+                             deadline_seconds: float = UPSTREAM_DEADLINE_SECONDS, discard_result=None,
+                             kind: str | None = None):
+    """
+    Calls `make_call(model)` on the best-ranked model whose breaker allows it, falling back to the
+    next one on failure, all within one overall deadline. Returns (result, model used).
+    Raises the last error when every model failed or was skipped. Results that hold a connection
+    (streams) should pass an async `discard_result(result)` so hedged duplicates get closed.
+    `kind` names the call type; breakers and latency windows are kept per "upstream:kind".
+    """
+    if kind:
+        upstream = f"{upstream}:{kind}"
+    deadline = time.monotonic() + deadline_seconds
+    if not breaker_allows(upstream):
+        raise RuntimeError(f"Circuit open for {upstream}")
+
+    error = RuntimeError(f"Circuit open for every {upstream} model")
+    try:
+        for model in rank_models(upstream, models):
+            key = f"{upstream}:{model}"
+            if time.monotonic() >= deadline:
+                error = asyncio.TimeoutError(f"{upstream} deadline exceeded")
+                break
+            if not breaker_allows(key):
+                continue
+            try:
+                result = await call_with_retries(key, lambda: make_call(model), deadline, hedge, discard_result)
+                record_success(upstream)
+                return result, model
+            except Exception as e:
+                error = e
+                logging.warning(f"UPSTREAM_FAILED {key}: {e!r}")
+    except asyncio.CancelledError:
+        release_probe(upstream)
+        raise
+
+    if is_retryable(error):
+        record_failure(upstream)
+    else:
+        release_probe(upstream)
+    raise error
+
+
+def get_resilience_stats() -> dict:
+    """Breaker state, call/failure/retry/hedge counters and latency percentiles per target."""
+    return {
+        key: {
+            "state": target["state"],
+            "calls": target["calls"],
+            "failures": target["failures"],
+            "retries": target["retries"],
+            "hedges": target["hedges"],
+            "error_rate": round(target["error_rate"], 3),
+            "p50_seconds": get_latency_percentile(key, 0.5),
+            "p95_seconds": get_latency_percentile(key, 0.95),
+        }
+        for key, target in _targets.items()
+    }
+
+
+register_gauge(
+    "recipe_bot_upstream_circuit_open",
+    "1 while the circuit breaker of an upstream or upstream:model is open or half-open",
+    lambda: [({"target": key}, int(target["state"] != "closed")) for key, target in _targets.items()]
+)
+register_gauge(
+    "recipe_bot_upstream_error_rate",
+    "Recent error rate (EWMA) of an upstream or upstream:model",
+    lambda: [({"target": key}, round(target["error_rate"], 4)) for key, target in _targets.items()]
+)
+
+
+def reset_resilience_state():
+    """Forgets all breaker and latency state."""
+    _targets.clear()
@@ -0,0 +1,99 @@
+"""
+Background retention job for conversation_history.
+Finds the users whose history exceeds the retention window and prunes it in small batches
+that go through the shared DB worker, pausing between lookups and batches so live traffic
+is never starved.
+"""
+import asyncio
+import logging
+import time
+
+import database
+from async_database import run_db_on_shard, run_user_db
+from config import (
+    DB_SHARDS,
+    MAX_CONTEXT_MESSAGES,
+    HISTORY_RETENTION_MESSAGES,
+    HISTORY_RETENTION_INTERVAL_SECONDS,
+    HISTORY_RETENTION_BATCH_SIZE,
+    HISTORY_RETENTION_PAUSE_MS,
+    HISTORY_RETENTION_ARCHIVE,
+)
+
+USER_PAGE_SIZE = 500
+VACUUM_PAGES_PER_PASS = 2000
+
+_retention_task = None
+
+
+async def run_retention_pass() -> dict:
+    """Runs one full pruning pass over all users over the window and returns rows removed and time spent."""
+    start_time = time.perf_counter()
+    # Never prune below what the bot reads back as LLM context
+    keep_last = max(HISTORY_RETENTION_MESSAGES, MAX_CONTEXT_MESSAGES)
+    rows_removed = 0
+    batches = 0
+
+    for shard in range(DB_SHARDS):
+        shard_rows_removed = 0
+        last_user_id = None
+        while True:
+            user_ids, last_checked_user_id = await run_db_on_shard(
+                shard, database.get_users_over_history_limit, last_user_id, keep_last, USER_PAGE_SIZE, shard
+            )
+            if last_checked_user_id is None:
+                break
+            await asyncio.sleep(HISTORY_RETENTION_PAUSE_MS / 1000)
+            for user_id in user_ids:
+                while True:
+                    removed = await run_user_db(
+                        user_id, database.prune_user_history, keep_last, HISTORY_RETENTION_BATCH_SIZE, HISTORY_RETENTION_ARCHIVE
+                    )
+                    if not removed:
+                        break
+                    shard_rows_removed += removed
+                    batches += 1
+                    await asyncio.sleep(HISTORY_RETENTION_PAUSE_MS / 1000)
+                    if removed < HISTORY_RETENTION_BATCH_SIZE:
+                        break
+            last_user_id = last_checked_user_id
+
+        if shard_rows_removed:
+            await run_db_on_shard(shard, database.compact_database, VACUUM_PAGES_PER_PASS, shard)
+        rows_removed += shard_rows_removed
+
+    duration = time.perf_counter() - start_time
+    logging.info(f"HISTORY_RETENTION rows_removed={rows_removed} batches={batches} time={duration:.2f}s")
+    return {"rows_removed": rows_removed, "batches": batches, "duration_seconds": duration}
+
+
+async def _retention_loop():
+    """Runs a retention pass every HISTORY_RETENTION_INTERVAL_SECONDS."""
+    while True:
+        try:
+            await run_retention_pass()
+        except Exception as e:
+            logging.error(f"History retention pass failed: {e}")
+        await asyncio.sleep(HISTORY_RETENTION_INTERVAL_SECONDS)
+
+
+def start_retention_job():
+    """Starts the background retention job unless HISTORY_RETENTION_MESSAGES is 0."""
+    global _retention_task
+    if HISTORY_RETENTION_MESSAGES <= 0 or _retention_task is not None:
+        return
+    _retention_task = asyncio.create_task(_retention_loop())
+    logging.info(f"History retention enabled: keeping the last {HISTORY_RETENTION_MESSAGES} messages per user.")
+
+
+async def stop_retention_job():
+    """Cancels the background retention job."""
+    global _retention_task
+    if _retention_task is None:
+        return
+    _retention_task.cancel()
+    try:
+        await _retention_task
+    except asyncio.CancelledError:
+        pass
+    _retention_task = None
@@ -2,10 +2,17 @@
 Surprise verification system for ensuring recipes meet surprise criteria and include humor.
 Following @conventions.md: functions only, simple data structures, KISS principle.
 """
+import asyncio
 import re
 import logging
-import openai
-from config import OPENROUTER_API_KEY, OPENROUTER_MODEL, LLM_TEMPERATURE, LLM_MAX_TOKENS
+from config import (
+    OPENROUTER_MODEL, LLM_TEMPERATURE,
+    SURPRISE_CANDIDATES, SURPRISE_MAX_ROUNDS, SURPRISE_COST_CAP_USD, SURPRISE_MAX_TOKENS
+)
+from http_clients import get_client
+from llm_client import generate_candidate, estimate_candidate_cost, record_usage
+from metrics import inc_counter, track_stage
+from ingredient_vocabulary import find_ingredients, get_ingredient_category
 import time
 
 # Surprise scoring constants
@@ -75,47 +82,17 @@ def calculate_surprise_score(ingredients: list, user_profile: dict) -> float:
     score = 0.0
     total_pairs = 0
     
-    # Convert ingredients to lowercase for comparison
-    normalized_ingredients = []
+    # Map each ingredient line to the food category of the first known ingredient it mentions
+    ingredient_categories = []
     for item in ingredients:
-        # Extract main ingredient name from descriptions
-        main_ingredient = item.split(',')[0].split('(')[0].lower().strip()
-        # Extract key words from ingredient descriptions
-        words = main_ingredient.split()
-        if words:
-            normalized_ingredients.append(words[0])  # Take first word as main ingredient
-    
-    if len(normalized_ingredients) < 2:
-        return 0.0
-    
-    # Define food categories for better matching
-    food_categories = {
-        "meats": ["chicken", "beef", "pork", "meat", "steak", "lamb", "turkey", "duck", "jerky"],
-        "seafood": ["fish", "shrimp", "seafood", "salmon", "tuna", "cod", "lobster"],
-        "dairy": ["milk", "cheese", "yogurt", "cream", "butter", "mozzarella", "cheddar", "ice"],
-        "sweets": ["chocolate", "sugar", "candy", "dessert", "sweet", "cake", "vanilla", "honey", "cream"],
-        "fruits": ["apple", "banana", "orange", "berry", "fruit", "mango", "peach", "strawberry", "strawberries"],
-        "vegetables": ["carrot", "broccoli", "spinach", "vegetable", "lettuce", "tomato", "onion"],
-        "grains": ["rice", "bread", "pasta", "wheat", "quinoa", "oats"],
-        "spices": ["cumin", "paprika", "cinnamon", "garlic", "ginger", "basil", "oregano"],
-        "sauces": ["sauce", "ketchup", "mustard", "mayo", "soy"]
-    }
+        ingredient_ids = find_ingredients(item)
+        ingredient_categories.append(get_ingredient_category(ingredient_ids[0]) if ingredient_ids else None)
     
     # Check all ingredient pairs
-    for i in range(len(normalized_ingredients)):
-        for j in range(i+1, len(normalized_ingredients)):
-            ing1 = normalized_ingredients[i]
-            ing2 = normalized_ingredients[j]
-            
-            # Find categories for each ingredient
-            ing1_category = None
-            ing2_category = None
-            
-            for category, keywords in food_categories.items():
-                if any(keyword in ing1 for keyword in keywords):
-                    ing1_category = category
-                if any(keyword in ing2 for keyword in keywords):
-                    ing2_category = category
+    for i in range(len(ingredient_categories)):
+        for j in range(i+1, len(ingredient_categories)):
+            ing1_category = ingredient_categories[i]
+            ing2_category = ingredient_categories[j]
             
             # Score based on category combinations
             if ing1_category and ing2_category:
@@ -232,21 +209,16 @@ def get_regeneration_hints(verification_result: dict, attempt_number: int) -> st
     
     return " | ".join(hints) if hints else "Create maximum surprise with unexpected combinations"
 
-async def enhance_recipe(recipe_text: str, verification_result: dict) -> str:
+async def enhance_recipe(recipe_text: str, verification_result: dict) -> tuple[str, float]:
     """
     Enhance recipe based on verification results to increase surprise and humor.
-    Returns enhanced recipe text.
+    Returns (enhanced recipe text, cost in USD).
     """
     if not verification_result["needs_enhancement"]:
-        return recipe_text  # No enhancement needed
+        return recipe_text, 0.0  # No enhancement needed
     
     start_time = time.time()
     
-    client = openai.Client(
-        api_key=OPENROUTER_API_KEY,
-        base_url="https://openrouter.ai/api/v1"
-    )
-    
     try:
         # Build system prompt for enhancement
         system_prompt = """You are an expert recipe enhancer focusing on SURPRISE and HUMOR.
@@ -285,20 +257,133 @@ Make the recipe more SURPRISING and FUNNY while keeping it cookable!"""
             {"role": "user", "content": enhancement_request}
         ]
         
-        response = client.chat.completions.create(
+        response = await get_client("openrouter").chat.completions.create(
             model=OPENROUTER_MODEL,
             messages=messages,
             temperature=LLM_TEMPERATURE,
-            max_tokens=LLM_MAX_TOKENS
+            max_tokens=SURPRISE_MAX_TOKENS
         )
         
         duration = time.time() - start_time
         tokens = response.usage.total_tokens if response.usage else 0
-        estimated_cost = (tokens * 0.75) / 1_000_000
+        estimated_cost = record_usage(OPENROUTER_MODEL, response.usage, purpose="enhance")
         
         logging.info(f"ENHANCE_SUCCESS surprise_score={verification_result['surprise_score']} has_humor={verification_result['has_humor']} tokens={tokens} time={duration:.2f}s cost=${estimated_cost:.4f}")
-        return response.choices[0].message.content
+        return response.choices[0].message.content, estimated_cost
         
     except Exception as e:
         logging.error(f"ENHANCE_ERROR: {e}")
-        return recipe_text  # Return original if enhancement fails
+        return recipe_text, 0.0  # Return original if enhancement fails
+
+def rank_verification(verification_result: dict) -> tuple:
+    """Sort key for candidates: humor first, then surprise score."""
+    return (verification_result["has_humor"], verification_result["surprise_score"])
+
+async def _generate_and_verify(conversation_history: list, user_profile: dict, hints: str) -> tuple:
+    """Generates one candidate recipe and verifies it. Returns (verification result, cost)."""
+    history = list(conversation_history)
+    if hints:
+        history.append({"role": "system", "content": f"System Note: Make this recipe better: {hints}"})
+    recipe_text, cost = await generate_candidate(history, max_tokens=SURPRISE_MAX_TOKENS)
+    return await verify_recipe_surprise(recipe_text, user_profile), cost
+
+async def _run_candidate_round(chat_id: int, conversation_history: list, user_profile: dict, hints: str, count: int) -> tuple:
+    """
+    Generates `count` candidates concurrently and returns as soon as one passes verification,
+    cancelling the rest. Returns (best verification result or None, cost of finished candidates,
+    finished count, cancelled count).
+    """
+    tasks = [
+        asyncio.create_task(_generate_and_verify(conversation_history, user_profile, hints))
+        for _ in range(count)
+    ]
+    inc_counter("recipe_bot_surprise_candidates_total", "Surprise recipe candidates by outcome", count, outcome="started")
+    best = None
+    cost = 0.0
+    finished_count = 0
+    try:
+        for finished in asyncio.as_completed(tasks):
+            try:
+                verification_result, candidate_cost = await finished
+            except Exception as e:
+                logging.warning(f"SURPRISE_CANDIDATE_ERROR chat_id={chat_id}: {e}")
+                continue
+            cost += candidate_cost
+            finished_count += 1
+            if best is None or rank_verification(verification_result) > rank_verification(best):
+                best = verification_result
+            if not verification_result["needs_enhancement"]:
+                break
+    finally:
+        cancelled = sum(task.cancel() for task in tasks)
+        if cancelled:
+            inc_counter("recipe_bot_surprise_candidates_total", "Surprise recipe candidates by outcome", cancelled, outcome="cancelled")
+    return best, cost, finished_count, cancelled
+
+async def generate_surprising_recipe(chat_id: int, conversation_history: list, user_profile: dict) -> str | None:
+    """
+    Best-of-N replacement for the sequential verify -> regenerate -> enhance loop.
+    Each round generates SURPRISE_CANDIDATES recipes concurrently and returns the first that passes;
+    otherwise the next round is steered by regeneration hints for the best candidate so far.
+    Every round, including the first, shrinks to the candidates the remaining SURPRISE_COST_CAP_USD
+    budget can pay for: at the pre-call estimate until candidates have finished, then at their observed
+    average cost. Candidates and the enhancement are bounded by SURPRISE_MAX_TOKENS. The final
+    enhancement only runs if the budget covers one more candidate, and its cost is added to the spend.
+    The cap is best-effort for in-flight calls: a candidate cancelled once another one passed may
+    already have been billed, so it is charged at the per-candidate estimate rather than its actual cost.
+    Returns the recipe text, or None if no candidate could be generated.
+    """
+    best = None
+    spent = 0.0
+    finished_cost = 0.0
+    candidates_finished = 0
+    estimated_cost = estimate_candidate_cost(conversation_history, SURPRISE_MAX_TOKENS)
+    hints = ""
+
+    def cost_per_candidate() -> float:
+        return finished_cost / candidates_finished if candidates_finished else estimated_cost
+
+    def affordable_candidates() -> int:
+        if spent >= SURPRISE_COST_CAP_USD:
+            return 0
+        if not cost_per_candidate():
+            return SURPRISE_CANDIDATES
+        return min(SURPRISE_CANDIDATES, int((SURPRISE_COST_CAP_USD - spent) / cost_per_candidate()))
+
+    with track_stage("surprise_pipeline"):
+        for round_number in range(1, SURPRISE_MAX_ROUNDS + 1):
+            count = affordable_candidates()
+            if count < 1:
+                logging.info(
+                    f"SURPRISE_COST_CAP chat_id={chat_id} spent=${spent:.4f} "
+                    f"per_candidate=${cost_per_candidate():.4f} round={round_number}"
+                )
+                break
+
+            round_charge = cost_per_candidate()
+            round_best, round_cost, round_finished, round_cancelled = await _run_candidate_round(
+                chat_id, conversation_history, user_profile, hints, count
+            )
+            finished_cost += round_cost
+            candidates_finished += round_finished
+            spent += round_cost + round_cancelled * round_charge
+            if round_best is None:
+                continue
+            if best is None or rank_verification(round_best) > rank_verification(best):
+                best = round_best
+            logging.info(
+                f"SURPRISE_ROUND chat_id={chat_id} round={round_number} candidates={count} "
+                f"surprise_score={best['surprise_score']:.2f} has_humor={best['has_humor']} spent=${spent:.4f}"
+            )
+            if not best["needs_enhancement"]:
+                return best["original_recipe"]
+            hints = get_regeneration_hints(best, round_number)
+
+        if best is None:
+            return None
+        if not affordable_candidates():
+            return best["original_recipe"]
+        recipe_text, enhance_cost = await enhance_recipe(best["original_recipe"], best)
+        spent += enhance_cost
+        logging.info(f"SURPRISE_ENHANCED chat_id={chat_id} cost=${enhance_cost:.4f} spent=${spent:.4f}")
+        return recipe_text
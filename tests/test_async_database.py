@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import async_database
+import context_buffer
+
+
+def test_history_read_sees_rows_flushed_while_it_is_queued():
+    """Test that a flush landing while a history read waits for the worker does not hide the queued row."""
+    stored = []
+
+    def fake_read(user_id, limit):
+        return list(stored)
+
+    def fake_write(rows, shard):
+        stored.extend({"role": role, "content": content} for _, role, content, _ in rows)
+
+    async def scenario():
+        busy = async_database.submit_db(0, time.sleep, 0.05)
+        async_database._pending_history.append((1, "user", "I have eggs", "2026-01-01T00:00:00+00:00"))
+        read = asyncio.create_task(async_database.get_conversation_history(1, 10))
+        await asyncio.sleep(0)
+        # The flush takes the row out of the queue after the read was submitted
+        await async_database.flush_history()
+        await busy
+        return await read
+
+    context_buffer.clear_context_buffers()
+    with patch('async_database.database.get_conversation_history', fake_read), \
+         patch('async_database.database.add_messages_to_history', fake_write), \
+         patch('async_database.database.get_shard_index', lambda user_id: 0):
+        history = asyncio.run(scenario())
+    context_buffer.clear_context_buffers()
+
+    assert history == [{"role": "user", "content": "I have eggs"}]
+    assert stored == history
+
+
+def test_preference_search_runs_one_query_per_shard_worker():
+    """Test that each shard is queried on its own worker and the ids are merged in order."""
+    calls = []
+
+    def fake_find(key, value, shard):
+        calls.append((shard, threading.current_thread().name))
+        return {0: [4, 10], 1: [3]}[shard]
+
+    executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-worker-{shard}") for shard in range(2)]
+    with patch('async_database._db_executors', executors), patch('async_database.DB_SHARDS', 2), \
+         patch('async_database.database.find_users_by_preference', fake_find):
+        user_ids = asyncio.run(async_database.find_users_by_preference("allergies", "peanuts"))
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+    assert user_ids == [3, 4, 10]
+    assert sorted((shard, name.rsplit("_", 1)[0]) for shard, name in calls) == [(0, "db-worker-0"), (1, "db-worker-1")]
+
+
+def test_stopping_the_writer_keeps_rows_queued_behind_a_slow_worker():
+    """Test that stop_history_writer waits for an in-flight flush instead of cancelling its DB writes."""
+    stored = []
+
+    def slow_write(rows, shard):
+        time.sleep(0.05)
+        stored.extend(rows)
+
+    async def scenario():
+        async_database.start_history_writer()
+        busy = async_database.submit_db(0, time.sleep, 0.1)
+        await async_database.add_message_to_history(1, "user", "I have eggs")
+        async_database._history_flush_requested.set()
+        await asyncio.sleep(0.01)
+        await async_database.stop_history_writer()
+        await busy
+        await async_database.add_message_to_history(1, "assistant", "Omelette time")
+
+    context_buffer.clear_context_buffers()
+    with patch('async_database.HISTORY_WRITE_BEHIND', True), \
+         patch('async_database.database.add_messages_to_history', slow_write), \
+         patch('async_database.database.add_message_to_history', lambda user_id, role, content: stored.append((user_id, role, content))), \
+         patch('async_database.database.get_shard_index', lambda user_id: 0):
+        asyncio.run(scenario())
+    context_buffer.clear_context_buffers()
+
+    assert [row[2] for row in stored] == ["I have eggs", "Omelette time"]
+    assert async_database._pending_history == []
+    assert async_database._flushing_rows == set()
@@ -0,0 +1,35 @@
+import asyncio
+from io import BytesIO
+from unittest.mock import AsyncMock, patch
+
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+import audio_processor
+from audio_processor import trim_silence, transcribe_audio_message
+
+
+def test_trim_silence_downmixes_resamples_and_trims():
+    """Test that a stereo 48 kHz recording becomes mono 16 kHz without its long leading and trailing silence."""
+    tone = Sine(440).to_audio_segment(duration=1000, volume=-10).set_frame_rate(48000).set_channels(2)
+    silence = AudioSegment.silent(duration=2000, frame_rate=48000).set_channels(2)
+
+    trimmed = trim_silence(silence + tone + silence)
+
+    assert trimmed.channels == 1 and trimmed.frame_rate == 16000
+    assert 1000 <= len(trimmed) <= 1000 + 2 * audio_processor.SILENCE_PADDING_MS + 20
+    assert trim_silence(silence) is None
+
+
+def test_silent_voice_message_is_not_sent_for_transcription():
+    """Test that a message with no speech is answered without calling the transcription API."""
+    call_with_fallback = AsyncMock()
+
+    with patch('audio_processor.AUDIO_PREPROCESSING', True), \
+         patch('audio_processor.AUDIO_PREPROCESSING_AVAILABLE', True), \
+         patch('audio_processor.prepare_audio', lambda audio_bytes: (None, 4.0, 0.0, 1.0)), \
+         patch('audio_processor.call_with_fallback', call_with_fallback):
+        text = asyncio.run(transcribe_audio_message(1, BytesIO(b"OggS")))
+
+    assert text.startswith("Error:")
+    call_with_fallback.assert_not_awaited()
@@ -0,0 +1,66 @@
+import pytest
+from unittest.mock import patch
+
+import context_buffer
+
+
+@pytest.fixture(autouse=True)
+def empty_buffers():
+    """Fixture to start every test with no buffered chats."""
+    context_buffer.clear_context_buffers()
+    yield
+    context_buffer.clear_context_buffers()
+
+
+def test_hydrated_buffer_serves_appends_and_clears():
+    """Test that a hydrated chat is served from memory, follows appends and honours deletes."""
+    assert context_buffer.get_buffered_context(1, 10) is None
+
+    generation = context_buffer.begin_hydration(1)
+    context_buffer.finish_hydration(1, generation, [{"role": "user", "content": "Hello"}])
+    context_buffer.append_message(1, "assistant", "Hi there!")
+
+    assert context_buffer.get_buffered_context(1, 10) == [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi there!"},
+    ]
+    assert context_buffer.get_buffered_context(1, 1) == [{"role": "assistant", "content": "Hi there!"}]
+
+    context_buffer.clear_chat(1)
+    assert context_buffer.get_buffered_context(1, 10) == []
+
+
+def test_write_during_hydration_discards_stale_read():
+    """Test that a write racing with the hydration read forces a re-read instead of caching stale rows."""
+    generation = context_buffer.begin_hydration(1)
+    context_buffer.append_message(1, "user", "Arrived mid-read")
+    context_buffer.finish_hydration(1, generation, [])
+
+    assert context_buffer.get_buffered_context(1, 10) is None
+
+
+def test_overlapping_hydrations_keep_only_reads_that_saw_every_write():
+    """Test that a second hydration starting after a write does not let the first, older read be cached."""
+    old = {"role": "user", "content": "old"}
+    new = {"role": "assistant", "content": "NEW"}
+
+    first = context_buffer.begin_hydration(1)
+    context_buffer.append_message(1, "assistant", "NEW")
+    second = context_buffer.begin_hydration(1)
+    context_buffer.finish_hydration(1, first, [old])
+    assert context_buffer.get_buffered_context(1, 10) is None
+
+    context_buffer.finish_hydration(1, second, [old, new])
+    assert context_buffer.get_buffered_context(1, 10) == [old, new]
+
+
+def test_idle_chats_are_evicted_over_the_message_cap():
+    """Test that the least recently used chat is evicted when the global cap is exceeded."""
+    with patch('context_buffer.CONTEXT_BUFFER_MAX_MESSAGES', 3):
+        for chat_id in (1, 2):
+            generation = context_buffer.begin_hydration(chat_id)
+            context_buffer.finish_hydration(chat_id, generation, [{"role": "user", "content": f"Chat {chat_id}"}] * 2)
+
+    assert context_buffer.get_buffered_context(1, 10) is None
+    assert len(context_buffer.get_buffered_context(2, 10)) == 2
+    assert context_buffer.get_context_buffer_stats()["evictions"] == 1
@@ -0,0 +1,90 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import async_database
+import context_buffer
+import context_builder
+from context_builder import build_context, count_tokens, get_message_fingerprint, schedule_summary_update
+
+
+def make_history(count: int, size: int = 400) -> list[dict]:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} " + "x" * size} for i in range(count)]
+
+
+def test_build_context_keeps_newest_turns_within_budget():
+    """Test that only the newest turns fitting the budget are kept and the rest are reported as evicted."""
+    history = make_history(10)
+    budget = count_tokens(context_builder.SYSTEM_PROMPT) + 3 * count_tokens(history[-1]["content"])
+
+    with patch('context_builder.LLM_INPUT_TOKEN_BUDGET', budget), \
+         patch('context_builder.get_conversation_summary', AsyncMock(return_value=None)):
+        messages, evicted, summary = asyncio.run(build_context(1, history, {"likes": ["spicy food"]}))
+
+    assert messages[:-1] == history[-2:]
+    assert messages[-1]["role"] == "system" and "spicy food" in messages[-1]["content"]
+    assert evicted == history[:-2]
+    assert summary is None
+
+
+def test_schedule_summary_update_folds_only_unsummarized_turns():
+    """Test that turns already covered by the summary are not folded again."""
+    history = make_history(6, size=10)
+    summary = {"summary": "Likes chocolate.", "last_folded_hash": get_message_fingerprint(history[2])}
+    summarize = AsyncMock(return_value="Likes chocolate and chicken.")
+    save = AsyncMock()
+
+    async def scenario():
+        schedule_summary_update(1, history[:5], summary)
+        await asyncio.gather(*context_builder._summary_tasks)
+
+    with patch('context_builder.summarize_conversation', summarize), \
+         patch('context_builder.save_conversation_summary', save):
+        asyncio.run(scenario())
+
+    summarize.assert_awaited_once_with(1, "Likes chocolate.", history[3:5])
+    save.assert_awaited_once_with(1, "Likes chocolate and chicken.", get_message_fingerprint(history[4]), 0)
+
+
+def test_context_notes_are_attached_to_the_newest_user_turn():
+    """Test that per-turn notes never precede history, keeping the prompt prefix stable."""
+    history = [{"role": "assistant", "content": "What's in your fridge?"}, {"role": "user", "content": "Chicken"}]
+
+    messages = context_builder.attach_context_notes(history, ["System Note: likes spicy food"])
+
+    assert messages[0] == history[0]
+    assert messages[1] == {"role": "user", "content": "System Note: likes spicy food\n\nChicken"}
+
+
+def test_summary_fold_is_dropped_when_history_is_deleted_meanwhile():
+    """Test that a fold finishing after /reset does not bring the deleted chat's summary back."""
+    history = make_history(4, size=10)
+    saved = []
+
+    async def slow_summarize(chat_id, previous_summary, messages):
+        await asyncio.sleep(0.01)
+        return "Likes chocolate."
+
+    async def scenario():
+        schedule_summary_update(7, history, None)
+        await async_database.delete_conversation_history(7)
+        await asyncio.gather(*context_builder._summary_tasks)
+
+    with patch('context_builder.summarize_conversation', slow_summarize), \
+         patch('async_database.database.delete_conversation_history', lambda user_id: None), \
+         patch('async_database.database.save_conversation_summary', lambda *args: saved.append(args)):
+        asyncio.run(scenario())
+    context_buffer.clear_context_buffers()
+
+    assert saved == []
+
+
+def test_token_counts_are_cached_by_digest_and_bounded():
+    """Test that the token count cache keeps digests rather than message bodies and stays within its size."""
+    context_builder._token_counts.clear()
+    with patch('context_builder.TOKEN_COUNT_CACHE_SIZE', 2):
+        counts = [count_tokens(text) for text in ("a" * 400, "b" * 40, "a" * 400, "c" * 4)]
+
+    assert counts[0] == counts[2]
+    assert len(context_builder._token_counts) == 2
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in context_builder._token_counts)
+    context_builder._token_counts.clear()
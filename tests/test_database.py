@@ -20,34 +20,18 @@ from database import (
     get_conversation_history,
     delete_conversation_history,
     delete_user_profile,
+    get_conversation_summary,
+    save_conversation_summary,
+    save_vision_cache_entry,
+    load_vision_cache_entries,
 )
 
 @pytest.fixture(scope="function")
 def test_db_conn():
     """Fixture to set up a single in-memory db connection and initialize tables."""
     conn = sqlite3.connect(':memory:')
-    # Manually initialize the schema using this connection
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            user_id INTEGER PRIMARY KEY,
-            journey_stage TEXT NOT NULL DEFAULT 'new_user',
-            preferences TEXT,
-            interaction_count INTEGER DEFAULT 0,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS conversation_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES user_profiles(user_id)
-        )
-    """)
+    # Initialize the full, migrated schema on this connection
+    init_db(conn=conn)
     conn.commit()
     yield conn
     conn.close()
@@ -119,3 +103,231 @@ def test_history_is_user_specific(test_db_conn):
     
     assert len(history2) == 1
     assert history2[0]['content'] == "Message for user 2"
+
+def test_async_storage_layer_round_trip(tmp_path):
+    """Test that the async wrappers run on the DB worker and see each other's writes."""
+    import asyncio
+    import async_database
+
+    async def scenario():
+        await async_database.init_db()
+        await async_database.create_user_profile(777)
+        await async_database.add_message_to_history(777, "user", "Async hello")
+        profile = await async_database.get_user_profile(777)
+        history = await async_database.get_conversation_history(777, 10)
+        return profile, history
+
+    with patch('database.DB_NAME', str(tmp_path / "async.db")):
+        profile, history = asyncio.run(scenario())
+
+    assert profile["user_id"] == 777
+    assert history == [{"role": "user", "content": "Async hello"}]
+
+def test_increment_interaction_count_upserts_and_returns_count(test_db_conn):
+    """Test that incrementing creates a missing profile and returns the new count atomically."""
+    from database import increment_interaction_count, reset_interaction_count
+
+    assert increment_interaction_count(999, conn=test_db_conn) == 1
+    assert increment_interaction_count(999, conn=test_db_conn) == 2
+    assert get_user_profile(999, conn=test_db_conn)["interaction_count"] == 2
+
+    reset_interaction_count(999, conn=test_db_conn)
+    assert get_user_profile(999, conn=test_db_conn)["interaction_count"] == 0
+
+def test_init_db_applies_migrations_and_indexes_history():
+    """Test that init_db runs all migrations once and history reads use the (user_id, id) index."""
+    from database import MIGRATIONS
+
+    conn = sqlite3.connect(':memory:')
+    init_db(conn=conn)
+    init_db(conn=conn)  # Re-running must be a no-op
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT role, content FROM conversation_history WHERE user_id = ? ORDER BY id DESC LIMIT 5",
+        (1,)
+    ).fetchall()
+    assert any("idx_conversation_history_user_id_id" in row[-1] for row in plan)
+    conn.close()
+
+def test_history_with_identical_timestamps_keeps_insertion_order(test_user, test_db_conn):
+    """Test that messages written in the same instant come back in insertion order."""
+    with patch('database.datetime') as mock_datetime:
+        mock_datetime.now.return_value = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        for i in range(3):
+            add_message_to_history(test_user, "user", f"Same instant {i}", conn=test_db_conn)
+
+    history = get_conversation_history(test_user, 10, conn=test_db_conn)
+    assert [m['content'] for m in history] == ["Same instant 0", "Same instant 1", "Same instant 2"]
+
+def test_history_write_behind_reads_own_writes_and_flushes_on_stop(tmp_path):
+    """Test that queued history rows are visible before the flush and committed when the writer stops."""
+    import asyncio
+    import async_database
+
+    async def scenario():
+        await async_database.init_db()
+        async_database.start_history_writer()
+        await async_database.add_message_to_history(888, "user", "Queued hello")
+        await async_database.add_message_to_history(888, "assistant", "Queued reply")
+        history_before_flush = await async_database.get_conversation_history(888, 10)
+        await async_database.stop_history_writer()
+        return history_before_flush
+
+    with patch('database.DB_NAME', str(tmp_path / "write_behind.db")), \
+         patch('async_database.HISTORY_WRITE_BEHIND', True), \
+         patch('async_database.HISTORY_FLUSH_INTERVAL_MS', 60_000):
+        history_before_flush = asyncio.run(scenario())
+        history_after_flush = get_conversation_history(888, 10)
+
+    expected = [{"role": "user", "content": "Queued hello"}, {"role": "assistant", "content": "Queued reply"}]
+    assert history_before_flush == expected
+    assert history_after_flush == expected
+    assert async_database.history_write_stats["rows_flushed"] >= 2
+
+def test_prune_user_history_keeps_newest_and_archives():
+    """Test that pruning removes only rows beyond the window, in batches, archiving them compressed."""
+    import zlib
+    from database import prune_user_history
+
+    user_id = 4242
+    conn = sqlite3.connect(':memory:')
+    init_db(conn=conn)
+    for i in range(10):
+        add_message_to_history(user_id, "user", f"Message {i}", conn=conn)
+
+    assert prune_user_history(user_id, keep_last=3, batch_size=4, archive=True, conn=conn) == 4
+    assert prune_user_history(user_id, keep_last=3, batch_size=4, archive=True, conn=conn) == 3
+    assert prune_user_history(user_id, keep_last=3, batch_size=4, archive=True, conn=conn) == 0
+
+    history = get_conversation_history(user_id, 100, conn=conn)
+    assert [m['content'] for m in history] == ["Message 7", "Message 8", "Message 9"]
+
+    archived = conn.execute("SELECT messages FROM conversation_history_archive ORDER BY id").fetchall()
+    archived_rows = [row for (blob,) in archived for row in json.loads(zlib.decompress(blob))]
+    assert [row[2] for row in archived_rows] == [f"Message {i}" for i in range(7)]
+    conn.close()
+
+def test_retention_lists_only_users_over_the_window_in_pages(test_db_conn):
+    """Test that each page checks a bounded run of users and reports only those over the window."""
+    from database import get_users_over_history_limit
+
+    for user_id, message_count in [(1, 5), (2, 2), (3, 4), (4, 3), (5, 6)]:
+        for i in range(message_count):
+            add_message_to_history(user_id, "user", f"Message {i}", conn=test_db_conn)
+
+    assert get_users_over_history_limit(None, 3, 2, conn=test_db_conn) == ([1], 2)
+    assert get_users_over_history_limit(2, 3, 2, conn=test_db_conn) == ([3], 4)
+    assert get_users_over_history_limit(4, 3, 2, conn=test_db_conn) == ([5], 5)
+    assert get_users_over_history_limit(5, 3, 2, conn=test_db_conn) == ([], None)
+
+def test_reshard_routes_every_chat_to_its_new_shard(tmp_path):
+    """Test that re-sharding copies all rows and each chat lands on the shard get_shard_index picks."""
+    from database import get_shard_index, get_shard_path
+    from reshard import reshard
+
+    source_name = str(tmp_path / "source.db")
+    source_conn = sqlite3.connect(source_name)
+    init_db(conn=source_conn)
+    for user_id in range(1, 21):
+        create_user_profile(user_id, conn=source_conn)
+        add_message_to_history(user_id, "user", f"First from {user_id}", conn=source_conn)
+        add_message_to_history(user_id, "assistant", f"Reply to {user_id}", conn=source_conn)
+        save_conversation_summary(user_id, f"Earlier chat with {user_id}", "hash", conn=source_conn)
+    save_vision_cache_entry("photo-1", f"{7:016x}", ["eggs"], conn=source_conn)
+    source_conn.close()
+
+    copied = reshard(1, 3, str(tmp_path / "out"), db_name=source_name)
+    assert copied["user_profiles"] == 20
+    assert copied["conversation_history"] == 40
+    assert copied["conversation_summaries"] == 20
+    assert copied["vision_cache"] == 1
+
+    target_base = str(tmp_path / "out" / "source.db")
+    for user_id in range(1, 21):
+        shard_conn = sqlite3.connect(get_shard_path(get_shard_index(user_id, 3), 3, target_base))
+        assert get_user_profile(user_id, conn=shard_conn)["user_id"] == user_id
+        history = get_conversation_history(user_id, 10, conn=shard_conn)
+        assert [m["content"] for m in history] == [f"First from {user_id}", f"Reply to {user_id}"]
+        assert get_conversation_summary(user_id, conn=shard_conn)["summary"] == f"Earlier chat with {user_id}"
+        shard_conn.close()
+
+    for shard in range(3):
+        shard_conn = sqlite3.connect(get_shard_path(shard, 3, target_base))
+        assert shard_conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        assert shard_conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        shard_conn.close()
+    first_shard = sqlite3.connect(get_shard_path(0, 3, target_base))
+    assert load_vision_cache_entries(10, conn=first_shard)[0]["ingredients"] == ["eggs"]
+    first_shard.close()
+
+def test_update_user_preferences_merges_in_sql_and_is_queryable(test_db_conn):
+    """Test that preference merges happen in one statement and can be queried without loading profiles."""
+    from database import update_user_preferences, find_users_by_preference
+
+    update_user_preferences(501, {"likes": ["spicy food"], "allergies": ["Peanuts"]}, conn=test_db_conn)
+    update_user_preferences(501, {"dislikes": ["celery"], "likes": ["sushi"]}, conn=test_db_conn)
+    update_user_preferences(502, {"allergies": ["shellfish"]}, conn=test_db_conn)
+
+    assert get_user_profile(501, conn=test_db_conn)["preferences"] == {
+        "likes": ["sushi"], "allergies": ["Peanuts"], "dislikes": ["celery"]
+    }
+    assert find_users_by_preference("allergies", "peanuts", conn=test_db_conn) == [501]
+    assert find_users_by_preference("allergies", "shellfish", conn=test_db_conn) == [502]
+
+def test_export_then_import_round_trips_profiles_and_history(tmp_path):
+    """Test that an NDJSON.gz export imports back into an empty database unchanged."""
+    from database import update_user_preferences
+    from data_transfer import export_data, import_data
+
+    export_path = str(tmp_path / "backup.ndjson.gz")
+    with patch('database.DB_NAME', str(tmp_path / "source.db")):
+        init_db()
+        update_user_preferences(31, {"likes": ["crème fraîche"]})
+        add_message_to_history(31, "user", "Bonjour")
+        add_message_to_history(31, "assistant", "Salut!")
+        save_conversation_summary(31, "Asked about crème fraîche", "hash")
+        counts = export_data(export_path)
+
+    assert counts == {"user_profiles": 1, "conversation_history": 2, "conversation_summaries": 1}
+
+    with patch('database.DB_NAME', str(tmp_path / "target.db")):
+        import_data(export_path)
+        assert get_user_profile(31)["preferences"] == {"likes": ["crème fraîche"]}
+        assert get_conversation_history(31, 10) == [
+            {"role": "user", "content": "Bonjour"},
+            {"role": "assistant", "content": "Salut!"},
+        ]
+        assert get_conversation_summary(31) == {"summary": "Asked about crème fraîche", "last_folded_hash": "hash"}
+        with pytest.raises(ValueError):
+            import_data(export_path)
+        assert len(get_conversation_history(31, 10)) == 2
+
+def test_export_reads_each_shard_from_one_snapshot(tmp_path):
+    """Test that rows written while an export is running are not mixed into it."""
+    import io
+    from data_transfer import export_data
+
+    db_path = str(tmp_path / "live.db")
+    with patch('database.DB_NAME', db_path):
+        init_db()
+        create_user_profile(41)
+        add_message_to_history(41, "user", "Before export")
+        writer = sqlite3.connect(db_path)
+
+        class WritesMidExport(io.StringIO):
+            def write(self, text):
+                if '"user_profiles"' in text:
+                    add_message_to_history(41, "assistant", "Written mid-export", conn=writer)
+                return super().write(text)
+
+            def close(self):
+                pass
+
+        output = WritesMidExport()
+        with patch('data_transfer._open_text', lambda path, mode: output):
+            counts = export_data(str(tmp_path / "unused.ndjson"))
+        writer.close()
+
+    assert counts["conversation_history"] == 1
+    assert "Written mid-export" not in output.getvalue()
@@ -0,0 +1,40 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+from aiogram.exceptions import TelegramBadRequest
+
+from handlers import send_reply
+
+
+def make_placeholder(edit_error: Exception | None = None) -> MagicMock:
+    placeholder = MagicMock()
+    placeholder.edit_text = AsyncMock(side_effect=edit_error)
+    return placeholder
+
+
+def test_streamed_reply_is_not_sent_twice():
+    """Test that a final reply already shown by streaming, or rejected as unmodified, is never re-sent."""
+    message = MagicMock()
+    message.answer = AsyncMock()
+
+    placeholder = make_placeholder()
+    asyncio.run(send_reply(message, placeholder, "Chocolate chicken!", "Chocolate chicken!"))
+    placeholder.edit_text.assert_not_awaited()
+
+    not_modified = TelegramBadRequest(MagicMock(), "Bad Request: message is not modified")
+    placeholder = make_placeholder(not_modified)
+    asyncio.run(send_reply(message, placeholder, "Chocolate chicken!", "Chocolate chick"))
+    placeholder.edit_text.assert_awaited_once()
+
+    message.answer.assert_not_awaited()
+
+
+def test_failed_edit_falls_back_to_new_message():
+    """Test that other edit failures still deliver the reply as a new message."""
+    message = MagicMock()
+    message.answer = AsyncMock()
+    placeholder = make_placeholder(TelegramBadRequest(MagicMock(), "Bad Request: message to edit not found"))
+
+    asyncio.run(send_reply(message, placeholder, "Chocolate chicken!", ""))
+
+    message.answer.assert_awaited_once_with("Chocolate chicken!")
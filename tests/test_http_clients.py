@@ -0,0 +1,33 @@
+import asyncio
+
+import httpx
+
+import http_clients
+import metrics
+
+
+def test_clients_are_shared_per_upstream_and_count_connection_reuse():
+    """Test that each upstream gets one lazily created client whose pool reports requests and new connections."""
+    metrics.reset_metrics()
+
+    async def scenario():
+        client = http_clients.get_client("openrouter")
+        assert http_clients.get_client("openrouter") is client
+        assert http_clients.get_client("openai") is not client
+
+        # Two requests over one pooled connection, as httpcore would trace them
+        on_request = http_clients._build_connection_tracer("openrouter")
+        for connect in (True, False):
+            request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+            await on_request(request)
+            if connect:
+                await request.extensions["trace"]("connection.connect_tcp.complete", {})
+
+        await http_clients.close_clients()
+
+    asyncio.run(scenario())
+
+    text = metrics.render_metrics()
+    assert 'recipe_bot_http_requests_total{upstream="openrouter"} 2' in text
+    assert 'recipe_bot_http_connections_opened_total{upstream="openrouter"} 1' in text
+    assert http_clients._clients == {}
@@ -0,0 +1,38 @@
+from io import BytesIO
+from types import SimpleNamespace
+
+from PIL import Image
+
+from image_processor import merge_ingredient_lists, prepare_image, select_photo_size
+
+
+def test_select_photo_size_prefers_smallest_size_covering_target():
+    """Test that the smallest PhotoSize reaching the target resolution is chosen, or the largest if none does."""
+    sizes = [SimpleNamespace(width=90, height=67), SimpleNamespace(width=320, height=240),
+             SimpleNamespace(width=800, height=600), SimpleNamespace(width=1280, height=960)]
+
+    assert select_photo_size(sizes) is sizes[2]
+    assert select_photo_size(sizes[:2]) is sizes[1]
+
+
+def test_prepare_image_downscales_to_lossy_jpeg():
+    """Test that a large photo is resized to the target box and re-encoded as a much smaller JPEG."""
+    source = BytesIO()
+    Image.effect_noise((2048, 1536), 40).convert("RGB").save(source, format="PNG")
+
+    encoded, mime_type, phash, cpu_ms = prepare_image(source.getvalue())
+
+    image = Image.open(BytesIO(encoded))
+    assert mime_type == "image/jpeg" and image.format == "JPEG"
+    assert max(image.size) == 512
+    assert len(encoded) < len(source.getvalue()) / 10
+    assert 0 <= phash < 2 ** 64 and cpu_ms >= 0
+
+
+def test_album_ingredients_are_merged_without_duplicates_or_errors():
+    """Test that ingredient lists from several photos merge case-insensitively and failed photos are skipped."""
+    error = ["Error: Could not analyze the image."]
+
+    assert merge_ingredient_lists([["Tomatoes", "basil"], error, ["tomatoes", "Garlic"], []]) == ["Tomatoes", "basil", "Garlic"]
+    assert merge_ingredient_lists([error, error]) == error
+    assert merge_ingredient_lists([[], []]) == []
@@ -0,0 +1,42 @@
+from unittest.mock import patch
+
+from ingredient_intelligence import select_surprise_ingredients
+from ingredient_vocabulary import find_ingredients, get_ingredient_category, normalize_ingredient_list
+
+
+def test_free_text_maps_to_canonical_ids_across_languages():
+    """Test that plurals, synonyms, accents and supported languages resolve to canonical ids as whole words."""
+    assert find_ingredients("2 Tomatoes, fresh coriander and some RICE") == ["tomato", "cilantro", "rice"]
+    assert find_ingredients("У меня есть курица и мёд") == ["chicken", "honey"]
+    assert find_ingredients("kaas, uien en aardappelen") == ["cheese", "onion", "potato"]
+    assert find_ingredients("creme fraiche et pommes de terre") == ["cream", "potato"]
+    # Longest match wins and words are not matched inside other words
+    assert find_ingredients("ice cream with fish sauce") == ["ice cream", "fish sauce"]
+    assert find_ingredients("licorice") == []
+    assert get_ingredient_category("ice cream") == "sweets"
+
+
+def test_vision_items_are_normalized_and_deduplicated():
+    """Test that a vision model's comma-separated items map to canonical names, keeping unknown ones."""
+    items = "Tomatoes, red onions, tomato, quince jam, garlic.".split(",")
+
+    assert normalize_ingredient_list(items) == ["tomato", "red onions", "quince jam", "garlic"]
+
+
+def test_multi_word_vision_items_are_not_split_or_shortened():
+    """Test that compound ingredients only partly covered by the vocabulary are displayed as written."""
+    items = ["cream cheese", "coconut milk", "sweet potatoes", "orange juice", "chicken breast", "ice cream", "soy sauce"]
+
+    assert normalize_ingredient_list(items) == [
+        "cream cheese", "coconut milk", "sweet potatoes", "orange juice", "chicken breast", "ice cream", "soy sauce"
+    ]
+
+
+def test_surprise_ingredients_skip_what_user_already_has():
+    """Test that local ingredients the user already mentioned, in any language, are not suggested."""
+    with patch('ingredient_intelligence.random.sample', lambda items, count: items[:count]):
+        suggestions = select_surprise_ingredients("greece", ["Feta", "оливковое масло", "орегано", "olijven"], count=8)
+
+    assert "feta" not in suggestions and "olive oil" not in suggestions
+    assert "oregano" not in suggestions and "olives" not in suggestions
+    assert "lemon" in suggestions
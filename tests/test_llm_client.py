@@ -0,0 +1,26 @@
+from llm_client import SYSTEM_PROMPT, build_llm_messages
+
+
+def test_build_llm_messages_marks_stable_prefix_for_cache_control_models():
+    """Test that cache breakpoints sit after the system prompt and after the stable history."""
+    history = [
+        {"role": "user", "content": "Chicken"},
+        {"role": "assistant", "content": "Chocolate chicken!"},
+        {"role": "user", "content": "Sounds wild"},
+    ]
+
+    messages = build_llm_messages(history, model="anthropic/claude-3.5-haiku")
+
+    assert messages[0]["content"][0]["text"] == SYSTEM_PROMPT
+    assert messages[0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert messages[2]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert messages[1] == history[0] and messages[3] == history[2]
+
+
+def test_build_llm_messages_leaves_automatic_cache_models_untouched():
+    """Test that models with automatic prefix caching get plain text messages."""
+    history = [{"role": "user", "content": "Chicken"}]
+
+    messages = build_llm_messages(history, model="openai/gpt-4o-mini")
+
+    assert messages == [{"role": "system", "content": SYSTEM_PROMPT}] + history
@@ -0,0 +1,26 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from media_groups import get_media_group_stats, submit_album_message
+
+
+def test_album_photos_are_handled_as_one_batch_per_media_group():
+    """Test that album items within the window are delivered once, in message order, separately per album."""
+    batches = []
+
+    async def run_album(messages):
+        batches.append([message.message_id for message in messages])
+
+    async def scenario():
+        submit_album_message("album-1", SimpleNamespace(message_id=2), run_album)
+        submit_album_message("album-2", SimpleNamespace(message_id=5), run_album)
+        submit_album_message("album-1", SimpleNamespace(message_id=1), run_album)
+        submit_album_message("album-1", SimpleNamespace(message_id=3), run_album)
+        await asyncio.sleep(0.05)
+
+    with patch('media_groups.MEDIA_GROUP_WINDOW_MS', 10):
+        asyncio.run(scenario())
+
+    assert sorted(batches) == [[1, 2, 3], [5]]
+    assert get_media_group_stats()["album_photos"] >= 4
@@ -0,0 +1,63 @@
+import asyncio
+from unittest.mock import patch
+
+import message_coalescer
+from message_coalescer import run_generation, submit_message
+
+
+def test_burst_is_merged_and_in_flight_generation_cancelled():
+    """Test that messages within the window form one turn and newer input cancels a running generation."""
+    turns = []
+    results = []
+
+    async def slow_generation():
+        await asyncio.sleep(10)
+        return "stale reply"
+
+    async def run_turn(messages):
+        turns.append(list(messages))
+        results.append(await run_generation(1, slow_generation() if len(turns) == 1 else asyncio.sleep(0, "fresh reply")))
+
+    async def scenario():
+        submit_message(1, "I have eggs", run_turn)
+        submit_message(1, "and cheese", run_turn)
+        await asyncio.sleep(0.05)
+        submit_message(1, "actually, no cheese", run_turn)
+        await asyncio.sleep(0.05)
+
+    with patch('message_coalescer.MESSAGE_DEBOUNCE_MS', 10):
+        asyncio.run(scenario())
+
+    assert turns == [["I have eggs", "and cheese"], ["actually, no cheese"]]
+    assert results == [None, "fresh reply"]
+    assert message_coalescer._chats == {}
+
+
+def test_turns_of_a_chat_never_overlap():
+    """Test that a turn waiting for the chat's lock keeps the state alive, so later turns still queue behind it."""
+    turns = []
+    active = [0, 0]
+
+    async def run_turn(messages):
+        turns.append(list(messages))
+        active[0] += 1
+        active[1] = max(active[1], active[0])
+        await asyncio.sleep(0.05)
+        active[0] -= 1
+
+    async def scenario():
+        submit_message(1, "A", run_turn)
+        await asyncio.sleep(0.02)
+        # B's window closes while A is still running, so B waits for the lock
+        submit_message(1, "B", run_turn)
+        await asyncio.sleep(0.05)
+        # A has just finished; C must queue behind B instead of getting a fresh lock
+        submit_message(1, "C", run_turn)
+        await asyncio.sleep(0.2)
+
+    with patch('message_coalescer.MESSAGE_DEBOUNCE_MS', 10):
+        asyncio.run(scenario())
+
+    assert turns == [["A"], ["B"], ["C"]]
+    assert active[1] == 1
+    assert message_coalescer._chats == {}
@@ -0,0 +1,39 @@
+import pytest
+
+import metrics
+from metrics import record_llm_usage, render_metrics, track_stage
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    """Fixture to start every test with no recorded metrics."""
+    metrics.reset_metrics()
+    yield
+    metrics.reset_metrics()
+
+
+def test_llm_usage_is_priced_per_model():
+    """Test that cached prompt tokens get the cached price and unknown models the default price."""
+    cost = record_llm_usage("anthropic/claude-3.5-haiku", 1_000_000, 100_000, cached_tokens=500_000)
+    fallback_cost = record_llm_usage("some/unknown-model", 1_000_000, 0)
+
+    assert cost == pytest.approx(0.5 * 0.80 + 0.5 * 0.08 + 0.1 * 4.00)
+    assert fallback_cost == pytest.approx(0.75)
+    text = render_metrics()
+    assert 'recipe_bot_llm_tokens_total{kind="cached_prompt",model="anthropic/claude-3.5-haiku",purpose="reply"} 500000' in text
+    assert 'recipe_bot_llm_cost_usd_total{model="some/unknown-model",purpose="reply"} 0.75' in text
+
+
+def test_track_stage_records_latency_and_errors():
+    """Test that a stage is observed in the histogram and counted as an error when it raises."""
+    with track_stage("db"):
+        pass
+    with pytest.raises(ValueError):
+        with track_stage("db"):
+            raise ValueError("boom")
+
+    text = render_metrics()
+    assert '# TYPE recipe_bot_stage_seconds histogram' in text
+    assert 'recipe_bot_stage_seconds_bucket{stage="db",le="+Inf"} 2' in text
+    assert 'recipe_bot_stage_seconds_count{stage="db"} 2' in text
+    assert 'recipe_bot_errors_total{stage="db"} 1' in text
@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import patch
+
+import profile_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Fixture to start every test with an empty cache and zeroed stats."""
+    profile_cache.clear_profile_cache()
+    for key in profile_cache.profile_cache_stats:
+        profile_cache.profile_cache_stats[key] = 0
+    yield
+    profile_cache.clear_profile_cache()
+
+
+def make_profile(user_id: int) -> dict:
+    return {"user_id": user_id, "journey_stage": "new_user", "preferences": {}, "interaction_count": 0}
+
+
+def test_cache_hit_returns_copy_and_write_through_updates():
+    """Test that hits are counted, callers get copies, and writers update the cached entry."""
+    profile_cache.cache_profile(1, make_profile(1))
+
+    profile = profile_cache.get_cached_profile(1)
+    profile["preferences"]["likes"] = ["mutated"]
+
+    profile_cache.merge_cached_preferences(1, {"allergies": ["peanuts"]})
+    profile_cache.update_cached_profile(1, interaction_count=5)
+
+    cached = profile_cache.get_cached_profile(1)
+    assert cached["preferences"] == {"allergies": ["peanuts"]}
+    assert cached["interaction_count"] == 5
+    assert profile_cache.get_profile_cache_stats()["hits"] == 2
+
+
+def test_lru_eviction_and_ttl_expiry():
+    """Test that the least recently used entry is evicted and expired entries count as misses."""
+    with patch('profile_cache.PROFILE_CACHE_SIZE', 2):
+        profile_cache.cache_profile(1, make_profile(1))
+        profile_cache.cache_profile(2, make_profile(2))
+        profile_cache.get_cached_profile(1)  # 2 is now least recently used
+        profile_cache.cache_profile(3, make_profile(3))
+
+    assert profile_cache.get_cached_profile(2) is None
+    assert profile_cache.get_profile_cache_stats()["evictions"] == 1
+
+    with patch('profile_cache.PROFILE_CACHE_TTL_SECONDS', -1):
+        assert profile_cache.get_cached_profile(1) is None
+    assert profile_cache.get_profile_cache_stats()["expirations"] == 1
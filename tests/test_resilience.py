@@ -0,0 +1,139 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+import resilience
+from resilience import call_with_fallback, get_resilience_stats
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """Fixture to start every test with closed breakers, no latency samples and no backoff delay."""
+    resilience.reset_resilience_state()
+    with patch('resilience.UPSTREAM_BACKOFF_BASE_MS', 1):
+        yield
+    resilience.reset_resilience_state()
+
+
+def test_transient_errors_are_retried_on_the_same_model():
+    """Test that a timeout is retried with backoff and the retry's result is returned."""
+    calls = []
+
+    async def flaky_call(model):
+        calls.append(model)
+        if len(calls) == 1:
+            raise asyncio.TimeoutError()
+        return "recipe"
+
+    result = asyncio.run(call_with_fallback("test", ["primary", "backup"], flaky_call, hedge=False))
+
+    assert result == ("recipe", "primary")
+    assert calls == ["primary", "primary"]
+    assert get_resilience_stats()["test:primary"]["retries"] == 1
+
+
+def test_open_breaker_skips_model_and_falls_back():
+    """Test that repeated failures open the model's breaker so later calls go straight to the fallback."""
+    calls = []
+
+    async def primary_down(model):
+        calls.append(model)
+        if model == "primary":
+            raise asyncio.TimeoutError()
+        return f"answer from {model}"
+
+    with patch('resilience.CIRCUIT_BREAKER_FAILURES', 2), patch('resilience.UPSTREAM_MAX_RETRIES', 1):
+        first = asyncio.run(call_with_fallback("test", ["primary", "backup"], primary_down, hedge=False))
+        calls.clear()
+        second = asyncio.run(call_with_fallback("test", ["primary", "backup"], primary_down, hedge=False))
+
+    assert first == second == ("answer from backup", "backup")
+    assert calls == ["backup"]
+    assert get_resilience_stats()["test:primary"]["state"] == "open"
+
+
+def test_slow_attempt_is_hedged():
+    """Test that an attempt slower than the observed p95 is raced against a duplicate request."""
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        resilience.record_success("test:primary", 0.01)
+    calls = []
+
+    async def first_call_hangs(model):
+        calls.append(model)
+        await asyncio.sleep(10 if len(calls) == 1 else 0)
+        return len(calls)
+
+    result = asyncio.run(call_with_fallback("test", ["primary"], first_call_hangs, hedge=True))
+
+    assert result == (2, "primary")
+    assert get_resilience_stats()["test:primary"]["hedges"] == 1
+
+
+def test_primary_leads_while_its_breaker_is_closed():
+    """Test that faster fallbacks never overtake a healthy primary, only each other."""
+    for _ in range(resilience.RANKING_MIN_SAMPLES):
+        resilience.record_success("test:primary", 5.0)
+        resilience.record_success("test:slow", 2.0)
+        resilience.record_success("test:fast", 0.5)
+
+    assert resilience.rank_models("test", ["primary", "slow", "fast"]) == ["primary", "fast", "slow"]
+
+    with patch('resilience.CIRCUIT_BREAKER_FAILURES', 1):
+        resilience.record_failure("test:primary")
+
+    assert resilience.rank_models("test", ["primary", "slow", "fast"]) == ["fast", "slow", "primary"]
+
+
+def test_losing_hedged_result_is_discarded():
+    """Test that a hedged attempt completing in the same round as the winner gets released."""
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        resilience.record_success("test:primary", 0.01)
+    release = asyncio.Event()
+    discarded = []
+
+    async def both_finish_together(model):
+        await release.wait()
+        return object()
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def run():
+        call = asyncio.create_task(call_with_fallback("test", ["primary"], both_finish_together, discard_result=discard))
+        while get_resilience_stats()["test:primary"]["hedges"] == 0:
+            await asyncio.sleep(0.01)
+        release.set()
+        result, _ = await call
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return result
+
+    result = asyncio.run(run())
+
+    assert len(discarded) == 1
+    assert discarded[0] is not result
+
+
+def test_failures_of_one_call_kind_do_not_block_another():
+    """Test that an upstream breaker opened by vision errors leaves chat calls on the same upstream alone."""
+    async def rate_limited(model):
+        raise asyncio.TimeoutError()
+
+    async def answer(model):
+        return "recipe"
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(asyncio.TimeoutError):
+                await call_with_fallback("test", ["vision-model"], rate_limited, hedge=False, kind="vision")
+        return await call_with_fallback("test", ["primary"], answer, hedge=False, kind="chat")
+
+    with patch('resilience.CIRCUIT_BREAKER_FAILURES', 2), patch('resilience.UPSTREAM_MAX_RETRIES', 0):
+        result = asyncio.run(scenario())
+
+    stats = get_resilience_stats()
+    assert result == ("recipe", "primary")
+    assert stats["test:vision"]["state"] == "open"
+    assert stats["test:chat"]["state"] == "closed"
+    assert stats["test:chat:primary"]["p50_seconds"] is not None
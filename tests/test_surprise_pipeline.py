@@ -0,0 +1,111 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import surprise_verification
+from surprise_verification import generate_surprising_recipe
+
+PLAIN_RECIPE = """**Ingredients:**
+- chicken breast
+- rice
+"""
+
+SURPRISING_RECIPE = """**Ingredients:**
+- chocolate cake
+- chicken thighs
+- vanilla extract
+
+**Result:** Plot twist! 🎭 Because dessert wanted to be dinner.
+"""
+
+
+def test_first_passing_candidate_wins_and_cancels_the_rest():
+    """Test that candidates run concurrently and the first one passing verification is returned right away."""
+    calls = []
+    cancelled = []
+
+    async def fake_candidate(history, purpose="surprise", max_tokens=None):
+        calls.append(history)
+        call = len(calls)
+        try:
+            await asyncio.sleep({1: 0.01, 2: 0.02, 3: 10}[call])
+        except asyncio.CancelledError:
+            cancelled.append(call)
+            raise
+        return (PLAIN_RECIPE if call == 1 else SURPRISING_RECIPE), 0.001
+
+    with patch('surprise_verification.SURPRISE_CANDIDATES', 3), \
+         patch('surprise_verification.estimate_candidate_cost', lambda history, max_tokens: 0.001), \
+         patch('surprise_verification.generate_candidate', fake_candidate):
+        recipe = asyncio.run(asyncio.wait_for(generate_surprising_recipe(1, [], {}), 1))
+
+    assert recipe == SURPRISING_RECIPE
+    assert cancelled == [3]
+
+
+def test_cost_cap_stops_new_rounds_and_enhancement():
+    """Test that once the spend cap is reached the best candidate so far is returned without more LLM calls."""
+    generate = AsyncMock(return_value=(PLAIN_RECIPE, 0.02))
+    enhance = AsyncMock()
+
+    with patch('surprise_verification.SURPRISE_COST_CAP_USD', 0.05), \
+         patch('surprise_verification.estimate_candidate_cost', lambda history, max_tokens: 0.02), \
+         patch('surprise_verification.generate_candidate', generate), \
+         patch('surprise_verification.enhance_recipe', enhance):
+        recipe = asyncio.run(generate_surprising_recipe(1, [], {}))
+
+    assert recipe == PLAIN_RECIPE
+    assert generate.await_count == 2
+    enhance.assert_not_awaited()
+
+
+def test_first_round_is_budgeted_from_the_estimated_candidate_cost():
+    """Test that the first round only starts the candidates the cap can pay for at the pre-call estimate."""
+    generate = AsyncMock(return_value=(PLAIN_RECIPE, 0.02))
+    enhance = AsyncMock()
+
+    with patch('surprise_verification.SURPRISE_CANDIDATES', 5), \
+         patch('surprise_verification.SURPRISE_COST_CAP_USD', 0.05), \
+         patch('surprise_verification.estimate_candidate_cost', lambda history, max_tokens: 0.02), \
+         patch('surprise_verification.generate_candidate', generate), \
+         patch('surprise_verification.enhance_recipe', enhance):
+        recipe = asyncio.run(generate_surprising_recipe(1, [], {}))
+        first_round_calls = generate.await_count
+        generate.reset_mock()
+        with patch('surprise_verification.estimate_candidate_cost', lambda history, max_tokens: 0.06):
+            too_expensive = asyncio.run(generate_surprising_recipe(1, [], {}))
+
+    assert recipe == PLAIN_RECIPE
+    assert first_round_calls == 2
+    assert too_expensive is None
+    generate.assert_not_awaited()
+    enhance.assert_not_awaited()
+
+
+def test_candidate_cost_estimate_covers_a_full_completion():
+    """Test that the pre-call estimate prices a full max_tokens completion at the costliest model in the chain."""
+    from llm_client import estimate_candidate_cost
+
+    pricing = {"cheap": {"prompt": 1.0, "completion": 1.0}, "pricey": {"prompt": 2.0, "completion": 10.0}}
+    with patch('llm_client.get_llm_models', lambda: ["cheap", "pricey"]), \
+         patch('llm_client.get_model_price', pricing.get), \
+         patch('llm_client.SYSTEM_PROMPT', ""):
+        cost = estimate_candidate_cost([{"role": "user", "content": "x" * 4000}], max_tokens=1000)
+
+    assert cost == (1000 * 2.0 + 1000 * 10.0) / 1_000_000
+
+
+def test_default_budget_runs_several_bounded_candidates_and_enhances():
+    """Test that with default pricing and cap a round starts every candidate, each bounded by SURPRISE_MAX_TOKENS."""
+    generate = AsyncMock(return_value=(PLAIN_RECIPE, 0.005))
+    enhance = AsyncMock(return_value=("Enhanced recipe", 0.005))
+
+    with patch('surprise_verification.SURPRISE_CANDIDATES', 3), \
+         patch('surprise_verification.SURPRISE_MAX_ROUNDS', 1), \
+         patch('surprise_verification.generate_candidate', generate), \
+         patch('surprise_verification.enhance_recipe', enhance):
+        recipe = asyncio.run(generate_surprising_recipe(1, [{"role": "user", "content": "I have eggs"}], {}))
+
+    assert recipe == "Enhanced recipe"
+    assert generate.await_count == 3
+    assert generate.await_args.kwargs["max_tokens"] == surprise_verification.SURPRISE_MAX_TOKENS
+    enhance.assert_awaited_once()
@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+from PIL import Image, ImageDraw
+from unittest.mock import patch
+
+import vision_cache
+from database import init_db, save_vision_cache_entry, load_vision_cache_entries
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """Fixture to start every test with an empty cache and zeroed stats."""
+    vision_cache.clear_vision_cache()
+    for key in vision_cache.vision_cache_stats:
+        vision_cache.vision_cache_stats[key] = 0
+    yield
+    vision_cache.clear_vision_cache()
+
+
+def make_photo(offset: int = 0, brightness: int = 0) -> Image.Image:
+    image = Image.linear_gradient("L").resize((512, 384)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((100 + offset, 80, 300 + offset, 280), fill=(200, 40, 40))
+    return image.point(lambda value: min(255, value + brightness))
+
+
+def test_near_duplicate_photo_hits_cache_and_different_photo_misses():
+    """Test that a re-encoded, slightly brighter photo matches by hash while an unrelated one does not."""
+    original = vision_cache.compute_dhash(make_photo())
+    near_duplicate = vision_cache.compute_dhash(make_photo(brightness=10).resize((500, 375)))
+    unrelated = vision_cache.compute_dhash(Image.effect_noise((512, 384), 80).convert("RGB"))
+    vision_cache.store(original, ["tomatoes", "basil"], "file-a")
+
+    assert vision_cache.hamming_distance(original, near_duplicate) <= vision_cache.VISION_CACHE_MAX_DISTANCE
+    assert vision_cache.get_by_phash(near_duplicate, "file-b") == ["tomatoes", "basil"]
+    assert vision_cache.get_by_file_id("file-b") == ["tomatoes", "basil"]
+    assert vision_cache.get_by_phash(unrelated) is None
+    assert vision_cache.get_vision_cache_stats() == {
+        "file_id_hits": 1, "phash_hits": 1, "misses": 1, "evictions": 0, "entries": 1
+    }
+
+
+def test_lru_eviction_drops_oldest_photos_from_every_index():
+    """Test that entries beyond the cache size are evicted and no longer found by file id or hash."""
+    with patch('vision_cache.VISION_CACHE_SIZE', 2), patch('vision_cache.VISION_CACHE_MAX_DISTANCE', 0):
+        for index, phash in enumerate([0x0F, 0xF0, 0xFF00]):
+            vision_cache.store(phash, [f"item{index}"], f"file-{index}")
+
+        assert vision_cache.get_by_file_id("file-0") is None
+        assert vision_cache.get_by_phash(0x0F) is None
+        assert vision_cache.get_by_phash(0xFF00) == ["item2"]
+        assert vision_cache.get_vision_cache_stats()["evictions"] == 1
+
+
+def test_persisted_entries_are_pruned_to_limit():
+    """Test that the vision cache table keeps only the newest rows when reloaded."""
+    conn = sqlite3.connect(':memory:')
+    init_db(conn=conn)
+    for index in range(3):
+        save_vision_cache_entry(f"file-{index}", f"{index:016x}", [f"item{index}"], conn=conn)
+
+    entries = load_vision_cache_entries(2, conn=conn)
+
+    assert [entry["file_unique_id"] for entry in entries] == ["file-1", "file-2"]
+    assert entries[1]["ingredients"] == ["item2"]
+    assert conn.execute("SELECT COUNT(*) FROM vision_cache").fetchone()[0] == 2
+    conn.close()
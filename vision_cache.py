@@ -0,0 +1,157 @@
+"""
+Cache of vision-model ingredient lists for repeated and near-duplicate photos.
+Exact re-sends are found by Telegram's file_unique_id before anything is downloaded; other
+photos by a 64-bit difference hash (dHash) of the thumbnail, searched within a Hamming
+distance through a BK-tree. Entries are LRU-bounded and optionally persisted in SQLite.
+"""
+import logging
+from collections import OrderedDict
+
+from PIL import Image
+
+from config import VISION_CACHE_SIZE, VISION_CACHE_MAX_DISTANCE, VISION_CACHE_PERSIST
+from metrics import inc_counter
+
+DHASH_SIZE = 8
+
+# phash -> ingredient list; most recently used entries at the end
+_entries = OrderedDict()
+# file_unique_id -> phash
+_file_ids = {}
+# BK-tree over phashes: node = {"hash": int, "children": {distance: node}}.
+# Evicted hashes stay in the tree until the next rebuild and are skipped on lookup.
+_bk_tree = {"root": None, "size": 0}
+vision_cache_stats = {"file_id_hits": 0, "phash_hits": 0, "misses": 0, "evictions": 0}
+
+
+def compute_dhash(image: Image.Image) -> int:
+    """64-bit difference hash: whether each pixel of a 9x8 grayscale version is brighter than its right neighbour."""
+    pixels = image.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.Resampling.BILINEAR).tobytes()
+    dhash = 0
+    for row in range(DHASH_SIZE):
+        for column in range(DHASH_SIZE):
+            left = pixels[row * (DHASH_SIZE + 1) + column]
+            dhash = (dhash << 1) | (left > pixels[row * (DHASH_SIZE + 1) + column + 1])
+    return dhash
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+def _bk_insert(phash: int):
+    node = _bk_tree["root"]
+    _bk_tree["size"] += 1
+    if node is None:
+        _bk_tree["root"] = {"hash": phash, "children": {}}
+        return
+    while True:
+        distance = hamming_distance(phash, node["hash"])
+        if distance == 0:
+            return
+        child = node["children"].get(distance)
+        if child is None:
+            node["children"][distance] = {"hash": phash, "children": {}}
+            return
+        node = child
+
+
+def _bk_search(phash: int, max_distance: int) -> tuple[int, int] | None:
+    """Closest live hash within max_distance as (distance, hash), or None."""
+    best = None
+    pending = [_bk_tree["root"]] if _bk_tree["root"] else []
+    while pending:
+        node = pending.pop()
+        distance = hamming_distance(phash, node["hash"])
+        if distance <= max_distance and node["hash"] in _entries and (best is None or distance < best[0]):
+            best = (distance, node["hash"])
+        # Triangle inequality: only subtrees at distance d +- max_distance can hold matches
+        for child_distance, child in node["children"].items():
+            if distance - max_distance <= child_distance <= distance + max_distance:
+                pending.append(child)
+    return best
+
+
+def _rebuild_bk_tree():
+    _bk_tree["root"] = None
+    _bk_tree["size"] = 0
+    for phash in _entries:
+        _bk_insert(phash)
+
+
+def get_by_file_id(file_unique_id: str) -> list[str] | None:
+    """Ingredients cached for this exact Telegram file, or None."""
+    phash = _file_ids.get(file_unique_id)
+    if phash is None or phash not in _entries:
+        return None
+    _entries.move_to_end(phash)
+    vision_cache_stats["file_id_hits"] += 1
+    inc_counter("recipe_bot_vision_cache_total", "Vision cache lookups by result", result="file_id_hit")
+    return list(_entries[phash])
+
+
+def get_by_phash(phash: int, file_unique_id: str | None = None) -> list[str] | None:
+    """Ingredients cached for a photo within VISION_CACHE_MAX_DISTANCE of this hash, or None."""
+    match = _bk_search(phash, VISION_CACHE_MAX_DISTANCE)
+    if match is None:
+        vision_cache_stats["misses"] += 1
+        inc_counter("recipe_bot_vision_cache_total", "Vision cache lookups by result", result="miss")
+        return None
+    distance, cached_hash = match
+    _entries.move_to_end(cached_hash)
+    if file_unique_id:
+        _file_ids[file_unique_id] = cached_hash
+    vision_cache_stats["phash_hits"] += 1
+    inc_counter("recipe_bot_vision_cache_total", "Vision cache lookups by result", result="phash_hit")
+    logging.info(f"VISION_CACHE near-duplicate hit distance={distance}")
+    return list(_entries[cached_hash])
+
+
+def store(phash: int, ingredients: list[str], file_unique_id: str | None = None):
+    """Caches a vision result, evicting the least recently used photos beyond VISION_CACHE_SIZE."""
+    if phash not in _entries:
+        _bk_insert(phash)
+    _entries[phash] = list(ingredients)
+    _entries.move_to_end(phash)
+    if file_unique_id:
+        _file_ids[file_unique_id] = phash
+
+    while len(_entries) > VISION_CACHE_SIZE:
+        evicted_hash, _ = _entries.popitem(last=False)
+        vision_cache_stats["evictions"] += 1
+        for file_id in [file_id for file_id, value in _file_ids.items() if value == evicted_hash]:
+            del _file_ids[file_id]
+    if _bk_tree["size"] > 2 * max(len(_entries), 1):
+        _rebuild_bk_tree()
+
+
+async def remember(phash: int, ingredients: list[str], file_unique_id: str | None = None):
+    """Caches a vision result and, with VISION_CACHE_PERSIST, saves it to the database."""
+    store(phash, ingredients, file_unique_id)
+    if VISION_CACHE_PERSIST and file_unique_id:
+        # Imported here so the cache itself stays usable without the storage layer
+        from async_database import save_vision_cache_entry
+        await save_vision_cache_entry(file_unique_id, f"{phash:016x}", ingredients)
+
+
+async def load_vision_cache():
+    """Fills the cache from the database at startup when VISION_CACHE_PERSIST is on."""
+    if not VISION_CACHE_PERSIST:
+        return
+    from async_database import load_vision_cache_entries
+    entries = await load_vision_cache_entries(VISION_CACHE_SIZE)
+    for entry in entries:
+        store(int(entry["phash"], 16), entry["ingredients"], entry["file_unique_id"])
+    logging.info(f"Loaded {len(entries)} vision cache entries")
+
+
+def clear_vision_cache():
+    _entries.clear()
+    _file_ids.clear()
+    _bk_tree["root"] = None
+    _bk_tree["size"] = 0
+
+
+def get_vision_cache_stats() -> dict:
+    """Returns hit/miss/eviction counters and the current entry count."""
+    return {**vision_cache_stats, "entries": len(_entries)}